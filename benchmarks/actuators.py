@@ -0,0 +1,43 @@
+"""
+How long does booting a building take, once every switch has to reach a
+gateway? One round trip per appliance vs batched.
+
+    python benchmarks/actuators.py [floors]
+"""
+
+import sys
+import time
+
+from buildings import make_building
+from prana.actuators import ActuatorDriver, MockGateway
+
+# Sub corridors per floor
+SUB_CORRIDORS = 20
+
+
+def boot(gateway, floors, **options):
+    """
+    Seconds to boot (& get every command through to the gateway)
+    """
+    b = make_building(floors, SUB_CORRIDORS + 1)
+    driver = ActuatorDriver(gateway.transport(), **options)
+    b.add_actuator(driver)
+    start = time.perf_counter()
+    b.boot()
+    driver.close()
+    return time.perf_counter() - start, driver
+
+
+def main(floors=20):
+    with MockGateway() as gateway:
+        one_by_one, driver = boot(gateway, floors, flush_size=1)
+        batched, driver = boot(gateway, floors)
+    print("Commands:    %d" % driver.sent)
+    print("One by one:  %.3fs (%d round trips)" % (
+        one_by_one, driver.sent))
+    print("Batched:     %.3fs (%d round trips)" % (batched, driver.batches))
+    return dict(one_by_one=one_by_one, batched=batched)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,40 @@
+"""
+The synthetic buildings every benchmark lays out: A main corridor & the
+rest sub corridors on every floor, each with ACs & lights in turns & a
+motion sensor.
+"""
+
+from prana.enums import ApplianceCategory, CorridorCategory, SensorCategory
+from prana.models import Building
+
+
+def spec(floors, corridors, appliances=2):
+    corridor = dict(
+        appliances=['AC', 'LIGHT'] * (appliances // 2) +
+        ['AC'] * (appliances % 2),
+        sensors=['MOTION'])
+    return dict(
+        layouts=dict(standard=[
+            dict(corridor, category='MAIN'),
+            dict(corridor, category='SUB', count=corridors - 1)]),
+        floors=[dict(ids='0-%d' % (floors - 1), layout='standard')])
+
+
+def make_building(floors, corridors, appliances=2):
+    return Building.from_spec(spec(floors, corridors, appliances))
+
+
+def by_appending(floors, corridors):
+    """
+    The same building as `make_building`, one append at a time
+    """
+    b = Building()
+    for floor_id in range(floors):
+        floor = b.add_floor(floor_id)
+        for category in [CorridorCategory.MAIN] + \
+                [CorridorCategory.SUB] * (corridors - 1):
+            corridor = floor.append_corridor(category)
+            corridor.append_appliance(ApplianceCategory.AC)
+            corridor.append_appliance(ApplianceCategory.LIGHT)
+            corridor.append_sensor(SensorCategory.MOTION)
+    return b
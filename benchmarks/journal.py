@@ -0,0 +1,46 @@
+"""
+How long does a large building take to come back after a crash?
+
+    python benchmarks/journal.py [floors] [corridors] [events]
+"""
+
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from buildings import make_building
+from prana.journal import Journal
+
+
+def main(floors=100, corridors=200, events=20000):
+    path = tempfile.mkdtemp()
+    try:
+        b = make_building(floors, corridors)
+        journal = Journal(path)
+        journal.recover(b)
+        b.boot()
+        journal.snapshot(b)
+        start = time.perf_counter()
+        for _ in range(events):
+            b.register_activity(
+                random.randrange(floors), random.randrange(corridors), 0)
+        journal.commit()
+        logged = time.perf_counter() - start
+        journal.close()
+
+        recovered = make_building(floors, corridors)
+        start = time.perf_counter()
+        records = Journal(path, sync_interval=None).recover(recovered)
+        recovery = time.perf_counter() - start
+        assert recovered.snapshot() == b.snapshot()
+    finally:
+        shutil.rmtree(path)
+    print("Events logged:  %d in %.3fs" % (events, logged))
+    print("Recovery:       %.3fs (%d records)" % (recovery, records))
+    return dict(logged=logged, recovery=recovery, records=records)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
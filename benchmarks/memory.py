@@ -0,0 +1,56 @@
+"""
+How many bytes does each appliance (& sensor & corridor) cost us?
+
+    python benchmarks/memory.py [count]
+"""
+
+import sys
+import tracemalloc
+
+from prana.enums import ApplianceCategory, CorridorCategory, SensorCategory
+from prana.models import Floor
+
+# Appliances (& sensors) per corridor
+PER_CORRIDOR = 10
+
+
+def bytes_per(count, add):
+    """
+    Average bytes allocated by calling `add` `count` times
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(count):
+        add()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def main(count=100000):
+    floor = Floor(0)
+    corridors = [
+        floor.append_corridor(CorridorCategory.SUB)
+        for _ in range(count // PER_CORRIDOR)]
+
+    def adder(add):
+        # Round robin over the corridors
+        items = iter(corridors * PER_CORRIDOR)
+        return lambda: add(next(items))
+
+    appliance = bytes_per(count, adder(
+        lambda c: c.append_appliance(ApplianceCategory.AC)))
+    sensor = bytes_per(count, adder(
+        lambda c: c.append_sensor(SensorCategory.MOTION)))
+    floor = Floor(1)
+    corridor = bytes_per(
+        count // PER_CORRIDOR,
+        lambda: floor.append_corridor(CorridorCategory.SUB))
+    print("Bytes per appliance: %.1f" % appliance)
+    print("Bytes per sensor:    %.1f" % sensor)
+    print("Bytes per corridor:  %.1f" % corridor)
+    return dict(appliance=appliance, sensor=sensor, corridor=corridor)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+"""
+Building a large building appliance by appliance vs attaching to a
+snapshot of it
+
+    python benchmarks/snapshot.py [floors] [corridors]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from buildings import make_building
+from prana.snapshot import dump, load
+
+
+def main(floors=500, corridors=200):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'building')
+    try:
+        start = time.perf_counter()
+        b = make_building(floors, corridors)
+        b.boot()
+        built = time.perf_counter() - start
+        # Somebody is around on a few floors
+        for floor_id in range(0, floors, 50):
+            b.register_activity(floor_id, 1, 0)
+        dump(b, path)
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        loaded = load(path)
+        attached = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded.map_floors()
+        mapped = time.perf_counter() - start
+        assert loaded.snapshot() == b.snapshot()
+        loaded.close()
+    finally:
+        shutil.rmtree(directory)
+    print("Appliances:    %d (%d bytes of snapshot)" % (
+        floors * corridors * 2, size))
+    print("Built & boot:  %.3fs" % built)
+    print("Attach:        %.3fs" % attached)
+    print("Rest of it:    %.3fs" % mapped)
+    return dict(built=built, attached=attached, mapped=mapped)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
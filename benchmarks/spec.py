@@ -0,0 +1,33 @@
+"""
+Laying out a building from a spec vs one append at a time
+
+    python benchmarks/spec.py [floors] [corridors per floor]
+"""
+
+import sys
+import time
+
+from buildings import by_appending, spec
+from prana.models import Building
+
+
+def best_of(runs, build, *args):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        build(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(floors=80, corridors=63):
+    appending = best_of(5, by_appending, floors, corridors)
+    from_spec = best_of(5, Building.from_spec, spec(floors, corridors))
+    print("Corridors:     %d" % (floors * corridors))
+    print("Appending:     %.1fms" % (appending * 1000))
+    print("From spec:     %.1fms" % (from_spec * 1000))
+    return dict(appending=appending, from_spec=from_spec)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
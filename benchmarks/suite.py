@@ -0,0 +1,404 @@
+"""
+Benchmarks of the model hot paths, on synthetic buildings of growing size.
+
+For every scenario (floors x corridors x appliances per corridor) it
+reports throughput & latency percentiles of each operation, along with
+peak memory while laying the building out.
+
+    python benchmarks/suite.py                      # Just run it
+    python benchmarks/suite.py --save FILE          # & keep the results
+    python benchmarks/suite.py --baseline FILE      # & compare
+    python benchmarks/suite.py --reference REV      # & compare with REV
+    python benchmarks/suite.py --reference base     # & with the branch point
+
+Compared to a baseline, an operation that got slower than the tolerance
+allows (or a scenario that takes more memory) is a regression, & the
+exit status says so.
+
+Results are only comparable on the same machine, at about the same time.
+`--reference` takes care of both: The package as of a git revision is
+checked out on the side, & the suite runs against it & the working tree
+in turns (`--runs` times each). A regression is the working tree at it's
+best doing worse than the reference at it's worst, so the spread between
+runs of the same code doesn't count.
+
+That's what `make bench` does, against `base`: Where the branch left
+main, so everything on the branch (committed or not) gets measured. On
+main itself with nothing changed, a clean checkout or CI after a merge,
+that would be the same code on both sides, so it's the commit before
+instead. `make bench REF=HEAD` just measures what isn't committed yet.
+To keep it to about a minute, `make bench` skips the biggest scenario
+(`MAX_FLOORS=` to run them all).
+
+Saved results (`make bench-baseline` keeps `benchmarks/baseline.json`) are
+there to look back on. Every run times a fixed bit of plain Python
+(`calibrate`), & the baseline's throughput is scaled by how much faster
+or slower that went. Still, a baseline from another kind of machine (CPU,
+core count or Python) only gets warnings rather than a failing exit
+status, unless `--strict`.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from buildings import spec
+from prana.clock import ManualClock, use_clock
+from prana.enums import CorridorCategory
+from prana.models import Building
+
+SCENARIOS = [
+    dict(floors=1, corridors=10, appliances=2),
+    dict(floors=100, corridors=10, appliances=2),
+    dict(floors=100, corridors=100, appliances=2),
+    dict(floors=1000, corridors=10, appliances=4),
+    dict(floors=10000, corridors=10, appliances=2),
+]
+
+# Calls of each operation per scenario. Operations on the whole building
+# get fewer as it grows.
+CALLS = 2000
+BUILDING_WORK = 200000
+
+
+def name(scenario):
+    return '%(floors)dx%(corridors)dx%(appliances)d' % scenario
+
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+
+def measure(calls, operation, rounds=5):
+    """
+    Call `operation(index)` `calls` times, timing each call. The median of
+    a few rounds counts, which keeps the noise of a busy machine down (a
+    round that got lucky doesn't set the bar either).
+    """
+    measured = []
+    for _ in range(rounds):
+        timings = []
+        gc.collect()
+        start = time.perf_counter()
+        for index in range(calls):
+            before = time.perf_counter()
+            operation(index)
+            timings.append(time.perf_counter() - before)
+        measured.append((time.perf_counter() - start, timings))
+    measured.sort(key=lambda round: round[0])
+    total, timings = measured[len(measured) // 2]
+    timings.sort()
+    return dict(
+        calls=calls,
+        ops_per_sec=calls / total,
+        p50_us=percentile(timings, 0.50) * 1e6,
+        p95_us=percentile(timings, 0.95) * 1e6,
+        p99_us=percentile(timings, 0.99) * 1e6,
+    )
+
+
+def calibrate(rounds=5):
+    """
+    Loops per second of a fixed bit of plain Python, on this machine as it
+    is right now
+    """
+    def work(index):
+        total = 0
+        for number in range(1000):
+            total += number % 7
+        return total
+    return measure(200, work, rounds)['ops_per_sec']
+
+
+def machine():
+    """
+    What the results were taken on. Only the calibration may differ
+    between runs that can be compared.
+    """
+    return dict(
+        processor=platform.machine(),
+        cpus=os.cpu_count(),
+        python='%s %s' % (
+            platform.python_implementation(), platform.python_version()),
+        calibration=calibrate())
+
+
+def run_scenario(scenario, seed=0):
+    floors, corridors = scenario['floors'], scenario['corridors']
+    building_spec = spec(**scenario)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    b = Building.from_spec(building_spec)
+    build = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    rng = random.Random(seed)
+    clock = ManualClock(0)
+    results = dict(build_s=build, peak_bytes=peak, operations={})
+    whole = max(5, min(CALLS, BUILDING_WORK // (floors * corridors)))
+    with use_clock(clock):
+        b.reset()
+        events = [
+            (rng.randrange(floors), rng.randrange(corridors))
+            for _ in range(CALLS)]
+
+        def register_activity(index):
+            clock.advance(0.01)
+            floor_id, corridor_id = events[index]
+            b.register_activity(floor_id, corridor_id, 0)
+
+        floor_list = b.list_floors()
+        picks = [rng.choice(floor_list) for _ in range(CALLS)]
+
+        def filtered_components(index):
+            for corridor in picks[index].filtered_corridors(
+                    CorridorCategory.SUB):
+                pass
+
+        operations = results['operations']
+        operations['register_activity'] = measure(CALLS, register_activity)
+        operations['optimize'] = measure(
+            whole, lambda index: b.optimize(full=True))
+        operations['refresh'] = measure(
+            whole, lambda index: b.refresh(full=True))
+        operations['floor_current_watts'] = measure(
+            CALLS, lambda index: picks[index].current_watts())
+        operations['filtered_components'] = measure(
+            CALLS, filtered_components)
+    return results
+
+
+def run(scenarios, seed=0):
+    results = dict(machine=machine(), scenarios={})
+    for scenario in scenarios:
+        numbers = run_scenario(scenario, seed)
+        results['scenarios'][name(scenario)] = numbers
+        report(name(scenario), numbers)
+    # Whichever went faster, the box may have been busy for one of them
+    results['machine']['calibration'] = max(
+        results['machine']['calibration'], calibrate())
+    return results
+
+
+def report(scenario, results):
+    print('%s: built in %.3fs, peak %.1fMB' % (
+        scenario, results['build_s'], results['peak_bytes'] / 2 ** 20))
+    for operation, numbers in results['operations'].items():
+        print(
+            '    %-20s %12.0f ops/s  p50 %9.1fus  p95 %9.1fus  '
+            'p99 %9.1fus' % (
+                operation, numbers['ops_per_sec'], numbers['p50_us'],
+                numbers['p95_us'], numbers['p99_us']))
+
+
+def same_machine(results, baseline):
+    """
+    Were `baseline` & `results` taken on the same kind of machine?
+    """
+    was = dict(baseline.get('machine', {}))
+    now = dict(results['machine'])
+    was.pop('calibration', None)
+    now.pop('calibration', None)
+    return was == now
+
+
+def compare(results, baseline, tolerance, calibrated=True):
+    """
+    Regressions against `baseline`, as a list of messages. Throughput is
+    compared after making up for the difference in calibration, if
+    `calibrated`.
+    """
+    regressions = []
+    scale = 1
+    calibration = baseline.get('machine', {}).get('calibration')
+    if calibrated and calibration:
+        scale = results['machine']['calibration'] / calibration
+    for scenario, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if before is None:
+            continue
+        if current['peak_bytes'] > before['peak_bytes'] * (1 + tolerance):
+            regressions.append('%s: peak memory %d => %d bytes' % (
+                scenario, before['peak_bytes'], current['peak_bytes']))
+        for operation, numbers in current['operations'].items():
+            was = before['operations'].get(operation)
+            if was is None:
+                continue
+            expected = was['ops_per_sec'] * scale
+            if numbers['ops_per_sec'] < expected * (1 - tolerance):
+                regressions.append('%s %s: %.0f => %.0f ops/s' % (
+                    scenario, operation, expected, numbers['ops_per_sec']))
+    return regressions
+
+
+def merge(runs, best=True):
+    """
+    Several runs of the same scenarios in one: The best of each number, or
+    the worst
+    """
+    better, worse = (max, min) if best else (min, max)
+    merged = dict(machine=dict(runs[0]['machine']), scenarios={})
+    merged['machine']['calibration'] = better(
+        run['machine']['calibration'] for run in runs)
+    for scenario in runs[0]['scenarios']:
+        numbers = [run['scenarios'][scenario] for run in runs]
+        operations = {}
+        for operation in numbers[0]['operations']:
+            operations[operation] = better(
+                (each['operations'][operation] for each in numbers),
+                key=lambda each: each['ops_per_sec'])
+        merged['scenarios'][scenario] = dict(
+            build_s=worse(each['build_s'] for each in numbers),
+            peak_bytes=worse(each['peak_bytes'] for each in numbers),
+            operations=operations)
+    return merged
+
+
+def run_against(tree, options, label):
+    """
+    Run the suite (this one) in a process of it's own, against the package
+    in `tree`
+    """
+    print('== %s' % label)
+    sys.stdout.flush()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'results.json')
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--save', path] +
+            options, env=dict(os.environ, PYTHONPATH=tree), check=True)
+        with open(path) as source:
+            return json.load(source)
+
+
+def branch_point(root):
+    """
+    The revision `--reference base` stands for: Where HEAD left main, or
+    the commit before if that's HEAD & nothing in the package has changed
+    """
+    def git(*args):
+        return subprocess.run(
+            ['git'] + list(args), cwd=root, capture_output=True, text=True)
+
+    head = git('rev-parse', 'HEAD').stdout.strip()
+    base = head
+    for main in ('origin/main', 'main', 'origin/master', 'master'):
+        found = git('merge-base', 'HEAD', main)
+        if found.returncode == 0:
+            base = found.stdout.strip()
+            break
+    if base == head and not git('status', '--porcelain', 'prana').stdout:
+        return 'HEAD~1'
+    return base
+
+
+def against_reference(revision, options, runs):
+    """
+    Runs of `revision` & of the working tree, taken in turns. Returns
+    (reference runs, runs).
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    reference, results = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, 'reference')
+        subprocess.run(
+            ['git', 'worktree', 'add', '--detach', '--quiet', tree,
+             revision], cwd=root, check=True)
+        try:
+            for _ in range(runs):
+                reference.append(run_against(tree, options, revision))
+                results.append(run_against(root, options, 'working tree'))
+        finally:
+            subprocess.run(
+                ['git', 'worktree', 'remove', '--force', tree], cwd=root,
+                check=True)
+    return reference, results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with results in here')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='how much worse than the baseline is still fine (0.25)')
+    parser.add_argument(
+        '--reference',
+        help='compare with the package as of this git revision, run here '
+        '(base: where the branch left main)')
+    parser.add_argument(
+        '--runs', type=int, default=2,
+        help='runs of each, with --reference (2)')
+    parser.add_argument(
+        '--max-floors', type=int, default=None,
+        help='skip scenarios with more floors than this')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--strict', action='store_true',
+        help='fail on regressions even against another kind of machine')
+    args = parser.parse_args(args)
+
+    if args.reference == 'base':
+        args.reference = branch_point(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if args.reference:
+        options = ['--seed', str(args.seed)]
+        if args.max_floors is not None:
+            options += ['--max-floors', str(args.max_floors)]
+        reference, results = against_reference(
+            args.reference, options, args.runs)
+        # However far apart the runs of the same code are is noise: The
+        # working tree's best has to fall short of the reference's worst
+        # to count.
+        reference = merge(reference, best=False)
+        results = merge(results)
+    else:
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if args.max_floors is None or
+            scenario['floors'] <= args.max_floors]
+        results = run(scenarios, args.seed)
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        regressions = compare(results, baseline, args.tolerance)
+        if not same_machine(results, baseline) and not args.strict:
+            print('WARNING: %s was taken on another machine (%s), this is '
+                  '%s. Save a baseline here to gate against.' % (
+                      args.baseline, baseline.get('machine'),
+                      results['machine']))
+            for regression in regressions:
+                print('WARNING: %s' % regression)
+            return 0
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            return 1
+        print('No regressions against %s' % args.baseline)
+    if args.reference:
+        # Same machine, same time: Nothing to make up for, calibrating
+        # would only add noise of it's own
+        regressions = compare(
+            results, reference, args.tolerance, calibrated=False)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            return 1
+        print('No regressions against %s' % args.reference)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
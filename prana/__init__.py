@@ -17,6 +17,51 @@ Models
     :show-inheritance:
 
 
+Actuators
+=========
+
+.. automodule:: prana.actuators
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Budget
+======
+
+.. automodule:: prana.budget
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Changes
+=======
+
+.. automodule:: prana.changes
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Clock
+=====
+
+.. automodule:: prana.clock
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Columnar
+========
+
+.. automodule:: prana.columnar
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
 Constants
 =========
 
@@ -26,6 +71,87 @@ Constants
     :show-inheritance:
 
 
+Energy
+======
+
+.. automodule:: prana.energy
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Journal
+=======
+
+.. automodule:: prana.journal
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Metrics
+=======
+
+.. automodule:: prana.metrics
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Runtime
+=======
+
+.. automodule:: prana.runtime
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Sharding
+========
+
+.. automodule:: prana.sharding
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Shedding
+========
+
+.. automodule:: prana.shedding
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Simulator
+=========
+
+.. automodule:: prana.simulator
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Snapshot
+========
+
+.. automodule:: prana.snapshot
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
+Tracing
+=======
+
+.. automodule:: prana.tracing
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+
 Enums
 =====
 
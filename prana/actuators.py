@@ -0,0 +1,409 @@
+"""
+Actuators
+
+Switching an appliance only flips a status in memory. `ActuatorDriver`
+gets those switches out to the relay gateways, without paying a round trip
+per appliance:
+
+* Commands are batched per gateway. A batch goes out when it has
+  `flush_size` commands, or when it has waited `flush_interval` seconds.
+* Batches go over pooled connections (`ConnectionPool`), up to
+  `pool_size` at a time to each gateway. A batch only goes out alongside
+  the ones before it when they have no appliance in common, so a newer
+  command never overtakes an older one for the same appliance.
+* A batch that fails is retried, backing off a little more each time.
+  Commands that a newer one (for the same appliance) took over from in the
+  meanwhile are left out of the retry. Until a batch is through, it's
+  commands are counted as in flight.
+
+Hook it up with `Building.add_actuator(driver)`.
+
+How bytes reach a gateway is up to the transport. Anything with a
+`connect()` that gives back a connection with `send(commands)` & `close()`
+will do. `TcpTransport` speaks a line protocol: One command per line
+(`floor corridor appliance status`), a blank line to end the batch, and
+the gateway answers `ok`. `MockGateway` is the other end of it, for tests
+& benchmarks.
+"""
+
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from prana.models import Transition
+
+
+class GatewayError(Exception):
+    """
+    The gateway did not take the batch
+    """
+
+
+class TcpConnection:
+    """
+    One connection to a gateway
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def send(self, commands):
+        lines = [
+            '%d %d %d %d\n' % (c.floor, c.corridor, c.appliance, c.new)
+            for c in commands]
+        lines.append('\n')
+        self.sock.sendall(''.join(lines).encode())
+        answer = self.reader.readline().strip()
+        if answer != b'ok':
+            raise GatewayError(answer.decode() or 'Connection closed')
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class TcpTransport:
+    """
+    Connects to a gateway at (host, port)
+    """
+
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+
+    def connect(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return TcpConnection(sock)
+
+
+class ConnectionPool:
+    """
+    At most `size` connections to one gateway. Connections are made as
+    needed & kept around for the next batch.
+    """
+
+    def __init__(self, transport, size=2):
+        self.transport = transport
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection. If anything goes wrong with it, it is thrown
+        away rather than given back.
+        """
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self.transport.connect()
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def by_floor(transition):
+    """
+    Default route: Every floor has a gateway of it's own
+    """
+    return transition.floor
+
+
+class ActuatorDriver:
+    """
+    Sends `Transition`s to the gateways, batched.
+
+    `gateways` maps a key to a transport, & `route(transition)` picks the
+    key for each transition (the floor, unless told otherwise). A single
+    transport gets everything.
+    """
+
+    def __init__(
+            self, gateways, route=by_floor, flush_size=64,
+            flush_interval=0.01, pool_size=2, retries=3, backoff=0.05,
+            on_error=None):
+        if not isinstance(gateways, dict):
+            gateways = {None: gateways}
+            route = None
+        self.pools = {
+            key: ConnectionPool(transport, pool_size)
+            for key, transport in gateways.items()}
+        self.route = route
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.backoff = backoff
+        # Called with (key, commands, exception) once a batch gives up
+        self.on_error = on_error
+        # Gateway key => (floor, corridor, appliance) => Transition
+        self._pending = {key: OrderedDict() for key in gateways}
+        # Gateway key => batches taken, waiting for a connection (or for
+        # one before them with the same appliances to be through)
+        self._ready = {key: deque() for key in gateways}
+        # Gateway key => (floor, corridor, appliance) of the batches on
+        # their way
+        self._busy = {key: set() for key in gateways}
+        # Gateway key => threads sending to it
+        self._senders = dict.fromkeys(gateways, 0)
+        self.pool_size = pool_size
+        # (floor, corridor, appliance) => latest command taken for sending
+        self._in_flight = {}
+        self.in_flight = 0
+        self.sent = 0
+        self.batches = 0
+        self.failed = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(len(gateways) * pool_size)
+        self._closed = False
+        self._flusher = threading.Thread(target=self._run, daemon=True)
+        self._flusher.start()
+
+    def __call__(self, transitions):
+        with self._condition:
+            full = False
+            for transition in transitions:
+                key = None if self.route is None else self.route(transition)
+                pending = self._pending[key]
+                switch = transition[:3]
+                queued = pending.pop(switch, None)
+                if queued is not None:
+                    # Not sent yet. Send where it ends up, if anywhere.
+                    if queued.old == transition.new:
+                        continue
+                    transition = Transition(
+                        *switch, queued.old, transition.new)
+                pending[switch] = transition
+                full = full or len(pending) >= self.flush_size
+            if full:
+                self._condition.notify()
+
+    def pending(self):
+        """
+        Commands waiting to go out, not counting those in flight
+        """
+        with self._condition:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def _take(self, full_only):
+        """
+        Batches of (at most) `flush_size` commands that are ready to go.
+        Whatever does not fill a batch stays, if `full_only`.
+        """
+        batches = []
+        size = self.flush_size
+        for key, pending in self._pending.items():
+            commands = list(pending.values())
+            keep = len(commands) % size if full_only else 0
+            for start in range(0, len(commands) - keep, size):
+                batches.append((key, commands[start:start + size]))
+            self._pending[key] = OrderedDict(
+                (command[:3], command)
+                for command in commands[len(commands) - keep:])
+        self.in_flight += sum(len(commands) for _, commands in batches)
+        for key, commands in batches:
+            for command in commands:
+                self._in_flight[command[:3]] = command
+            self._ready[key].append(commands)
+        return batches
+
+    def _dispatch(self):
+        """
+        Start sending to the gateways that have batches ready & a
+        connection to spare. Holds `_condition`.
+        """
+        for key, ready in self._ready.items():
+            for _ in range(min(
+                    len(ready), self.pool_size - self._senders[key])):
+                self._senders[key] += 1
+                self._executor.submit(self._drain, key)
+
+    def _next(self, key):
+        """
+        The first batch ready for gateway `key` that has no appliance in
+        common with a batch on it's way or before it in line. Holds
+        `_condition`.
+        """
+        ready = self._ready[key]
+        busy = self._busy[key]
+        blocked = set(busy)
+        for index, commands in enumerate(ready):
+            switches = {command[:3] for command in commands}
+            if blocked.isdisjoint(switches):
+                del ready[index]
+                busy.update(switches)
+                return commands
+            blocked.update(switches)
+        return None
+
+    def _drain(self, key):
+        """
+        Send batches ready for gateway `key`, till there is none it can
+        send
+        """
+        while True:
+            with self._condition:
+                commands = self._next(key)
+                if commands is None:
+                    self._senders[key] -= 1
+                    return
+            self._send(key, commands)
+            with self._condition:
+                self._busy[key].difference_update(
+                    command[:3] for command in commands)
+                # Whatever waited on these appliances may go now
+                self._dispatch()
+
+    def _superseded(self, command):
+        """
+        Was a newer command for the same appliance taken for sending (so it
+        goes out after this one)? Holds `_condition`.
+        """
+        return self._in_flight.get(command[:3]) is not command
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            with self._condition:
+                self._condition.wait(max(deadline - time.monotonic(), 0))
+                if self._closed:
+                    return
+                timed_out = time.monotonic() >= deadline
+                batches = self._take(full_only=not timed_out)
+                if batches:
+                    self._dispatch()
+            if timed_out:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _send(self, key, commands):
+        batch = commands
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    with self.pools[key].connection() as connection:
+                        connection.send(commands)
+                    break
+                except (OSError, GatewayError) as e:
+                    with self._condition:
+                        commands = [
+                            command for command in commands
+                            if not self._superseded(command)]
+                    if not commands:
+                        return
+                    if attempt == self.retries:
+                        self.failed.extend(commands)
+                        if self.on_error is not None:
+                            self.on_error(key, commands, e)
+                        return
+                    time.sleep(self.backoff * 2 ** attempt)
+            with self._condition:
+                self.sent += len(commands)
+                self.batches += 1
+        finally:
+            with self._condition:
+                for command in batch:
+                    if self._in_flight.get(command[:3]) is command:
+                        del self._in_flight[command[:3]]
+                self.in_flight -= len(batch)
+                self._condition.notify_all()
+
+    def flush(self):
+        """
+        Send everything now & wait till the gateways have it (or gave up)
+        """
+        with self._condition:
+            self._take(full_only=False)
+            self._dispatch()
+            self._condition.wait_for(lambda: not self.in_flight)
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+        self._executor.shutdown()
+        for pool in self.pools.values():
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _GatewayHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        gateway = self.server
+        commands = []
+        for line in self.rfile:
+            if line.strip():
+                commands.append(tuple(map(int, line.split())))
+                continue
+            with gateway.lock:
+                if gateway.failures:
+                    gateway.failures -= 1
+                    return  # Hang up without an answer
+                gateway.batches.append(commands)
+                for floor, corridor, appliance, status in commands:
+                    gateway.statuses[(floor, corridor, appliance)] = status
+            commands = []
+            self.wfile.write(b'ok\n')
+
+
+class MockGateway(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    A relay gateway on localhost that just remembers what it was told.
+    `failures` is the number of batches to drop (hanging up) before it
+    starts behaving.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), failures=0):
+        super(MockGateway, self).__init__(address, _GatewayHandler)
+        self.lock = threading.Lock()
+        self.failures = failures
+        # Every batch received, as lists of
+        # (floor, corridor, appliance, status)
+        self.batches = []
+        # (floor, corridor, appliance) => last status received
+        self.statuses = {}
+
+    def start(self):
+        threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def transport(self, timeout=5.0):
+        return TcpTransport(self.server_address, timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,140 @@
+"""
+Budget
+
+Power budgets make a tree: Building => Floor => Corridor.
+
+Every model has a cap, the watts it may consume by it's own rights. A
+corridor's is the multiplier of it's category, a floor's is what it's
+corridors add up to & so is a building's (it's feeder, so to say). Any of
+them can be set to something else with `set_cap`.
+
+What a model may actually consume right now (`max_watts`) is handed down
+from the top. The building gets it's cap, and the policy of every model
+decides how what it got is shared among it's components:
+
+* `Strict`: Each gets it's cap. If there isn't enough for all of them,
+  they are cut down alike. Buildings go by this, unless told otherwise.
+* `Pool`: Each may take whatever is not used by the others. Floors go by
+  this, so corridors share the floor's budget.
+* `Lend`: Each gets it's cap (cut down as with `Strict`), & may borrow
+  whatever the others leave unused. Once a lender wants it back,
+  borrowers are over budget till they shed enough (see
+  `Building.rebalance`).
+
+Change a model's policy with `set_budget_policy`.
+
+Policies hear about every switch of the components they look after, so
+a switch costs O(1) on each level of the tree it goes through, and
+nothing on the others. So does working out an allowance. A `steady`
+policy goes by caps alone, so the building keeps the allowances of it's
+floors till caps or policies change.
+
+Shedding goes by the floor budgets. Corridor budgets are there to be
+read, and for the caps to add up. So floors only go by `Pool`: Any other
+policy would hold corridors to less than shedding does, & is turned down.
+"""
+
+
+class Strict:
+
+    # Allowances go by caps alone, so they hold till caps or policy change
+    steady = True
+
+    def allowance(self, model, component, allowed):
+        """
+        Watts `component` may consume, given `model` (it's owner) is
+        `allowed` as much
+        """
+        return component.cap() * self._share(model, allowed)
+
+    def _share(self, model, allowed):
+        """
+        How much of it's cap each component of `model` gets
+        """
+        caps = model._caps
+        if not caps or allowed >= caps:
+            return 1
+        return allowed / caps
+
+    def attached(self, model, components):
+        """
+        `components` joined `model`
+        """
+
+    def caps_changed(self, model):
+        """
+        The cap of one of the components of `model` changed
+        """
+
+    def switched(self, model, component, delta):
+        """
+        `component` of `model` consumes `delta` watts more (or less)
+        """
+
+    def overdrawn(self, model):
+        """
+        Components of `model` that have to give power back
+        """
+        return ()
+
+
+class Pool(Strict):
+
+    steady = False
+
+    def allowance(self, model, component, allowed):
+        return allowed - (model.current_watts() - component.current_watts())
+
+
+class Lend(Strict):
+    """
+    Looks after one model only, make one for each.
+    """
+
+    steady = False
+
+    def __init__(self):
+        self.model = None
+        # How much of it's cap a component gets as it's share, as of when
+        # `_borrowers` was made. None once stale.
+        self._scale = None
+        # Component id => component, for those using more than their share
+        self._borrowers = {}
+
+    def attached(self, model, components):
+        if self.model is None:
+            self.model = model
+        elif self.model is not model:
+            raise ValueError("A Lend looks after one model only")
+        self._scale = None
+
+    def caps_changed(self, model):
+        self._scale = None
+
+    def switched(self, model, component, delta):
+        if self._scale is None:
+            return
+        if component.current_watts() > component.cap() * self._scale:
+            self._borrowers[component.id] = component
+        else:
+            self._borrowers.pop(component.id, None)
+
+    def allowance(self, model, component, allowed):
+        share = component.cap() * self._share(model, allowed)
+        spare = allowed - model.current_watts()
+        # Lenders can always have their share back, borrowers make do with
+        # less then
+        return max(share, component.current_watts() + spare)
+
+    def overdrawn(self, model):
+        allowed = model.max_watts()
+        scale = self._share(model, allowed)
+        if scale != self._scale:
+            self._scale = scale
+            self._borrowers = {
+                component.id: component
+                for component in model.iter_components()
+                if component.current_watts() > component.cap() * scale}
+        if model.current_watts() <= allowed:
+            return ()
+        return list(self._borrowers.values())
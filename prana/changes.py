@@ -0,0 +1,62 @@
+"""
+Change data capture
+
+Rather than walking every floor to find out what is on, subscribe to the
+building (`Building.subscribe`) & get told whenever appliances actually
+change status. Changes come in batches of `ChangeEvent`, one batch per
+transaction, and are handed out only after the floor locks are let go.
+
+A `ChangeFeed` keeps the most recent changes in a ring buffer, so anybody
+can catch up at their own pace with `read`, without the building waiting
+on them.
+"""
+
+from collections import namedtuple
+from itertools import count
+
+# `watts` is the change in consumption: Positive when switched on
+ChangeEvent = namedtuple(
+    'ChangeEvent', [
+        'building', 'floor', 'corridor', 'appliance', 'old', 'new',
+        'timestamp', 'watts'])
+
+
+class ChangeFeed:
+    """
+    Ring buffer of the last `size` change events. Subscribe it to a
+    building, then `read` from wherever you left off.
+
+    No locks: Every event takes the next sequence number & goes into it's
+    own slot. A reader stops at the first slot that is not written yet, so
+    nothing is skipped even when writers finish out of order.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self._slots = [(-1, None)] * size
+        self._sequence = count()
+
+    def __call__(self, events):
+        slots, size = self._slots, self.size
+        for event in events:
+            sequence = next(self._sequence)
+            slots[sequence % size] = (sequence, event)
+
+    def read(self, cursor=0, limit=None):
+        """
+        Events from `cursor` on, along with the cursor to carry on from.
+        If the reader fell more than `size` events behind, the ones that
+        were overwritten are lost & reading resumes at the oldest left.
+        """
+        slots, size = self._slots, self.size
+        events = []
+        while limit is None or len(events) < limit:
+            sequence, event = slots[cursor % size]
+            if sequence < cursor:
+                break  # Not written yet
+            if sequence > cursor:
+                cursor = sequence - size + 1
+                continue
+            events.append(event)
+            cursor += 1
+        return events, cursor
@@ -0,0 +1,81 @@
+"""
+Clocks
+
+Models ask `prana.clock.now()` for the time. It is a float number of
+seconds from a monotonic clock by default, so wall-clock jumps (NTP, DST &
+friends) do not mess with sensor timeouts. Swap in a `ManualClock` to
+replay events or to test without sleeping.
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class MonotonicClock:
+    """
+    Seconds from a clock that never goes backwards
+    """
+
+    def now(self):
+        return time.monotonic()
+
+
+class ManualClock:
+    """
+    A clock that only moves when told to. For tests & replays.
+    """
+
+    def __init__(self, now=0.0):
+        self._now = float(now)
+
+    def now(self):
+        return self._now
+
+    def set(self, now):
+        """
+        Jump to `now`
+        """
+        self._now = float(now)
+        return self._now
+
+    def advance(self, seconds):
+        """
+        Move the clock forward by `seconds`
+        """
+        self._now += seconds
+        return self._now
+
+
+_clock = MonotonicClock()
+
+
+def now():
+    """
+    Current time, according to the clock in use
+    """
+    return _clock.now()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """
+    Use `clock` from now on. Returns the clock that was in use.
+    """
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+@contextmanager
+def use_clock(clock):
+    """
+    Use `clock` within the block only
+    """
+    previous = set_clock(clock)
+    try:
+        yield clock
+    finally:
+        set_clock(previous)
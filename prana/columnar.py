@@ -0,0 +1,608 @@
+"""
+A columnar take on the models
+
+Instead of a tree of Python objects, all the state of a building lives in
+flat NumPy arrays (one row per appliance, sensor, corridor & floor) and the
+rules are applied to whole columns at once with masks & `bincount`.
+
+`ColumnarBuilding` mimics the `Building` API, so code written against
+`prana.models` (like `run.py`) keeps working. Where the object models
+take the current time from `prana.clock`, it can be given as `now`.
+Floors, corridors, appliances & sensors handed out by it are just thin
+views on rows of the arrays.
+"""
+
+import heapq
+
+import numpy as np
+
+from prana import clock
+from prana.constants import SENSOR_TIMEOUT, SENSOR_TIMEOUT_SECONDS, \
+    TIME_SLOT_CURRENT, TIME_SLOT_DAY
+from prana.enums import ApplianceCategory, ApplianceStatus, CorridorCategory
+from prana.models import Floor, Transition
+
+
+class Column:
+    """
+    A NumPy array that can grow, one row at a time
+    """
+
+    def __init__(self, dtype, capacity=64):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        """
+        Add a row & return it's index
+        """
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, 2 * len(self.data))
+        self.data[self.size] = value
+        self.size += 1
+        return self.size - 1
+
+    def view(self):
+        """
+        The rows that are actually in use
+        """
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+
+class ColumnarState:
+    """
+    All the state of a building, in columns
+    """
+
+    def __init__(self):
+        self.floor_ids = Column(np.int64)
+        self.floor_max = Column(np.int64)
+        self.corridor_ids = Column(np.int64)
+        self.corridor_category = Column(np.int8)
+        self.corridor_floor = Column(np.int64)
+        self.appliance_ids = Column(np.int64)
+        self.appliance_category = Column(np.int8)
+        self.appliance_status = Column(np.int8)
+        self.appliance_watts = Column(np.int64)
+        self.appliance_corridor = Column(np.int64)
+        self.appliance_floor = Column(np.int64)
+        self.sensor_ids = Column(np.int64)
+        self.sensor_category = Column(np.int8)
+        self.sensor_last_activity = Column(np.float64)
+        self.sensor_corridor = Column(np.int64)
+
+        # Index maps: from ids (as seen by the outside world) to rows
+        self.floor_rows = {}
+        self.corridor_rows = {}  # (floor row, corridor id) => row
+        self.appliance_rows = {}  # (corridor row, appliance id) => row
+        self.sensor_rows = {}  # (corridor row, sensor id) => row
+
+        # Rows per corridor & floor, for single event updates
+        self._floor_corridors = {}
+        self._floor_appliances = {}
+        self._floor_sensors = {}
+        self._corridor_appliances = {}
+        self._corridor_sensors = {}
+
+        # Floor row => appliance rows shed, to be switched back on in
+        # reverse (as `prana.shedding.HeapShedder` does)
+        self._shed = {}
+
+    # Topology
+
+    def add_floor(self, id):
+        if id in self.floor_rows:
+            raise Exception("Component Already Exists")
+        row = self.floor_ids.append(id)
+        self.floor_max.append(0)
+        self.floor_rows[id] = row
+        self._floor_corridors[row] = []
+        self._floor_appliances[row] = []
+        self._floor_sensors[row] = []
+        return row
+
+    def add_corridor(self, floor_row, id, category):
+        key = (floor_row, id)
+        if key in self.corridor_rows:
+            raise Exception("Component Already Exists")
+        row = self.corridor_ids.append(id)
+        multiplier = CorridorCategory.multiplier(category)
+        self.corridor_category.append(category)
+        self.corridor_floor.append(floor_row)
+        self.floor_max.data[floor_row] += multiplier
+        self.corridor_rows[key] = row
+        self._floor_corridors[floor_row].append(row)
+        self._corridor_appliances[row] = []
+        self._corridor_sensors[row] = []
+        return row
+
+    def add_appliance(self, corridor_row, id, category):
+        key = (corridor_row, id)
+        if key in self.appliance_rows:
+            raise Exception("Component Already Exists")
+        floor_row = self.corridor_floor.data[corridor_row]
+        row = self.appliance_ids.append(id)
+        self.appliance_category.append(category)
+        self.appliance_status.append(ApplianceStatus.OFF)
+        self.appliance_watts.append(ApplianceCategory.watts(category))
+        self.appliance_corridor.append(corridor_row)
+        self.appliance_floor.append(floor_row)
+        self.appliance_rows[key] = row
+        self._corridor_appliances[corridor_row].append(row)
+        self._floor_appliances[floor_row].append(row)
+        return row
+
+    def add_sensor(self, corridor_row, id, category):
+        key = (corridor_row, id)
+        if key in self.sensor_rows:
+            raise Exception("Sensor Already Exists")
+        row = self.sensor_ids.append(id)
+        self.sensor_category.append(category)
+        # Same clean slate as `Sensor`: timed-out twice over already
+        self.sensor_last_activity.append(
+            clock.now() - 2 * SENSOR_TIMEOUT * 60)
+        self.sensor_corridor.append(corridor_row)
+        self.sensor_rows[key] = row
+        self._corridor_sensors[corridor_row].append(row)
+        self._floor_sensors[self.corridor_floor.data[corridor_row]].append(
+            row)
+        return row
+
+    # Aggregates
+
+    def _floor_mask(self, floors):
+        """
+        Boolean mask over floor rows. `None` means every floor
+        """
+        mask = np.zeros(len(self.floor_ids), dtype=bool)
+        if floors is None:
+            mask[:] = True
+        else:
+            mask[floors] = True
+        return mask
+
+    def floor_watts(self):
+        """
+        Watts consumed per floor
+        """
+        on = self.appliance_status.view() == ApplianceStatus.ON
+        return np.bincount(
+            self.appliance_floor.view(),
+            weights=self.appliance_watts.view() * on,
+            minlength=len(self.floor_ids)).astype(np.int64)
+
+    def floor_max_watts(self):
+        """
+        Max watts allowed per floor
+        """
+        return self.floor_max.view()
+
+    def corridor_active(self, now=None):
+        """
+        Mask of corridors that have at least one sensor still active
+        """
+        if now is None:
+            now = clock.now()
+        expiry = self.sensor_last_activity.view() + SENSOR_TIMEOUT_SECONDS
+        return np.bincount(
+            self.sensor_corridor.view(), weights=now < expiry,
+            minlength=len(self.corridor_ids)) > 0
+
+    def floor_active(self, now=None, corridor_active=None):
+        """
+        Mask of floors that have at least one corridor still active
+        """
+        if corridor_active is None:
+            corridor_active = self.corridor_active(now)
+        return np.bincount(
+            self.corridor_floor.view(), weights=corridor_active,
+            minlength=len(self.floor_ids)) > 0
+
+    # Rules
+
+    def boot(self, floors=None):
+        """
+        Bring floors to defaults: All ACs on, main lights on at night
+        """
+        status = self.appliance_status.view()
+        category = self.appliance_category.view()
+        in_floors = self._floor_mask(floors)[self.appliance_floor.view()]
+        status[in_floors & (category == ApplianceCategory.AC)] = \
+            ApplianceStatus.ON
+        if TIME_SLOT_CURRENT is TIME_SLOT_DAY:
+            return
+        corridor_category = self.corridor_category.view()[
+            self.appliance_corridor.view()]
+        for rule in Floor._appliances_always_on:
+            mask = in_floors & (corridor_category == rule['corridor']) \
+                & (category == rule['appliance'])
+            status[mask] = ApplianceStatus.ON
+
+    def refresh(self, now=None, floors=None):
+        """
+        Reset every floor (of `floors`) that has no active sensor left to
+        defaults
+        """
+        reset = np.flatnonzero(
+            ~self.floor_active(now) & self._floor_mask(floors))
+        if not len(reset):
+            return reset
+        status = self.appliance_status.view()
+        status[self._floor_mask(reset)[self.appliance_floor.view()]] = \
+            ApplianceStatus.OFF
+        self.boot(reset)
+        for floor_row in reset.tolist():
+            self._shed.pop(floor_row, None)
+        return reset
+
+    def optimize(self, floors=None, now=None):
+        """
+        Shed load on the floors that are over their budget, & bring back
+        what fits on those that shed some before (see `optimize_floor`)
+        """
+        mask = self._floor_mask(floors)
+        rows = set(np.flatnonzero(
+            mask & (self.floor_watts() > self.floor_max_watts())).tolist())
+        rows.update(row for row in self._shed if mask[row])
+        for floor_row in sorted(rows):
+            self.optimize_floor(floor_row, now)
+
+    def register_activity(self, corridor_row, sensor_row, timestamp=None):
+        """
+        A sensor saw something: Switch the corridor on & optimize it's floor
+        """
+        now = clock.now()
+        self.activate(corridor_row, sensor_row, timestamp, now)
+        floor_row = self.corridor_floor.data[corridor_row]
+        self.optimize_floor(floor_row, now)
+
+    def activate(self, corridor_row, sensor_row, timestamp=None, now=None):
+        """
+        A sensor saw something: Switch the corridor on, leaving it's floor
+        to be optimized. Returns when the sensor times out.
+        """
+        if timestamp is None:
+            timestamp = clock.now() if now is None else now
+        last_activity = self.sensor_last_activity.data
+        # A late event does not make the sensor any fresher
+        last_activity[sensor_row] = max(last_activity[sensor_row], timestamp)
+        self.appliance_status.data[self._corridor_appliances[corridor_row]] \
+            = ApplianceStatus.ON
+        return last_activity[sensor_row] + SENSOR_TIMEOUT_SECONDS
+
+    def optimize_floor(self, floor_row, now=None):
+        """
+        Shed just enough to get a floor within budget, the way
+        `prana.shedding.HeapShedder` does: Expendable appliances that are
+        on in idle corridors, rule by rule, the longest idle corridor & the
+        hungriest appliance first (ties go by row). Under budget, what was
+        shed comes back on (last shed, first back) while it fits.
+        """
+        if now is None:
+            now = clock.now()
+        rows = np.asarray(self._floor_appliances[floor_row], dtype=np.int64)
+        status = self.appliance_status.data
+        on = status[rows] == ApplianceStatus.ON
+        watts = self.appliance_watts.data[rows]
+        excess = int((watts * on).sum() - self.floor_max.data[floor_row])
+        if excess <= 0:
+            if excess < 0 and self._shed.get(floor_row):
+                self._restore(floor_row, -excess)
+            return
+        sensors = np.asarray(self._floor_sensors[floor_row], dtype=np.int64)
+        last_activity = self.sensor_last_activity.data[sensors]
+        sensor_corridor = self.sensor_corridor.data[sensors]
+        active = sensor_corridor[now < last_activity + SENSOR_TIMEOUT_SECONDS]
+        appliance_corridor = self.appliance_corridor.data[rows]
+        idle = ~np.isin(appliance_corridor, active)
+        # When each corridor last saw something, never if it has no sensors
+        idle_since = np.full(len(self.corridor_ids), -np.inf)
+        np.maximum.at(idle_since, sensor_corridor, last_activity)
+        idle_since = idle_since[appliance_corridor]
+        category = self.appliance_category.data[rows]
+        corridor_category = self.corridor_category.data[appliance_corridor]
+        shed = self._shed.setdefault(floor_row, [])
+        for rule in Floor._appliances_expendable:
+            candidates = np.flatnonzero(
+                on & idle & (corridor_category == rule['corridor'])
+                & (category == rule['appliance']))
+            if not len(candidates):
+                continue
+            order = candidates[np.lexsort((
+                candidates, -watts[candidates], idle_since[candidates]))]
+            # Up to (and including) the one that gets the floor within budget
+            before = np.cumsum(watts[order]) - watts[order]
+            order = order[before < excess]
+            status[rows[order]] = ApplianceStatus.OFF
+            shed.extend(rows[order].tolist())
+            excess -= int(watts[order].sum())
+            if excess <= 0:
+                break
+
+    def _restore(self, floor_row, headroom):
+        status = self.appliance_status.data
+        shed = self._shed[floor_row]
+        while shed:
+            row = shed[-1]
+            if status[row] == ApplianceStatus.ON:
+                # Somebody else got to it
+                shed.pop()
+                continue
+            watts = int(self.appliance_watts.data[row])
+            if watts > headroom:
+                break
+            shed.pop()
+            status[row] = ApplianceStatus.ON
+            headroom -= watts
+
+
+class ColumnarView:
+    """
+    A thin handle on a row of `ColumnarState`
+    """
+
+    def __init__(self, state, row):
+        self._state = state
+        self.row = row
+
+    def __repr__(self):
+        return '<%s(%d)>' % (self.__class__.__name__, self.id)
+
+
+class ColumnarAppliance(ColumnarView):
+
+    @property
+    def id(self):
+        return int(self._state.appliance_ids.data[self.row])
+
+    @property
+    def category(self):
+        return int(self._state.appliance_category.data[self.row])
+
+    @property
+    def status(self):
+        return int(self._state.appliance_status.data[self.row])
+
+    def switch_on(self):
+        self._state.appliance_status.data[self.row] = ApplianceStatus.ON
+        return self.status
+
+    def switch_off(self):
+        self._state.appliance_status.data[self.row] = ApplianceStatus.OFF
+        return self.status
+
+    def current_watts(self):
+        if self.status == ApplianceStatus.OFF:
+            return 0
+        return int(self._state.appliance_watts.data[self.row])
+
+
+class ColumnarSensor(ColumnarView):
+
+    @property
+    def id(self):
+        return int(self._state.sensor_ids.data[self.row])
+
+    @property
+    def category(self):
+        return int(self._state.sensor_category.data[self.row])
+
+    @property
+    def last_activity(self):
+        return float(self._state.sensor_last_activity.data[self.row])
+
+    def is_active(self, now=None):
+        if now is None:
+            now = clock.now()
+        return now < self.last_activity + SENSOR_TIMEOUT_SECONDS
+
+
+class ColumnarCorridor(ColumnarView):
+
+    @property
+    def id(self):
+        return int(self._state.corridor_ids.data[self.row])
+
+    @property
+    def category(self):
+        return int(self._state.corridor_category.data[self.row])
+
+    def get_appliance(self, id):
+        return ColumnarAppliance(
+            self._state, self._state.appliance_rows[(self.row, id)])
+
+    def list_appliances(self):
+        return [
+            ColumnarAppliance(self._state, row)
+            for row in self._state._corridor_appliances[self.row]]
+
+    def add_appliance(self, id, category):
+        return ColumnarAppliance(
+            self._state, self._state.add_appliance(self.row, id, category))
+
+    def append_appliance(self, category):
+        appliance_id = len(self._state._corridor_appliances[self.row])
+        return self.add_appliance(appliance_id, category)
+
+    def get_sensor(self, id):
+        return ColumnarSensor(
+            self._state, self._state.sensor_rows[(self.row, id)])
+
+    def list_sensors(self):
+        return [
+            ColumnarSensor(self._state, row)
+            for row in self._state._corridor_sensors[self.row]]
+
+    def add_sensor(self, id, sensor_category):
+        return ColumnarSensor(
+            self._state,
+            self._state.add_sensor(self.row, id, sensor_category))
+
+    def append_sensor(self, sensor_category):
+        sensor_id = len(self._state._corridor_sensors[self.row])
+        return self.add_sensor(sensor_id, sensor_category)
+
+    def is_active(self, now=None):
+        return any(sensor.is_active(now) for sensor in self.list_sensors())
+
+
+class ColumnarFloor(ColumnarView):
+
+    @property
+    def id(self):
+        return int(self._state.floor_ids.data[self.row])
+
+    def get_corridor(self, id):
+        return ColumnarCorridor(
+            self._state, self._state.corridor_rows[(self.row, id)])
+
+    def list_corridors(self):
+        return [
+            ColumnarCorridor(self._state, row)
+            for row in self._state._floor_corridors[self.row]]
+
+    def add_corridor(self, id, category):
+        return ColumnarCorridor(
+            self._state, self._state.add_corridor(self.row, id, category))
+
+    def append_corridor(self, category):
+        corridor_id = len(self._state._floor_corridors[self.row])
+        return self.add_corridor(corridor_id, category)
+
+    def current_watts(self):
+        rows = self._state._floor_appliances[self.row]
+        on = self._state.appliance_status.data[rows] == ApplianceStatus.ON
+        return int((self._state.appliance_watts.data[rows] * on).sum())
+
+    def max_watts(self):
+        return int(self._state.floor_max.data[self.row])
+
+    def is_active(self, now=None):
+        return any(
+            corridor.is_active(now) for corridor in self.list_corridors())
+
+    def boot(self):
+        self._state.boot([self.row])
+
+    def optimize(self):
+        self._state.optimize_floor(self.row)
+
+
+class ColumnarBuilding:
+    """
+    Drop-in replacement for `Building`, backed by `ColumnarState`
+    """
+
+    def __init__(self, id=0):
+        self.id = id
+        self.state = ColumnarState()
+        # (expiry, floor row, sensor row) for `tick`, as `Building` keeps
+        # them
+        self._expiry = []
+
+    def get_floor(self, id):
+        return ColumnarFloor(self.state, self.state.floor_rows[id])
+
+    def list_floors(self):
+        return [
+            ColumnarFloor(self.state, row)
+            for row in range(len(self.state.floor_ids))]
+
+    def add_floor(self, id):
+        return ColumnarFloor(self.state, self.state.add_floor(id))
+
+    def append_floor(self):
+        return self.add_floor(len(self.state.floor_ids))
+
+    def current_watts(self):
+        return int(self.state.floor_watts().sum())
+
+    def boot(self):
+        self.state.boot()
+
+    def tick(self, now=None):
+        """
+        Refresh only the floors whose sensors timed-out since the last tick.
+        Returns the floors that were looked at.
+        """
+        if now is None:
+            now = clock.now()
+        last_activity = self.state.sensor_last_activity.data
+        floors = set()
+        while self._expiry and self._expiry[0][0] <= now:
+            expiry, floor_row, sensor_row = heapq.heappop(self._expiry)
+            if last_activity[sensor_row] + SENSOR_TIMEOUT_SECONDS != expiry:
+                # There was activity since, a later entry takes care
+                continue
+            floors.add(floor_row)
+        floors = sorted(floors)
+        if floors:
+            self.state.refresh(now, floors)
+        return [ColumnarFloor(self.state, row) for row in floors]
+
+    def refresh(self, full=False, *, now=None):
+        """
+        Every floor is looked at in one go, whatever `full` says
+        """
+        self.state.refresh(now)
+
+    def optimize(self, full=False, *, now=None):
+        """
+        Every floor over it's budget (or with something shed) is looked at,
+        whatever `full` says
+        """
+        self.state.optimize(now=now)
+
+    def _rows(self, floor_id, corridor_id, sensor_id):
+        floor_row = self.state.floor_rows[floor_id]
+        corridor_row = self.state.corridor_rows[(floor_row, corridor_id)]
+        return (
+            floor_row, corridor_row,
+            self.state.sensor_rows[(corridor_row, sensor_id)])
+
+    def register_activity(
+            self, floor_id, corridor_id, sensor_id, timestamp=None):
+        floor_row, corridor_row, sensor_row = self._rows(
+            floor_id, corridor_id, sensor_id)
+        self.state.register_activity(corridor_row, sensor_row, timestamp)
+        heapq.heappush(self._expiry, (
+            self.state.sensor_last_activity.data[sensor_row] +
+            SENSOR_TIMEOUT_SECONDS, floor_row, sensor_row))
+
+    def register_activities(self, events):
+        """
+        Register a burst of activities in one go, as
+        `Building.register_activities` does: Each corridor is switched on &
+        each floor optimized just once. Returns the same summary.
+        """
+        state = self.state
+        now = clock.now()
+        before = state.appliance_status.view().copy()
+        floors = {}
+        count = 0
+        for event in events:
+            floor_row, corridor_row, sensor_row = self._rows(
+                int(event[0]), int(event[1]), int(event[2]))
+            timestamp = event[3] if len(event) > 3 else None
+            expiry = state.activate(corridor_row, sensor_row, timestamp, now)
+            heapq.heappush(self._expiry, (expiry, floor_row, sensor_row))
+            floors.setdefault(floor_row, set()).add(corridor_row)
+            count += 1
+        for floor_row in floors:
+            state.optimize_floor(floor_row, now)
+        after = state.appliance_status.view()
+        transitions = [
+            Transition(
+                int(state.floor_ids.data[state.appliance_floor.data[row]]),
+                int(state.corridor_ids.data[
+                    state.appliance_corridor.data[row]]),
+                int(state.appliance_ids.data[row]),
+                int(before[row]), int(after[row]))
+            for row in np.flatnonzero(before != after).tolist()]
+        return dict(
+            events=count,
+            corridors=sum(len(corridors) for corridors in floors.values()),
+            floors=len(floors), transitions=transitions)
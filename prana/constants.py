@@ -9,6 +9,7 @@ TIME_SLOT_DAY = (6, 18)  # Assuming 6AM to 6PM is day slot => in 24 hour format
 TIME_SLOT_NIGHT = tuple(24 - t for t in TIME_SLOT_DAY)  # what isn't day slot
 
 SENSOR_TIMEOUT = 1  # A timeout for sensors, For 1 minute.
+SENSOR_TIMEOUT_SECONDS = SENSOR_TIMEOUT * 60  # What the clocks deal in
 
 MULTIPLIER_CORRIDOR_MAIN = 15
 MULTIPLIER_CORRIDOR_SUB = 10
@@ -17,3 +18,7 @@ MULTIPLIER_CORRIDOR_SUB = 10
 # Since this more of a prgaramming challene,
 # I am emulating current time rather than using actual time utils
 TIME_SLOT_CURRENT = TIME_SLOT_NIGHT
+
+# Minutes of per minute energy rollups kept (see `prana.energy`)
+ENERGY_ROLLUP_MINUTES_FLOOR = 60
+ENERGY_ROLLUP_MINUTES_BUILDING = 24 * 60
@@ -0,0 +1,124 @@
+"""
+Energy
+
+Watts say how much is being consumed right now, bills want kWh. So every
+model keeps a running count of the energy (in joules) consumed under it:
+Whenever it's watts change, what was consumed at the old rate since the
+last change is added on. That is O(1) per level, per transition, with
+nothing to poll. Appliances are counted by their corridor.
+
+Floors & the building also keep per minute rollups: The count as of every
+minute boundary (& the watts either side of it), for the last so many
+minutes, in a fixed size ring. Energy between any two moments in there
+comes straight out of it. That is exact, but for minutes in which the
+watts changed more than once: Those can be a little off, though never
+beyond the counts at either end of the minute.
+
+Corridors & appliances keep no rollups, there are far too many of them.
+They only know what was consumed since their last change: Asking for
+energy from any earlier is a `ValueError`.
+
+Ask any model for `energy(start, end)`, in joules. `kwh` converts.
+"""
+
+from array import array
+
+JOULES_PER_KWH = 3.6e6
+
+
+def kwh(joules):
+    return joules / JOULES_PER_KWH
+
+
+class Rollup:
+    """
+    Energy consumed as of each minute boundary, for the last `minutes`
+    minutes. Minutes are counted from 0 on the clock in use.
+    """
+
+    __slots__ = (
+        'minutes', 'start', 'last', 'initial', 'watts', '_ring', '_first',
+        '_final')
+
+    def __init__(self, minutes, start):
+        self.minutes = minutes
+        # When counting started, nothing was consumed before
+        self.start = start
+        # Latest minute boundary noted down, None till one is
+        self.last = None
+        # Watts from the start till the first change, & up to the latest
+        self.initial = self.watts = None
+        size = minutes + 1
+        # A boundary at either end of every minute
+        self._ring = array('d', bytes(8 * size))
+        # Watts at the start & at the end of every minute
+        self._first = array('d', bytes(8 * size))
+        self._final = array('d', bytes(8 * size))
+
+    def record(self, joules, watts, since, now):
+        """
+        `joules` had been consumed by `since`, then `watts` till `now`.
+        Note down where that got to at every minute boundary in between.
+        """
+        if self.watts is None:
+            self.initial = watts
+        self.watts = watts
+        size = len(self._ring)
+        # Boundaries from `since` on, up to (not at) `now`: What comes after
+        # `now` goes at the new watts
+        last = -int(-now // 60) - 1
+        first = max(-int(-since // 60), last - self.minutes)
+        for minute in range(first, last + 1):
+            self._ring[minute % size] = joules + watts * (minute * 60 - since)
+            self._first[minute % size] = watts
+        # Minutes that end at `watts`, unless something changes in there yet
+        for minute in range(max(int(since // 60), last - self.minutes),
+                            last + 1):
+            self._final[minute % size] = watts
+        if first <= last:
+            self.last = last
+
+    def oldest(self):
+        """
+        How far back the rollup goes
+        """
+        if self.last is None:
+            return self.start
+        return max(self.start, (self.last - self.minutes) * 60)
+
+    def energy_at(self, moment, joules, since):
+        """
+        Energy consumed as of `moment`, given that it was `joules` by
+        `since` (the last change, which is after `moment`). Exact if the
+        watts changed once at most in the minute of `moment`.
+        """
+        if moment <= self.start:
+            return 0.0
+        if moment < self.oldest():
+            raise ValueError(
+                "Energy is only kept for the last %d minutes" % self.minutes)
+        size = len(self._ring)
+        minute = int(moment // 60)
+        # The closest points known on either side of `moment`, with the
+        # watts going away from them
+        if minute * 60 >= self.start:
+            lower, lower_joules, lower_watts = (
+                minute * 60, self._ring[minute % size],
+                self._first[minute % size])
+        else:
+            lower, lower_joules, lower_watts = self.start, 0.0, self.initial
+        if (minute + 1) * 60 < since:
+            upper, upper_joules, upper_watts = (
+                (minute + 1) * 60, self._ring[(minute + 1) % size],
+                self._final[minute % size])
+        else:
+            upper, upper_joules, upper_watts = since, joules, self.watts
+        ahead = lower_joules + lower_watts * (moment - lower)
+        behind = upper_joules - upper_watts * (upper - moment)
+        # A single change in between is where the two meet: Before it the
+        # count goes as `ahead`, after it as `behind`
+        if lower_watts <= upper_watts:
+            energy = max(ahead, behind)
+        else:
+            energy = min(ahead, behind)
+        return min(max(energy, lower_joules), upper_joules)
@@ -0,0 +1,284 @@
+"""
+Journal
+
+Everything a building has been through, on disk, so that a restarted
+controller picks up exactly where the last one left off, instead of
+booting every floor back to defaults.
+
+A journal is a directory holding:
+
+* `log.<generation>`: Fixed size binary records, appended to as things
+  happen. Either a sensor saw activity or an appliance was switched.
+* `snapshot`: The whole building, as of the start of a generation, in the
+  same records.
+
+Records pile up in memory & are written & fsync'ed in groups: Every
+`sync_interval` seconds, or when somebody `commit`s. Whoever commits
+writes out what everybody else has appended as well.
+
+`snapshot` starts a new generation, after which older logs are deleted.
+Recovery replays the snapshot, then every log since, in order.
+
+Timestamps are stored as wall clock time, since the monotonic clock starts
+over with the process. Recover before anything is hooked up to the
+building (actuators & such), since replaying switches them as well.
+"""
+
+import os
+import re
+import struct
+import threading
+import time
+
+from prana import clock
+
+# kind, floor_id, corridor_id, sensor / appliance id, timestamp / status
+RECORD = struct.Struct('<BIIId')
+ACTIVITY = 1
+SWITCH = 2
+
+# magic, generation, time slot
+HEADER = struct.Struct('<4sIBB')
+MAGIC = b'PRNA'
+
+LOG = re.compile(r'^log\.(\d+)$')
+
+
+class Journal:
+    """
+    Hand it over to the building it should keep track of with `recover`.
+    """
+
+    def __init__(self, path, sync_interval=0.01, offset=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Seconds to add to `prana.clock` time to make it wall clock time.
+        # Clocks that have nothing to do with the wall (like a manual one)
+        # had better say so.
+        if offset is None:
+            offset = time.time() - clock.now()
+        self.offset = offset
+        self.generation = max(self._generations() + [self._read_header()[0]])
+        self._buffer = bytearray()
+        self._file = None
+        self._file_generation = None
+        # Records appended & records safely on disk, so far
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+        self._snapshotting = False
+        self._condition = threading.Condition()
+        self._closed = False
+        self._syncer = None
+        if sync_interval is not None:
+            self._syncer = threading.Thread(
+                target=self._run, args=(sync_interval,), daemon=True)
+            self._syncer.start()
+
+    def _log_path(self, generation):
+        return os.path.join(self.path, 'log.%d' % generation)
+
+    def _snapshot_path(self):
+        return os.path.join(self.path, 'snapshot')
+
+    def _generations(self):
+        return sorted(
+            int(match.group(1)) for match in map(LOG.match,
+                                                 os.listdir(self.path))
+            if match)
+
+    def _read_header(self):
+        """
+        Generation & time slot of the snapshot, (0, None) if there's none
+        """
+        try:
+            with open(self._snapshot_path(), 'rb') as snapshot:
+                header = snapshot.read(HEADER.size)
+        except FileNotFoundError:
+            return 0, None
+        magic, generation, start, end = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('%s is not a snapshot' % self._snapshot_path())
+        return generation, (start, end)
+
+    def _append(self, kind, floor_id, corridor_id, id, value):
+        with self._condition:
+            self._buffer += RECORD.pack(
+                kind, floor_id, corridor_id, id, value)
+            self._appended += 1
+
+    def record_activity(self, sensor):
+        corridor = sensor.parent
+        self._append(
+            ACTIVITY, corridor.parent.id, corridor.id, sensor.id,
+            sensor.last_activity + self.offset)
+
+    def record_switch(self, appliance):
+        corridor = appliance.parent
+        self._append(
+            SWITCH, corridor.parent.id, corridor.id, appliance.id,
+            appliance.status)
+
+    def commit(self):
+        """
+        Wait till every record appended so far is on disk
+        """
+        with self._condition:
+            target = self._appended
+            while self._synced < target:
+                if self._syncing or self._snapshotting:
+                    self._condition.wait()
+                    continue
+                # Our turn to write, for everybody waiting
+                buffer, self._buffer = self._buffer, bytearray()
+                generation, appended = self.generation, self._appended
+                self._syncing = True
+                self._condition.release()
+                try:
+                    self._write(generation, buffer)
+                finally:
+                    self._condition.acquire()
+                    self._syncing = False
+                    self._condition.notify_all()
+                self._synced = max(self._synced, appended)
+
+    def _write(self, generation, buffer):
+        if self._file_generation != generation:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self._log_path(generation), 'ab')
+            self._file_generation = generation
+            # Drop whatever a crash left half written
+            size = self._file.tell()
+            self._file.truncate(size - size % RECORD.size)
+        if buffer:
+            self._file.write(buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _run(self, sync_interval):
+        while True:
+            with self._condition:
+                self._condition.wait(sync_interval)
+                if self._closed:
+                    return
+            self.commit()
+
+    def snapshot(self, building):
+        """
+        Write the whole building down & start a new generation. Logs of
+        older generations are not needed any more, so they go.
+        """
+        records = bytearray()
+        with building.locked() as floors:
+            for floor in floors:
+                for corridor in floor.iter_corridors():
+                    for sensor in corridor.iter_sensors():
+                        records += RECORD.pack(
+                            ACTIVITY, floor.id, corridor.id, sensor.id,
+                            sensor.last_activity + self.offset)
+                    for appliance in corridor.iter_appliances():
+                        records += RECORD.pack(
+                            SWITCH, floor.id, corridor.id, appliance.id,
+                            appliance.status)
+            with self._condition:
+                # What is still in memory is in the snapshot as well
+                while self._syncing:
+                    self._condition.wait()
+                self._buffer = bytearray()
+                self.generation += 1
+                generation = self.generation
+                covered = self._appended
+                self._snapshotting = True
+        path = self._snapshot_path()
+        try:
+            with open(path + '.tmp', 'wb') as snapshot:
+                snapshot.write(HEADER.pack(
+                    MAGIC, generation, *building.time_slot))
+                snapshot.write(records)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(path + '.tmp', path)
+            self._sync_directory()
+        finally:
+            with self._condition:
+                self._snapshotting = False
+                self._synced = max(self._synced, covered)
+                self._condition.notify_all()
+        for old in self._generations():
+            if old < generation:
+                os.remove(self._log_path(old))
+
+    def _sync_directory(self):
+        directory = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _records(self):
+        generation, _ = self._read_header()
+        paths = [self._snapshot_path()] if generation else []
+        paths += [
+            self._log_path(log) for log in self._generations()
+            if log >= generation]
+        for path in paths:
+            with open(path, 'rb') as source:
+                data = source.read()
+            start = HEADER.size if path == self._snapshot_path() else 0
+            # A record cut short by a crash never made it, drop it
+            end = start + (len(data) - start) // RECORD.size * RECORD.size
+            yield from RECORD.iter_unpack(memoryview(data)[start:end])
+
+    def recover(self, building):
+        """
+        Bring `building` (laid out just like before, but not booted) back
+        to where it was, then keep track of it from here on.
+        Returns how many records were replayed. With none, it is a new
+        building: Boot it & take a snapshot, to start the journal off.
+
+        Sensors that timed out while nobody was watching are not on the
+        timer. `refresh` the building to catch up with them.
+        """
+        _, time_slot = self._read_header()
+        if time_slot is not None:
+            building.time_slot = time_slot
+        # Only where each appliance & sensor ended up matters
+        final = {}
+        count = 0
+        for kind, floor_id, corridor_id, id, value in self._records():
+            final[(kind, floor_id, corridor_id, id)] = value
+            count += 1
+        now = clock.now()
+        for (kind, floor_id, corridor_id, id), value in final.items():
+            corridor = building.get_floor(floor_id).get_corridor(corridor_id)
+            if kind == SWITCH:
+                corridor.get_appliance(id).set_status(int(value))
+                continue
+            sensor = corridor.get_sensor(id)
+            sensor.last_activity = value - self.offset
+            if sensor.is_active(now):
+                building.schedule_expiry(sensor, sensor.expiry())
+        # Only floors off their defaults can have anything shed
+        for floor in building.dirty_floors():
+            with floor.lock:
+                floor.shedder.recover()
+        building.add_recorder(self)
+        return count
+
+    def close(self):
+        self.commit()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._syncer is not None:
+            self._syncer.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
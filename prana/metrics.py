@@ -0,0 +1,166 @@
+"""
+Metrics
+
+Where does the time go? Hand a `Metrics` to a building (`watch`) & it
+keeps:
+
+* Latency histograms per operation: `register_activity`,
+  `register_activities`, `optimize`, `refresh_floor` (`Floor.refresh`) &
+  `tick`
+* Counters of appliances switched on & off, appliances shed to stay within
+  budget & sensors that timed out
+* Per floor gauges of current & max watts. These are read off the floors
+  when exported, so they cost nothing in between.
+
+A building without metrics (the default) does not time anything.
+
+`export` gives it all in the Prometheus text format. `serve` puts that up
+on a local HTTP endpoint, for Prometheus to scrape.
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+    2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+# Counter name => help text
+COUNTERS = dict(
+    switch_on='Appliances switched on',
+    switch_off='Appliances switched off',
+    shed='Appliances switched off to stay within the power budget',
+    sensor_expirations='Sensors that timed out',
+)
+
+
+class Histogram:
+    """
+    Counts of observations that fall in each bucket, along with their sum
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        # One more, for whatever is beyond the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        (upper bound, observations up to it) for each bucket, `+Inf` last
+        """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Operation => Histogram of how long it took
+        self.histograms = {}
+        self.buildings = []
+        self._lock = threading.Lock()
+
+    def watch(self, building):
+        """
+        Start keeping track of `building`
+        """
+        building.metrics = self
+        self.buildings.append(building)
+        return building
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, operation, seconds):
+        with self._lock:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                histogram = self.histograms[operation] = Histogram(
+                    self.buckets)
+            histogram.observe(seconds)
+
+    def export(self):
+        """
+        Everything, in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP prana_operation_seconds How long operations take',
+                '# TYPE prana_operation_seconds histogram',
+            ]
+            for operation, histogram in sorted(self.histograms.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append(
+                        'prana_operation_seconds_bucket'
+                        '{operation="%s",le="%s"} %d' % (
+                            operation, bound, count))
+                lines.append(
+                    'prana_operation_seconds_sum{operation="%s"} %r' % (
+                        operation, histogram.sum))
+                lines.append(
+                    'prana_operation_seconds_count{operation="%s"} %d' % (
+                        operation, histogram.count))
+            for name, value in self.counters.items():
+                lines += [
+                    '# HELP prana_%s_total %s' % (name, COUNTERS[name]),
+                    '# TYPE prana_%s_total counter' % name,
+                    'prana_%s_total %d' % (name, value),
+                ]
+        for gauge, help, read in (
+                ('floor_watts', 'Watts consumed on the floor right now',
+                 lambda floor: floor.current_watts()),
+                ('floor_max_watts', 'Watts the floor may consume',
+                 lambda floor: floor.max_watts())):
+            lines += [
+                '# HELP prana_%s %s' % (gauge, help),
+                '# TYPE prana_%s gauge' % gauge,
+            ]
+            for building in self.buildings:
+                for floor in building.iter_floors():
+                    lines.append(
+                        'prana_%s{building="%d",floor="%d"} %d' % (
+                            gauge, building.id, floor.id, read(floor)))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        Serve `export` over HTTP (on any path), from a thread of it's own.
+        Returns the server; `server.server_address` says where it is &
+        `server.shutdown()` stops it.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.export().encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Scraped every few seconds, no need to log that
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, args=(0.05,), daemon=True).start()
+        return server
@@ -1,7 +1,117 @@
-from datetime import datetime, timedelta
+import gc
+import heapq
+import json
+import re
+import threading
+from collections import namedtuple
+from itertools import chain
+from contextlib import contextmanager
+from time import perf_counter
+
+from prana import clock
+from prana.budget import Pool, Strict
+from prana.changes import ChangeEvent
+from prana.constants import ENERGY_ROLLUP_MINUTES_BUILDING, \
+    ENERGY_ROLLUP_MINUTES_FLOOR, SENSOR_TIMEOUT, SENSOR_TIMEOUT_SECONDS, \
+    TIME_SLOT_CURRENT, TIME_SLOT_DAY
+from prana.energy import Rollup
+from prana.shedding import HeapShedder
+from prana.enums import ApplianceCategory, CorridorCategory, ApplianceStatus, \
+    SensorCategory
+
+# Shared (and never modified) stand-in for a category with no components
+_NO_COMPONENTS = {}
+
+# Id ranges in a spec, like "1-80"
+_ID_RANGE = re.compile(r'^\s*(\d+)\s*-\s*(\d+)\s*$')
+
+
+def _spec_ids(ids):
+    """
+    Ids out of a spec: 3, "3", "1-80" or a list of those
+    """
+    if isinstance(ids, list):
+        return [id for item in ids for id in _spec_ids(item)]
+    if isinstance(ids, str):
+        match = _ID_RANGE.match(ids)
+        if match:
+            return list(range(int(match.group(1)), int(match.group(2)) + 1))
+    return [int(ids)]
+
+
+def _spec_category(enum, category):
+    """
+    A category out of a spec, by name ("AC", "light") or by value
+    """
+    if isinstance(category, str):
+        try:
+            return getattr(enum, category.upper())
+        except AttributeError:
+            raise ValueError("Unknown %s '%s'" % (enum.__name__, category))
+    return category
+
+
+# An appliance that ended up in a different status than it started with
+Transition = namedtuple(
+    'Transition', ['floor', 'corridor', 'appliance', 'old', 'new'])
+
+
+class ComponentStore:
+    """
+    Components keyed by their integer ids.
+
+    Ids usually go 0, 1, 2.. so those live in a plain list, where lookups &
+    appends are as cheap as they get. Any other id falls back to a dict.
+    """
+    __slots__ = ('_dense', '_sparse')
+
+    def __init__(self):
+        self._dense = []
+        self._sparse = {}
 
-from prana.constants import SENSOR_TIMEOUT, TIME_SLOT_CURRENT, TIME_SLOT_DAY
-from prana.enums import ApplianceCategory, CorridorCategory, ApplianceStatus
+    def __len__(self):
+        return len(self._dense) + len(self._sparse)
+
+    def __contains__(self, id):
+        return 0 <= id < len(self._dense) or id in self._sparse
+
+    def __getitem__(self, id):
+        if 0 <= id < len(self._dense):
+            return self._dense[id]
+        return self._sparse[id]
+
+    def add(self, id, component):
+        dense = self._dense
+        if id != len(dense):
+            self._sparse[id] = component
+            return
+        dense.append(component)
+        # Filled a gap? Move whatever follows over to the list as well
+        while self._sparse and len(dense) in self._sparse:
+            dense.append(self._sparse.pop(len(dense)))
+
+    def extend(self, components):
+        """
+        Add a bunch of components. If their ids just carry on from the list
+        (as they usually do), they go onto it in one go.
+        """
+        dense = self._dense
+        start = len(dense)
+        if not self._sparse and [
+                component.id for component in components] == list(
+                    range(start, start + len(components))):
+            dense.extend(components)
+            return
+        for component in components:
+            self.add(component.id, component)
+
+    def values(self):
+        """
+        Iterate over the components, without copying them
+        """
+        if self._sparse:
+            return chain(self._dense, self._sparse.values())
+        return iter(self._dense)
 
 
 class BaseModel:
@@ -13,42 +123,113 @@ class BaseModel:
     And so on..
 
     FYI: Usually, we sould have a data store.
-    I am just using a simple dict for simplicity.
+    I am just using a simple in-memory `ComponentStore` for simplicity.
     Would not do this in a real world application. :P
     """
+    # Leaves (Appliance, Sensor) are plenty, so keep them lean.
+    # Models with components get a `__dict__` anyway.
+    __slots__ = ('id', 'parent')
+
     _components = None
+    _categories = None
     _component_type = None
     _component_prefix = None
 
+    # Running count of watts consumed by appliances under this model
+    _watts = 0
+
+    # Watts this model may consume by it's own rights, None for the sum of
+    # the caps of it's components (`_caps`). See `prana.budget`.
+    _cap = None
+    _caps = 0
+    # How the components share what this model is allowed
+    budget_policy = Strict()
+    # Goes up after every change of caps or policy here, so that
+    # allowances worked out before can tell they are stale
+    _budget_version = 0
+
+    # Joules consumed under this model by `_accrued_at` (see `prana.energy`)
+    _joules = 0.0
+    _accrued_at = None
+    # Minutes of per minute energy rollups to keep, None for none
+    _rollup_minutes = None
+    _rollup = None
+
+    # Attributes (like locks) that don't travel with pickles.
+    # `_init_transient` makes them afresh instead.
+    _transient = ()
+
+    # Aliases like get_floor, list_floors, init_floors, etc
+    _aliases = dict(
+        get_component="get_%s",
+        list_components="list_%ss",
+        iter_components="iter_%ss",
+        add_component="add_%s",
+        attach_component="attach_%s",
+        attach_components="attach_%ss",
+        init_components="init_%ss",
+        append_component="append_%s",
+        filtered_components="filtered_%ss",
+    )
+
+    def __init_subclass__(klass, **kwargs):
+        """
+        Add the component aliases to the model class, once
+        """
+        super().__init_subclass__(**kwargs)
+        if klass._component_type is None:
+            return
+        # Identify components by thier class names
+        component_name = klass._component_type.__name__.lower()
+        klass._component_prefix = component_name + "%d"
+        # You know, because we can. And its convenient
+        for method, alias in klass._aliases.items():
+            alias = alias % component_name
+            if alias not in vars(klass):
+                setattr(klass, alias, getattr(klass, method))
+
     def __init__(self, id):
         """
-        Initialize base & dynamic methods
+        Initialize base
         """
         self.id = id
+        # The model that owns this one (Building owns Floor & so on..)
+        self.parent = None
 
         if self._component_type is None:
             # Hush now! Don't scare BaseModel!
             return
 
-        # add methods to models in runtime ;)
-        self._components = {}
-        # Identify components by thier class names
-        component_name = self._component_type.__name__.lower()
-        self._component_prefix = component_name + "%d"
+        self._components = ComponentStore()
+        # Index of components by category => {id: component}
+        self._categories = {}
 
-        # Make aliases like get_floor, get_floors, init_floors, etc
-        # You know, because we can. And its convenient
-        setattr(self, "get_%s" % component_name, self.get_component)
-        setattr(self, "list_%ss" % component_name, self.list_components)
-        setattr(self, "add_%s" % component_name, self.add_component)
-        setattr(self, "init_%ss" % component_name, self.init_components)
-        setattr(self, "append_%s" % component_name, self.append_component)
-        setattr(
-            self, "filtered_%ss" % component_name, self.filtered_components)
+    def _init_transient(self):
+        """
+        Make the attributes listed in `_transient`
+        """
+
+    def __getstate__(self):
+        slots = {}
+        for klass in type(self).__mro__:
+            for name in getattr(klass, '__slots__', ()):
+                if hasattr(self, name):
+                    slots[name] = getattr(self, name)
+        state = {
+            name: value
+            for name, value in getattr(self, '__dict__', {}).items()
+            if name not in self._transient}
+        return state, slots
+
+    def __setstate__(self, state):
+        state, slots = state
+        for name, value in chain(state.items(), slots.items()):
+            setattr(self, name, value)
+        self._init_transient()
 
     def component_key(self, id):
         """
-        Generic way of creating component_key
+        Generic way of naming a component. Components are stored by id.
         """
         return self._component_prefix % id
 
@@ -56,8 +237,7 @@ class BaseModel:
         """
         Get a specific component
         """
-        key = self.component_key(id)
-        return self._components[key]
+        return self._components[id]
 
     def list_components(self):
         """
@@ -67,29 +247,105 @@ class BaseModel:
             return []
         return list(self._components.values())
 
+    def iter_components(self):
+        """
+        Iterate over all components, without copying them into a list
+        """
+        if self._components is None:
+            return iter(())
+        return self._components.values()
+
     def filtered_components(self, category):
         """
-        Filter component according to category
+        Filter component according to category.
+        Gives a read-only view, which stays in sync as components are added
         """
-        return [
-            component for component in self.list_components()
-            if component.category == category]
+        if self._categories is None:
+            return _NO_COMPONENTS.values()
+        return self._categories.get(category, _NO_COMPONENTS).values()
 
     def add_component(self, id, *args, **kwargs):
         """
         Add a component
         """
-        key = self.component_key(id)
-        if key in self._components:
+        if id in self._components:
             raise Exception("Component Already Exists")
-        self._components[key] = self._component_type(id, *args, **kwargs)
-        return self._components[key]
+        return self.attach_component(
+            self._component_type(id, *args, **kwargs))
+
+    def attach_component(self, component):
+        """
+        Adopt an existing component, along with everything under it
+        """
+        if component.id in self._components:
+            raise Exception("Component Already Exists")
+        component.parent = self
+        self._components.add(component.id, component)
+        category = getattr(component, 'category', None)
+        if category is not None:
+            self._categories.setdefault(category, {})[component.id] = \
+                component
+        # Whatever it is consuming is on our bill now
+        self._add_watts(component.current_watts())
+        self._attach_budgets([component])
+        return component
+
+    def attach_components(self, components):
+        """
+        Adopt many new components in one go. Ids must not be taken yet,
+        that is up to the caller.
+        """
+        if not isinstance(components, list):
+            components = list(components)
+        categories = self._categories
+        watts = 0
+        for component in components:
+            component.parent = self
+            category = getattr(component, 'category', None)
+            if category is not None:
+                categories.setdefault(category, {})[component.id] = component
+            watts += component.current_watts()
+        self._components.extend(components)
+        self._add_watts(watts)
+        self._attach_budgets(components)
+        return components
+
+    def _attach_budgets(self, components):
+        self._add_caps(sum(component.cap() for component in components))
+        self.budget_policy.attached(self, components)
+
+    def _add_caps(self, caps):
+        """
+        Put `caps` more (or less) on the caps of the components of this
+        model. Those above follow suit, as long as they go by them.
+        """
+        model = self
+        while caps:
+            model._caps += caps
+            model._budget_version += 1
+            model.budget_policy.caps_changed(model)
+            if model._cap is not None or model.parent is None:
+                return
+            model = model.parent
+
+    def _add_watts(self, watts):
+        """
+        Put `watts` more (or less) on the bill of this model & those above
+        """
+        if not watts:
+            return
+        now = clock.now()
+        model = self
+        while model is not None:
+            model._accrue(now)
+            model._watts += watts
+            model = model.parent
 
     def append_component(self, *args, **kwargs):
         """
         A shoutcut to add more components
         """
-        component_id = len(self.list_components())
+        component_id = len(self._components)
         return self.add_component(component_id, *args, **kwargs)
 
     def init_components(self, component_count, *args, **kwargs):
@@ -100,6 +356,125 @@ class BaseModel:
             self.add_component(component_id, *args, **kwargs)
         return self._components
 
+    def current_watts(self):
+        """
+        Amout of watts consumed at the moment
+        """
+        return self._watts
+
+    def cap(self):
+        """
+        Watts this model may consume by it's own rights
+        """
+        if self._cap is not None:
+            return self._cap
+        return self._caps
+
+    def set_cap(self, watts):
+        """
+        Cap this model at `watts`. None goes back to the default.
+        Those above that go by the caps of their components follow suit.
+        """
+        delta = -self.cap()
+        self._cap = watts
+        self._budget_version += 1
+        delta += self.cap()
+        if self.parent is not None:
+            self.parent._add_caps(delta)
+        self.budget_changed()
+
+    def set_budget_policy(self, policy):
+        """
+        Share what this model is allowed among it's components by `policy`
+        (see `prana.budget`)
+        """
+        policy.attached(self, self.list_components())
+        self.budget_policy = policy
+        self._budget_version += 1
+        self.budget_changed()
+
+    def max_watts(self):
+        """
+        Max watts allowed under this model, as things stand
+        """
+        if self.parent is None:
+            return self.cap()
+        return self.parent.allowance(self)
+
+    def allowance(self, component):
+        """
+        Max watts allowed for `component`, as things stand
+        """
+        return self.budget_policy.allowance(self, component, self.max_watts())
+
+    def budget_changed(self):
+        """
+        Caps or policies under this model changed. Pass it up.
+        """
+        if self.parent is not None:
+            self.parent.budget_changed()
+
+    def appliance_switched(self, appliance, delta, now):
+        """
+        Invoked when an appliance under this model changes it's status (at
+        `now`). Keeps the running watt & energy counters in sync all the
+        way up to the top.
+        """
+        self._accrue(now)
+        self._watts += delta
+        if self.parent is not None:
+            self.parent.appliance_switched(appliance, delta, now)
+
+    def _accrue(self, now):
+        """
+        Add what was consumed since the last change of watts to the energy
+        count. Must come before every change of `_watts`.
+        """
+        since = self._accrued_at
+        if since is None:
+            if self._rollup_minutes:
+                self._rollup = Rollup(self._rollup_minutes, now)
+        elif now > since:
+            joules = self._joules
+            self._joules = joules + self._watts * (now - since)
+            if self._rollup is not None:
+                self._rollup.record(joules, self._watts, since, now)
+        else:
+            # Somebody got in with a later time, carry on from there
+            return
+        self._accrued_at = now
+
+    def _energy_at(self, moment):
+        since = self._accrued_at
+        if since is None:
+            return 0.0
+        if moment >= since:
+            return self._joules + self._watts * (moment - since)
+        if self._rollup is None:
+            raise ValueError(
+                "%s %d only knows the energy since it's last change" % (
+                    self.__class__.__name__, self.id))
+        return self._rollup.energy_at(moment, self._joules, since)
+
+    def energy(self, start=None, end=None):
+        """
+        Joules consumed under this model between `start` & `end` (as per
+        `prana.clock`), all of it till now by default
+        """
+        if end is None:
+            end = clock.now()
+        energy = self._energy_at(end)
+        if start is not None:
+            energy -= self._energy_at(start)
+        return energy
+
+    def schedule_expiry(self, sensor, expiry):
+        """
+        A sensor under this model will time-out at `expiry`. Pass it up.
+        """
+        if self.parent is not None:
+            self.parent.schedule_expiry(sensor, expiry)
+
     def __str__(self):
         return '%s(%d) {%s}' % (
             self.__class__.__name__, self.id, self.list_components())
@@ -112,6 +487,8 @@ class CategoryModel(BaseModel):
     """
     Abstract Model to handle category
     """
+    __slots__ = ('category',)
+
     def __init__(self, id, category):
         super(CategoryModel, self).__init__(id)
         self.category = category
@@ -121,26 +498,38 @@ class Appliance(CategoryModel):
     """
     TV / AC / LIGHTS
     """
-
-    # Appliances are switched off by default
-    status = ApplianceStatus.OFF
+    __slots__ = ('status',)
 
     def __init__(self, id, category):
         super(Appliance, self).__init__(id, category)
+        # Appliances are switched off by default
+        self.status = ApplianceStatus.OFF
+
+    def set_status(self, status):
+        """
+        Change the status & let the owners know how the watts moved
+        """
+        if self.status == status:
+            return self.status
+        self.status = status
+        delta = ApplianceCategory.watts(self.category)
+        if status == ApplianceStatus.OFF:
+            delta = -delta
+        if self.parent is not None:
+            self.parent.appliance_switched(self, delta, clock.now())
+        return self.status
 
     def switch_on(self):
         """
         Switch on the Appliance
         """
-        self.status = ApplianceStatus.ON
-        return self.status
+        return self.set_status(ApplianceStatus.ON)
 
     def switch_off(self):
         """
         Switch off the Appliance
         """
-        self.status = ApplianceStatus.OFF
-        return self.status
+        return self.set_status(ApplianceStatus.OFF)
 
     def current_watts(self):
         """
@@ -150,32 +539,71 @@ class Appliance(CategoryModel):
             return 0
         return ApplianceCategory.watts(self.category)
 
+    def energy(self, start=None, end=None):
+        """
+        Joules consumed between `start` & `end`, as kept by the corridor.
+        Nothing before it was last switched is kept.
+        """
+        if self.parent is None:
+            return 0.0
+        if end is None:
+            end = clock.now()
+        energy = self.parent.appliance_energy_at(self, end)
+        if start is not None:
+            energy -= self.parent.appliance_energy_at(self, start)
+        return energy
+
 
 class Sensor(CategoryModel):
     """
     Motion, Pressure sensor
     """
+    __slots__ = ('last_activity',)
 
-    def __init__(self, id, category, timeout=SENSOR_TIMEOUT):
+    def __init__(self, id, category, timeout=SENSOR_TIMEOUT, now=None):
         super(Sensor, self).__init__(id, category)
-        # While init, make sure `last_activity` is twide the timeout
+        self.reset(now, timeout)
+
+    def reset(self, now=None, timeout=SENSOR_TIMEOUT):
+        """
+        Forget about any activity seen so far
+        """
+        if now is None:
+            now = clock.now()
+        # Make sure `last_activity` is twide the timeout
         # Which ensures we have not received any actionbale activities yet!
         # Thus gicing us a clean slate to work with
-        self.last_activity = datetime.now() - timedelta(minutes=2*timeout)
+        self.last_activity = now - 2 * timeout * 60
 
-    def register_activity(self):
+    def register_activity(self, timestamp=None):
         """
-        Invoked when given sensor detected an activity
+        Invoked when given sensor detected an activity.
+        `timestamp` is when it happened (as per `prana.clock`), if it
+        wasn't just now.
         """
-        self.last_activity = datetime.now()
+        if timestamp is None:
+            timestamp = clock.now()
+        elif timestamp < self.last_activity:
+            # A late event does not make the sensor any fresher
+            return self.last_activity
+        self.last_activity = timestamp
+        if self.parent is not None:
+            self.parent.schedule_expiry(self, self.expiry())
         return self.last_activity
 
-    def is_active(self):
+    def expiry(self):
+        """
+        When does (or did) this sensor time-out?
+        """
+        return self.last_activity + SENSOR_TIMEOUT_SECONDS
+
+    def is_active(self, now=None):
         """
         Has it timed-out since last activity yet?
         """
-        expiry = self.last_activity + timedelta(minutes=SENSOR_TIMEOUT)
-        return datetime.now() < expiry
+        if now is None:
+            now = clock.now()
+        return now < self.last_activity + SENSOR_TIMEOUT_SECONDS
 
 
 class Corridor(CategoryModel):
@@ -184,56 +612,141 @@ class Corridor(CategoryModel):
     """
     _component_type = Appliance
     _sensors = None
+    # Appliance id => [joules, when it was last switched], for appliances
+    # that have been on. Made once needed.
+    _appliance_energy = None
 
     def __init__(self, id, category):
         super(Corridor, self).__init__(id, category)
-        self._sensors = {}
+        self._sensors = ComponentStore()
+
+    def attach_component(self, appliance):
+        super(Corridor, self).attach_component(appliance)
+        self._meter_appliances([appliance])
+        return appliance
+
+    def attach_components(self, appliances):
+        appliances = super(Corridor, self).attach_components(appliances)
+        self._meter_appliances(appliances)
+        return appliances
+
+    def _meter_appliances(self, appliances):
+        """
+        Start counting the energy of appliances that come in switched on
+        """
+        now = None
+        for appliance in appliances:
+            if appliance.status == ApplianceStatus.ON:
+                if now is None:
+                    now = clock.now()
+                if self._appliance_energy is None:
+                    self._appliance_energy = {}
+                self._appliance_energy[appliance.id] = [0.0, now]
+
+    def appliance_switched(self, appliance, delta, now):
+        if self._appliance_energy is None:
+            self._appliance_energy = {}
+        meter = self._appliance_energy.get(appliance.id)
+        if meter is None:
+            self._appliance_energy[appliance.id] = [0.0, now]
+        elif now > meter[1]:
+            if delta < 0:
+                # It was on till now
+                meter[0] -= delta * (now - meter[1])
+            meter[1] = now
+        super(Corridor, self).appliance_switched(appliance, delta, now)
+
+    def appliance_energy_at(self, appliance, moment):
+        """
+        Joules `appliance` had consumed as of `moment`
+        """
+        meter = None
+        if self._appliance_energy is not None:
+            meter = self._appliance_energy.get(appliance.id)
+        if meter is None:
+            return 0.0
+        joules, since = meter
+        if moment < since:
+            raise ValueError(
+                "Appliance %d only knows the energy since it was last "
+                "switched" % appliance.id)
+        return joules + appliance.current_watts() * (moment - since)
+
+    def cap(self):
+        if self._cap is not None:
+            return self._cap
+        return CorridorCategory.multiplier(self.category)
 
     def sensor_key(self, id):
         """
-        Generic way of creating component_key
+        Generic way of naming a sensor. Sensors are stored by id.
         """
         return "sensor%d" % id
 
     def get_sensor(self, id):
-        key = self.sensor_key(id)
-        return self._sensors[key]
+        return self._sensors[id]
 
     def list_sensors(self):
         return list(self._sensors.values())
 
+    def iter_sensors(self):
+        return self._sensors.values()
+
     def add_sensor(self, id, sensor_category):
-        key = self.sensor_key(id)
-        if key in self._sensors:
+        if id in self._sensors:
             raise Exception("Sensor Already Exists")
-        self._sensors[key] = Sensor(id, sensor_category)
-        return self._sensors[key]
+        sensor = Sensor(id, sensor_category)
+        sensor.parent = self
+        self._sensors.add(id, sensor)
+        return sensor
 
     def append_sensor(self, sensor_category):
-        sensor_id = len(self.list_sensors())
+        sensor_id = len(self._sensors)
         return self.add_sensor(sensor_id, sensor_category)
 
-    def is_active(self):
+    def attach_sensors(self, sensors):
         """
-        Can appliances in this room be optimized?
+        Adopt many new sensors in one go
         """
-        sensors = self.list_sensors()
         for sensor in sensors:
-            if sensor.is_active():
+            sensor.parent = self
+        self._sensors.extend(sensors)
+        return sensors
+
+    def is_active(self, now=None):
+        """
+        Can appliances in this room be optimized?
+        """
+        for sensor in self.iter_sensors():
+            if sensor.is_active(now):
                 return True
         return False
 
+    def last_activity(self):
+        """
+        When did any sensor in here last see something? Never (minus
+        infinity) if there are no sensors.
+        """
+        return max(
+            (sensor.last_activity for sensor in self.iter_sensors()),
+            default=float('-inf'))
+
     def optimize(self, appliance_category):
         """
-        Try to conserve some energy
+        Try to conserve some energy.
+        Returns how many appliances were switched off.
         """
         if self.is_active():
-            return
+            return 0
+        shed = 0
         for appliance in self.filtered_appliances(appliance_category):
-            appliance.switch_off()
+            if appliance.status == ApplianceStatus.ON:
+                appliance.switch_off()
+                shed += 1
+        return shed
 
     def switch_off_all(self):
-        for appliance in self.list_appliances():
+        for appliance in self.iter_appliances():
             appliance.switch_off()
 
     def switch_on_appliances(self, appliance_category):
@@ -266,42 +779,87 @@ class Floor(BaseModel):
             corridor=CorridorCategory.MAIN, appliance=ApplianceCategory.LIGHT),
     ]
 
+    _transient = ('lock', 'shedder', '_allowance')
+
+    _rollup_minutes = ENERGY_ROLLUP_MINUTES_FLOOR
+
+    # Decides what to switch off when over budget, see `prana.shedding`
+    shedder_class = HeapShedder
+
+    # Corridors share the floor's budget
+    budget_policy = Pool()
+
     def __init__(self, id):
         super(Floor, self).__init__(id)
+        self._init_transient()
+
+    def _init_transient(self):
+        # Anyone changing things on this floor holds this lock
+        self.lock = threading.RLock()
+        self.shedder = self.shedder_class(self)
+        # Unpickled, there may be something shed already
+        self.shedder.recover()
+        # (building, it's budget version, allowance) See `Building.allowance`
+        self._allowance = None
+
+    def set_budget_policy(self, policy):
+        # Shedding goes by the floor's budget as a whole, nothing would
+        # hold corridors to their allowances
+        if not isinstance(policy, Pool):
+            raise ValueError(
+                "Corridors can only pool their floor's budget, not %s" %
+                policy.__class__.__name__)
+        with self.lock:
+            super(Floor, self).set_budget_policy(policy)
 
     def max_watts(self):
+        # What the building worked out last time, if it still holds (see
+        # `Building.allowance`)
+        cached = self._allowance
+        if cached is not None:
+            building, version, watts = cached
+            if building is self.parent and \
+                    version == building._budget_version:
+                return watts
+        return super(Floor, self).max_watts()
+
+    def energy(self, start=None, end=None):
+        with self.lock:
+            return super(Floor, self).energy(start, end)
+
+    def appliance_switched(self, appliance, delta, now):
         """
-        Max watts allowed on this floor
-        """
-        return sum([
-            CorridorCategory.multiplier(corridor.category)
-            for corridor in self.list_corridors()])
-
-    def current_watts(self):
-        """
-        Amout of watts consumed at the moment
+        Status changed somewhere on this floor. Flag it for the building.
         """
-        watts = 0
-        for corridor in self.list_corridors():
-            for appliance in corridor.list_appliances():
-                watts += appliance.current_watts()
-        return watts
+        super(Floor, self).appliance_switched(appliance, delta, now)
+        self.budget_policy.switched(self, appliance.parent, delta)
+        self.shedder.appliance_switched(appliance, delta)
+        if self.parent is not None:
+            self.parent.mark_dirty(self)
 
     def boot(self):
-        [corridor.boot() for corridor in self.list_corridors()]
-        if TIME_SLOT_CURRENT is TIME_SLOT_DAY:
+        for corridor in self.iter_corridors():
+            corridor.boot()
+        if self.time_slot() == TIME_SLOT_DAY:
             return
         for rule in self._appliances_always_on:
             for corridor in self.filtered_corridors(rule['corridor']):
                 corridor.switch_on_appliances(rule['appliance'])
 
-    def is_active(self):
+    def time_slot(self):
+        """
+        Day or night? The building decides.
+        """
+        if self.parent is None:
+            return TIME_SLOT_CURRENT
+        return self.parent.time_slot
+
+    def is_active(self, now=None):
         """
         Can appliances in this room be optimized?
         """
-        corridors = self.list_corridors()
-        for corridor in corridors:
-            if corridor.is_active():
+        for corridor in self.iter_corridors():
+            if corridor.is_active(now):
                 return True
         return False
 
@@ -309,50 +867,594 @@ class Floor(BaseModel):
         """
         Can appliances in this room be optimized?
         """
-        corridors = self.list_corridors()
-        for corridor in corridors:
+        for corridor in self.iter_corridors():
             corridor.switch_off_all()
 
-    def refresh(self):
-        if self.is_active():
-            return
+    def refresh(self, now=None):
+        """
+        Bring the floor back to defaults once all it's sensors time out.
+        Returns True if it did.
+        """
+        if self.is_active(now):
+            return False
         self.switch_off_all()
+        self.shedder.reset()
         self.boot()
+        return True
 
-    def optimize(self):
+    def optimize(self, trace=None):
         """
-        Optimize appliances
+        Optimize appliances, as the shedder sees fit. Returns how many were
+        switched off. Decisions get spans in `trace`, if given
+        (see `prana.tracing`).
         """
-        if self.current_watts() <= self.max_watts():
-            return
-        for rule in self._appliances_expendable:
-            corridors = self.filtered_corridors(rule['corridor'])
-            for corridor in corridors:
-                corridor.optimize(rule['appliance'])
+        excess = self.current_watts() - self.max_watts()
+        if excess <= 0 and -excess < self.shedder.room_wanted:
+            # Where a floor mostly sits: Nothing to shed, & not enough room
+            # to give anything back
+            return 0
+        return self.shedder.optimize(excess, trace)
 
 
 class Building(BaseModel):
+    """
+    Safe to use from many threads: Every operation on a floor holds that
+    floor's lock, so events on different floors go on in parallel.
+    Things shared by all floors (watts, dirty floors, expiry heap) sit
+    behind a building-wide lock that is only ever held very briefly.
+
+    Lock order is: Floor locks (by floor id), then the building lock.
+    """
 
     _component_type = Floor
+    _transient = ('_lock', '_local', 'metrics', 'tracer')
+
+    # Where timings & counts go, see `prana.metrics`. None keeps it all off.
+    metrics = None
+    # Follows sampled events through, see `prana.tracing`. None for off.
+    tracer = None
+
+    _rollup_minutes = ENERGY_ROLLUP_MINUTES_BUILDING
 
     def __init__(self, id=0):
         super(Building, self).__init__(id)
+        # Floors that have changed since they were last brought to defaults
+        self._dirty_floors = {}
+        # Min-heap of (expiry, floor_id, corridor_id, sensor_id)
+        self._expiry = []
+        self.time_slot = TIME_SLOT_CURRENT
+        # Whoever needs to hear about appliances being switched
+        self._actuators = []
+        self._subscribers = []
+        self._recorders = []
+        self._init_transient()
+
+    def _init_transient(self):
+        self._lock = threading.Lock()
+        # Per thread bits, like the transaction the thread is in
+        self._local = threading.local()
+
+    @classmethod
+    def from_spec(klass, spec):
+        """
+        Lay out a whole building from a spec (a dict, or JSON of one):
+
+            {
+                "id": 0,
+                "layouts": {
+                    "standard": [
+                        {"category": "MAIN", "appliances": ["AC", "LIGHT"],
+                         "sensors": ["MOTION"]},
+                        {"category": "SUB", "count": 2,
+                         "appliances": ["AC", "LIGHT"],
+                         "sensors": ["MOTION"]}
+                    ]
+                },
+                "floors": [
+                    {"ids": "0-79", "layout": "standard"},
+                    {"ids": 80, "corridors": [...]}
+                ]
+            }
+
+        Corridors are numbered from 0 on each floor, as are appliances &
+        sensors in each corridor. Everything is built & attached in bulk.
+        Nothing is booted.
+        """
+        if isinstance(spec, (str, bytes)):
+            spec = json.loads(spec)
+        # Nothing but fresh objects here, the garbage collector would only
+        # keep looking at them over & over
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return klass._from_spec(spec)
+        finally:
+            if collecting:
+                gc.enable()
+
+    @classmethod
+    def _from_spec(klass, spec):
+        layouts = spec.get('layouts', {})
+        now = clock.now()
+        floors = []
+        taken = set()
+        for entry in spec['floors']:
+            corridors = entry.get('corridors')
+            if corridors is None:
+                corridors = layouts[entry['layout']]
+            # Work the categories out once for every floor alike
+            plan = []
+            for corridor in corridors:
+                plan.extend([(
+                    _spec_category(CorridorCategory, corridor['category']),
+                    [_spec_category(ApplianceCategory, category)
+                     for category in corridor.get('appliances', ())],
+                    [_spec_category(SensorCategory, category)
+                     for category in corridor.get('sensors', ())],
+                )] * corridor.get('count', 1))
+            for floor_id in _spec_ids(entry['ids']):
+                if floor_id in taken:
+                    raise ValueError(
+                        "Floor %d is in the spec twice" % floor_id)
+                taken.add(floor_id)
+                floor = Floor(floor_id)
+                corridors = []
+                for corridor_id, (category, appliances, sensors) in \
+                        enumerate(plan):
+                    corridor = Corridor(corridor_id, category)
+                    corridor.attach_appliances([
+                        Appliance(id, category)
+                        for id, category in enumerate(appliances)])
+                    corridor.attach_sensors([
+                        Sensor(id, category, now=now)
+                        for id, category in enumerate(sensors)])
+                    corridors.append(corridor)
+                floor.attach_corridors(corridors)
+                floors.append(floor)
+        building = klass(spec.get('id', 0))
+        building.attach_floors(floors)
+        return building
+
+    def add_actuator(self, actuator):
+        """
+        `actuator` gets called with a list of `Transition` every time
+        appliances actually have to be switched
+        """
+        self._actuators.append(actuator)
 
-    def boot(self):
-        [floor.boot() for floor in self.list_floors()]
+    def subscribe(self, subscriber):
+        """
+        `subscriber` gets called with a list of `ChangeEvent` for every
+        batch of appliances that changed status. See `prana.changes`.
+        """
+        self._subscribers.append(subscriber)
+        return subscriber
 
-    def refresh(self):
-        for floor in self.list_floors():
-            floor.refresh()
+    def unsubscribe(self, subscriber):
+        self._subscribers.remove(subscriber)
 
-    def optimize(self):
-        [floor.optimize() for floor in self.list_floors()]
+    def add_recorder(self, recorder):
+        """
+        `recorder` is told about every sensor activity
+        (`record_activity(sensor)`) & every appliance switch
+        (`record_switch(appliance)`) right away, with the floor's lock
+        held. So it sees things in the order they happened on each floor,
+        switches that cancel out included. See `prana.journal`.
+        """
+        self._recorders.append(recorder)
+        return recorder
 
-    def register_activity(self, floor_id, corridor_id, sensor_id):
+    def _record_activity(self, sensor):
+        for recorder in self._recorders:
+            recorder.record_activity(sensor)
+
+    def _transition(self, appliance, old):
+        corridor = appliance.parent
+        return Transition(
+            corridor.parent.id, corridor.id, appliance.id, old,
+            appliance.status)
+
+    def _actuate(self, transitions, switched):
+        """
+        Let actuators & subscribers know. `switched` are the appliances
+        behind `transitions`, in the same order.
+        """
+        for actuator in self._actuators:
+            actuator(transitions)
+        if not self._subscribers:
+            return
+        now = clock.now()
+        events = []
+        for transition, appliance in zip(transitions, switched):
+            watts = ApplianceCategory.watts(appliance.category)
+            if transition.new == ApplianceStatus.OFF:
+                watts = -watts
+            events.append(ChangeEvent(self.id, *transition, now, watts))
+        for subscriber in self._subscribers:
+            subscriber(events)
+
+    def _measure(self, operation, start, shed=0):
+        """
+        Let the metrics know how long `operation` took, since `start`
+        """
+        metrics = self.metrics
+        metrics.observe(operation, perf_counter() - start)
+        if shed:
+            metrics.count('shed', shed)
+
+    def energy(self, start=None, end=None):
+        with self._lock:
+            return super(Building, self).energy(start, end)
+
+    def appliance_switched(self, appliance, delta, now):
+        with self._lock:
+            self._accrue(now)
+            self._watts += delta
+            self.budget_policy.switched(self, appliance.parent.parent, delta)
+        for recorder in self._recorders:
+            recorder.record_switch(appliance)
+        if self.metrics is not None:
+            self.metrics.count(
+                'switch_on' if delta > 0 else 'switch_off')
+        old = ApplianceStatus.OFF if delta > 0 else ApplianceStatus.ON
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            if self._actuators or self._subscribers:
+                self._actuate(
+                    [self._transition(appliance, old)], [appliance])
+        elif appliance not in pending:
+            pending[appliance] = old
+
+    def set_budget_policy(self, policy):
+        with self.locked():
+            with self._lock:
+                policy.attached(self, self.list_floors())
+                self.budget_policy = policy
+                self._budget_version += 1
+            self.budget_changed()
+
+    def allowance(self, floor):
+        # Asked on every optimize of every floor. As long as the policy
+        # goes by caps alone, what was worked out here still holds till
+        # caps or policy change: The floor keeps it (see `Floor.max_watts`).
+        with self._lock:
+            version = self._budget_version
+            watts = super(Building, self).allowance(floor)
+        if self.budget_policy.steady and self.parent is None:
+            floor._allowance = (self, version, watts)
+        return watts
+
+    def budget_changed(self):
+        """
+        Any floor's budget may have changed. Let optimize have a look.
+        """
+        floors = self.list_floors()
+        with self._lock:
+            for floor in floors:
+                self._dirty_floors[floor.id] = floor
+
+    def rebalance(self):
+        """
+        Floors that borrowed power which is wanted back (see
+        `prana.budget.Lend`) give it back. Returns how many appliances
+        were switched off.
+        """
+        with self._lock:
+            floors = self.budget_policy.overdrawn(self)
+        if not floors:
+            return 0
+        shed = 0
+        with self.transaction():
+            for floor in floors:
+                with floor.lock:
+                    shed += floor.optimize()
+        return shed
+
+    @contextmanager
+    def transaction(self):
+        """
+        Switches made by this thread within the block are only sent to the
+        actuators (& subscribers) at the end, and only those that still make
+        a difference.
+        Switching something on & off again costs no actuator traffic.
+
+        Yields a list, which is filled with the net transitions at the end.
+        Nested transactions are sent along with the outermost one.
+        """
+        outer = getattr(self._local, 'pending', None)
+        self._local.pending = pending = {}
+        transitions = []
+        switched = []
+        try:
+            yield transitions
+        finally:
+            self._local.pending = outer
+            for appliance, old in pending.items():
+                if outer is not None and appliance not in outer:
+                    outer[appliance] = old
+                if appliance.status != old:
+                    transitions.append(self._transition(appliance, old))
+                    switched.append(appliance)
+            if outer is None and transitions:
+                self._actuate(transitions, switched)
+
+    def attach_component(self, floor):
+        """
+        Adopt a floor, keeping an eye on the sensors that are still active
+        """
+        super(Building, self).attach_component(floor)
+        self._watch_sensors([floor])
+        return floor
+
+    def attach_components(self, floors):
+        floors = super(Building, self).attach_components(floors)
+        self._watch_sensors(floors)
+        return floors
+
+    def _watch_sensors(self, floors):
+        now = clock.now()
+        for floor in floors:
+            for corridor in floor.iter_corridors():
+                for sensor in corridor.iter_sensors():
+                    if sensor.is_active(now):
+                        self.schedule_expiry(sensor, sensor.expiry())
+                        self.mark_dirty(floor)
+
+    def mark_dirty(self, floor):
+        """
+        Remember that `floor` needs attention on next optimize / refresh
+        """
+        with self._lock:
+            self._dirty_floors[floor.id] = floor
+
+    def dirty_floors(self, full=False):
+        """
+        Floors that need attention. `full` gives every floor there is.
+        """
+        if full:
+            return self.list_floors()
+        with self._lock:
+            return list(self._dirty_floors.values())
+
+    @contextmanager
+    def locked(self, floors=None):
+        """
+        Hold the locks of `floors` (all of them by default) for the block,
+        so that nobody changes anything on them in the meanwhile
+        """
+        if floors is None:
+            floors = self.list_floors()
+        floors = sorted(floors, key=lambda floor: floor.id)
+        for index, floor in enumerate(floors):
+            try:
+                floor.lock.acquire()
+            except BaseException:
+                floors = floors[:index]
+                raise
+        try:
+            yield floors
+        finally:
+            for floor in reversed(floors):
+                floor.lock.release()
+
+    def snapshot(self):
+        """
+        A consistent picture of the whole building, as of one moment:
+        floor_id => dict(current_watts, max_watts, statuses), where
+        statuses are (corridor_id, appliance_id) => status
+        """
+        with self.locked() as floors:
+            return {
+                floor.id: dict(
+                    current_watts=floor.current_watts(),
+                    max_watts=floor.max_watts(),
+                    statuses={
+                        (corridor.id, appliance.id): appliance.status
+                        for corridor in floor.iter_corridors()
+                        for appliance in corridor.iter_appliances()})
+                for floor in floors}
+
+    def boot(self):
+        with self.transaction():
+            for floor in self.list_floors():
+                with floor.lock:
+                    floor.boot()
+                    # Freshly booted floors are at defaults, nothing to do
+                    with self._lock:
+                        self._dirty_floors.pop(floor.id, None)
+
+    def reset(self, now=None):
+        """
+        Start over: Every sensor timed-out & every floor at defaults
+        """
+        if now is None:
+            now = clock.now()
+        with self.transaction(), self.locked() as floors:
+            for floor in floors:
+                for corridor in floor.iter_corridors():
+                    for sensor in corridor.iter_sensors():
+                        sensor.reset(now)
+                        self._record_activity(sensor)
+                floor.switch_off_all()
+                floor.shedder.reset()
+            with self._lock:
+                del self._expiry[:]
+            self.boot()
+
+    def set_time_slot(self, time_slot):
+        """
+        Day turned to night (or the other way around).
+        Floors with nobody around are brought to the new defaults.
+        """
+        if time_slot == self.time_slot:
+            return
+        self.time_slot = time_slot
+        self.refresh(full=True)
+
+    def schedule_expiry(self, sensor, expiry):
+        """
+        Remember when the sensor times-out, so `tick` need not poll for it
+        """
+        corridor = sensor.parent
+        with self._lock:
+            heapq.heappush(
+                self._expiry,
+                (expiry, corridor.parent.id, corridor.id, sensor.id))
+
+    def next_expiry(self):
+        """
+        When is the next sensor going to time-out? None if none is.
+        """
+        with self._lock:
+            while self._expiry:
+                expiry, floor_id, corridor_id, sensor_id = self._expiry[0]
+                sensor = self.get_floor(floor_id).get_corridor(
+                    corridor_id).get_sensor(sensor_id)
+                if sensor.expiry() == expiry:
+                    return expiry
+                # There was activity since, drop the stale entry
+                heapq.heappop(self._expiry)
+        return None
+
+    def refresh_floor(self, floor, now=None):
+        """
+        Refresh a single floor & forget about it once it is at defaults
+        """
+        start = perf_counter() if self.metrics is not None else None
+        with self.transaction(), floor.lock:
+            if floor.refresh(now):
+                with self._lock:
+                    self._dirty_floors.pop(floor.id, None)
+        if start is not None:
+            self._measure('refresh_floor', start)
+
+    def tick(self, now=None):
+        """
+        Refresh only the floors whose sensors timed-out since the last tick.
+        Returns the floors that were looked at.
+        """
+        if now is None:
+            now = clock.now()
+        start = perf_counter() if self.metrics is not None else None
+        floors = {}
+        expired = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expiry, floor_id, corridor_id, sensor_id = \
+                    heapq.heappop(self._expiry)
+                floor = self.get_floor(floor_id)
+                sensor = floor.get_corridor(corridor_id).get_sensor(sensor_id)
+                if sensor.expiry() != expiry:
+                    # There was activity since, a later entry takes care
+                    continue
+                floors[floor_id] = floor
+                expired += 1
+        with self.transaction():
+            for floor in floors.values():
+                self.refresh_floor(floor, now)
+        if start is not None:
+            self.metrics.count('sensor_expirations', expired)
+            self._measure('tick', start)
+        return list(floors.values())
+
+    def refresh(self, full=False):
+        with self.transaction():
+            for floor in self.dirty_floors(full):
+                self.refresh_floor(floor)
+
+    def optimize(self, full=False):
+        start = perf_counter() if self.metrics is not None else None
+        shed = 0
+        with self.transaction():
+            for floor in self.dirty_floors(full):
+                with floor.lock:
+                    shed += floor.optimize()
+        if start is not None:
+            self._measure('optimize', start, shed)
+
+    def register_activity(
+            self, floor_id, corridor_id, sensor_id, timestamp=None):
+        """
+        A sensor saw something. `timestamp` (as per `prana.clock`) is when,
+        so that backlogged events are aged correctly.
+        """
+        start = perf_counter() if self.metrics is not None else None
+        # Sampled events get a span for every stage, see `prana.tracing`
+        trace = self.tracer.start() if self.tracer is not None else None
+        if trace is not None:
+            began = perf_counter()
         floor = self.get_floor(floor_id)
         corridor = floor.get_corridor(corridor_id)
         sensor = corridor.get_sensor(sensor_id)
-        sensor.register_activity()
-        for appliance in corridor.list_appliances():
-            appliance.switch_on()
-        return self.optimize()
+        with self.transaction() as transitions:
+            with floor.lock:
+                sensor.register_activity(timestamp)
+                self._record_activity(sensor)
+                self.mark_dirty(floor)
+                if trace is not None:
+                    mark = perf_counter()
+                for appliance in corridor.iter_appliances():
+                    appliance.switch_on()
+                if trace is not None:
+                    trace.span('switch_on', mark)
+                    mark = perf_counter()
+                # Only this floor could have changed, leave the rest alone
+                shed = floor.optimize(trace)
+                if trace is not None:
+                    trace.span('floor.optimize', mark, shed=shed)
+            # ..but for the floors it may have borrowed from
+            shed += self.rebalance()
+            if trace is not None:
+                mark = perf_counter()
+        if trace is not None:
+            end = perf_counter()
+            trace.span('commit', mark, end, transitions=len(transitions))
+            trace.span(
+                'register_activity', began, end, floor=floor_id,
+                corridor=corridor_id, sensor=sensor_id,
+                transitions=[list(transition) for transition in transitions])
+            trace.finish()
+        if start is not None:
+            self._measure('register_activity', start, shed)
+
+    def register_activities(self, events):
+        """
+        Register a burst of activities in one go.
+
+        `events` is an iterable (or array) of
+        (floor_id, corridor_id, sensor_id[, timestamp]).
+        Every sensor gets updated, but each corridor is switched on just once
+        and each floor is optimized just once.
+        Returns a summary along with the net transitions it caused.
+        """
+        start = perf_counter() if self.metrics is not None else None
+        # Floor => Corridor => [(sensor, timestamp), ..]
+        floors = {}
+        count = 0
+        shed = 0
+        for event in events:
+            floor = self.get_floor(int(event[0]))
+            corridor = floor.get_corridor(int(event[1]))
+            timestamp = event[3] if len(event) > 3 else None
+            floors.setdefault(floor, {}).setdefault(corridor, []).append(
+                (corridor.get_sensor(int(event[2])), timestamp))
+            count += 1
+
+        with self.transaction() as transitions:
+            for floor, corridors in floors.items():
+                with floor.lock:
+                    for corridor, sensors in corridors.items():
+                        for sensor, timestamp in sensors:
+                            sensor.register_activity(timestamp)
+                            self._record_activity(sensor)
+                        for appliance in corridor.iter_appliances():
+                            appliance.switch_on()
+                    self.mark_dirty(floor)
+                    shed += floor.optimize()
+            shed += self.rebalance()
+        if start is not None:
+            self._measure('register_activities', start, shed)
+        return dict(
+            events=count,
+            corridors=sum(len(corridors) for corridors in floors.values()),
+            floors=len(floors), transitions=transitions)
@@ -0,0 +1,180 @@
+"""
+Asyncio runtime
+
+Runs a `Building` inside an event loop:
+
+* Sensor events come in through a bounded `asyncio.Queue` (`submit`), or a
+  local socket (`serve`) feeding that queue. Once the queue is full,
+  producers wait: That is the backpressure.
+* Events are taken off the queue in batches & handed to
+  `Building.register_activities`.
+* Sensor time-outs are not polled for. A single `loop.call_at` timer is
+  kept on the next expiry of the building.
+* Whatever the appliances have to do goes out through an async `sink`,
+  in order, as lists of `Transition`.
+
+A socket client sends one event per line: `floor corridor sensor`.
+
+An event that can't be handled (say, one for a floor that doesn't exist)
+or a sink that fails is logged & left behind. Everything else carries on.
+"""
+
+import asyncio
+import logging
+
+from prana import clock
+
+logger = logging.getLogger(__name__)
+
+
+class Runtime:
+    """
+    Drives `building` from an event loop. `sink` is an async callable that
+    gets lists of `Transition` to act upon.
+    """
+
+    def __init__(self, building, sink=None, maxsize=10000, batch_size=1000):
+        self.building = building
+        self.sink = sink
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.events = None
+        self.commands = None
+        self._loop = None
+        self._tasks = []
+        self._timer = None
+        self._timer_at = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue(self.maxsize)
+        self.commands = asyncio.Queue()
+        self._tasks = [
+            self._loop.create_task(self._consume()),
+            self._loop.create_task(self._send()),
+        ]
+        self.schedule_expiry()
+        return self
+
+    async def stop(self):
+        """
+        Finish what is queued up already, then stop
+        """
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_at = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def drain(self):
+        """
+        Wait till every queued event is handled & it's commands are out
+        """
+        await self.events.join()
+        await self.commands.join()
+
+    async def submit(
+            self, floor_id, corridor_id, sensor_id, timestamp=None):
+        """
+        Queue up a sensor event. Waits while the queue is full.
+        """
+        if timestamp is None:
+            timestamp = clock.now()
+        await self.events.put((floor_id, corridor_id, sensor_id, timestamp))
+
+    async def _consume(self):
+        events = self.events
+        while True:
+            batch = [await events.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(events.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                self._register(batch)
+            except LookupError:
+                # Some event names something that isn't there. Nothing was
+                # done yet, so go one by one to get the rest through.
+                for event in batch:
+                    try:
+                        self._register([event])
+                    except LookupError:
+                        logger.exception("Dropped event %r", event)
+                    except Exception:
+                        logger.exception("Failed on event %r", event)
+            except Exception:
+                logger.exception("Failed on a batch of %d events", len(batch))
+            finally:
+                for _ in batch:
+                    events.task_done()
+
+    def _register(self, batch):
+        summary = self.building.register_activities(batch)
+        self._command(summary['transitions'])
+        self.schedule_expiry()
+
+    def _command(self, transitions):
+        if transitions and self.sink is not None:
+            self.commands.put_nowait(transitions)
+
+    async def _send(self):
+        commands = self.commands
+        while True:
+            transitions = await commands.get()
+            try:
+                await self.sink(transitions)
+            except Exception:
+                logger.exception(
+                    "Sink failed on %d transitions", len(transitions))
+            finally:
+                commands.task_done()
+
+    def schedule_expiry(self):
+        """
+        Make sure the timer goes off when the next sensor times out.
+        Call it if the clock was moved by hand.
+        """
+        expiry = self.building.next_expiry()
+        if expiry is None:
+            return
+        when = self._loop.time() + max(expiry - clock.now(), 0)
+        if self._timer is not None:
+            if self._timer_at <= when:
+                return
+            self._timer.cancel()
+        self._timer = self._loop.call_at(when, self._expire)
+        self._timer_at = when
+
+    def _expire(self):
+        self._timer = self._timer_at = None
+        with self.building.transaction() as transitions:
+            self.building.tick()
+        self._command(transitions)
+        self.schedule_expiry()
+
+    async def _handle(self, reader, writer):
+        try:
+            async for line in reader:
+                try:
+                    floor_id, corridor_id, sensor_id = map(int, line.split())
+                except ValueError:
+                    continue  # Not an event, move on
+                await self.submit(floor_id, corridor_id, sensor_id)
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=0):
+        """
+        Take events from a local socket. Returns the `asyncio.Server`.
+        """
+        return await asyncio.start_server(self._handle, host, port)
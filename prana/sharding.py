@@ -0,0 +1,266 @@
+"""
+Sharding
+
+Floors never touch each other, so there is no reason for one core to do
+all the work. `ShardedController` splits floors (or whole buildings) across
+worker processes. Every worker owns the state of it's shard, events are
+routed to the worker that owns (building, floor) & queries fan out to all
+workers & are merged back.
+"""
+
+import multiprocessing
+
+from prana.models import Building
+
+
+class ShardWorker:
+    """
+    What runs inside a worker process: A bunch of (partial) buildings
+    """
+
+    def __init__(self, buildings):
+        self.buildings = buildings
+
+    def register_activity(
+            self, building_id, floor_id, corridor_id, sensor_id,
+            timestamp=None):
+        self.buildings[building_id].register_activity(
+            floor_id, corridor_id, sensor_id, timestamp)
+
+    def register_activities(self, events):
+        """
+        `events` are (building_id, floor_id, corridor_id, sensor_id[, ts])
+        """
+        per_building = {}
+        for event in events:
+            per_building.setdefault(event[0], []).append(event[1:])
+        summary = dict(events=0, corridors=0, floors=0, transitions=[])
+        for building_id, building_events in per_building.items():
+            result = self.buildings[building_id].register_activities(
+                building_events)
+            for key in ('events', 'corridors', 'floors'):
+                summary[key] += result[key]
+            summary['transitions'].extend(
+                (building_id, transition)
+                for transition in result['transitions'])
+        return summary
+
+    def boot(self):
+        for building in self.buildings.values():
+            building.boot()
+
+    def tick(self, now=None):
+        return [
+            (building_id, floor.id)
+            for building_id, building in self.buildings.items()
+            for floor in building.tick(now)]
+
+    def refresh(self, full=False):
+        for building in self.buildings.values():
+            building.refresh(full)
+
+    def optimize(self, full=False):
+        for building in self.buildings.values():
+            building.optimize(full)
+
+    def watts(self):
+        """
+        (building_id, floor_id) => (current watts, max watts)
+        """
+        return {
+            (building_id, floor.id): (floor.current_watts(), floor.max_watts())
+            for building_id, building in self.buildings.items()
+            for floor in building.iter_floors()}
+
+    def statuses(self):
+        """
+        (building_id, floor_id, corridor_id, appliance_id) => status
+        """
+        return {
+            (building_id, floor.id, corridor.id, appliance.id):
+                appliance.status
+            for building_id, building in self.buildings.items()
+            for floor in building.iter_floors()
+            for corridor in floor.iter_corridors()
+            for appliance in corridor.iter_appliances()}
+
+
+def serve(connection, buildings):
+    """
+    Worker loop: Run whatever the controller asks for, till it says stop
+    """
+    worker = ShardWorker(buildings)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            connection.send((True, getattr(worker, method)(*args)))
+        except Exception as e:
+            connection.send((False, e))
+    connection.close()
+
+
+class ShardedController:
+    """
+    Spread buildings over a pool of worker processes.
+
+    `by` is either 'floor' (floors are dealt to workers one by one) or
+    'building' (each building stays whole within one worker).
+    The buildings handed over now belong to the workers. Talk to them
+    through the controller only.
+
+    Split by floor, each part of a building gets it's share of the
+    building's cap, going by the caps of it's floors. That is what
+    `prana.budget.Strict` would give them anyway. A budget policy that
+    goes by the watts of floors elsewhere (anything not `steady`) can't
+    be split, so such buildings are turned down.
+    """
+
+    def __init__(self, buildings, processes=None, by='floor'):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        shards = [{} for _ in range(processes)]
+        # (building_id, floor_id) => worker index
+        self.routes = {}
+        slot = 0
+        for building in buildings:
+            if by == 'building':
+                shards[slot % processes][building.id] = building
+                for floor in building.iter_floors():
+                    self.routes[(building.id, floor.id)] = slot % processes
+                slot += 1
+                continue
+            if not building.budget_policy.steady:
+                raise ValueError(
+                    "Building %s shares it's budget by the watts of all "
+                    "floors, it can't be split by floor" % building.id)
+            parts = {}
+            for floor in building.list_floors():
+                shard = shards[slot % processes]
+                if building.id not in shard:
+                    shard[building.id] = parts[slot % processes] = \
+                        Building(building.id)
+                    shard[building.id].time_slot = building.time_slot
+                shard[building.id].attach_floor(floor)
+                self.routes[(building.id, floor.id)] = slot % processes
+                slot += 1
+            if building.cap() != building._caps:
+                # The feeder was set: Each part gets it's share of it
+                share = building.cap() / building._caps
+                for part in parts.values():
+                    part.set_cap(part.cap() * share)
+
+        self._connections = []
+        self._processes = []
+        for shard in shards:
+            ours, theirs = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=serve, args=(theirs, shard), daemon=True)
+            process.start()
+            theirs.close()
+            self._connections.append(ours)
+            self._processes.append(process)
+
+    def _receive(self, connection):
+        ok, result = connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def _call(self, shard, method, *args):
+        connection = self._connections[shard]
+        connection.send((method, args))
+        return self._receive(connection)
+
+    def _call_all(self, method, *args, shards=None):
+        """
+        Ask every worker (or the given ones) at once, then gather answers
+        """
+        if shards is None:
+            shards = {shard: args for shard in range(len(self._connections))}
+        for shard, shard_args in shards.items():
+            self._connections[shard].send((method, shard_args))
+        return [
+            self._receive(self._connections[shard]) for shard in shards]
+
+    def register_activity(
+            self, building_id, floor_id, corridor_id, sensor_id,
+            timestamp=None):
+        shard = self.routes[(building_id, floor_id)]
+        return self._call(
+            shard, 'register_activity', building_id, floor_id, corridor_id,
+            sensor_id, timestamp)
+
+    def register_activities(self, events):
+        """
+        `events` are (building_id, floor_id, corridor_id, sensor_id[, ts]).
+        Each worker gets just it's own events, in one go.
+        """
+        per_shard = {}
+        for event in events:
+            shard = self.routes[(event[0], event[1])]
+            per_shard.setdefault(shard, []).append(event)
+        results = self._call_all(
+            'register_activities',
+            shards={shard: (batch,) for shard, batch in per_shard.items()})
+        summary = dict(events=0, corridors=0, floors=0, transitions=[])
+        for result in results:
+            for key in ('events', 'corridors', 'floors'):
+                summary[key] += result[key]
+            summary['transitions'].extend(result['transitions'])
+        return summary
+
+    def boot(self):
+        self._call_all('boot')
+
+    def tick(self, now=None):
+        """
+        Returns (building_id, floor_id) of the floors that were looked at
+        """
+        return sum(self._call_all('tick', now), [])
+
+    def refresh(self, full=False):
+        self._call_all('refresh', full)
+
+    def optimize(self, full=False):
+        self._call_all('optimize', full)
+
+    def watts(self):
+        """
+        (building_id, floor_id) => (current watts, max watts)
+        """
+        merged = {}
+        for result in self._call_all('watts'):
+            merged.update(result)
+        return merged
+
+    def current_watts(self, building_id=None):
+        return sum(
+            current for (b, _), (current, _) in self.watts().items()
+            if building_id is None or b == building_id)
+
+    def statuses(self):
+        """
+        (building_id, floor_id, corridor_id, appliance_id) => status
+        """
+        merged = {}
+        for result in self._call_all('statuses'):
+            merged.update(result)
+        return merged
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
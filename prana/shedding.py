@@ -0,0 +1,252 @@
+"""
+Shedding
+
+What gets switched off when a floor goes over it's power budget (and what
+comes back on once there's room again) is up to the floor's shedder.
+
+`HeapShedder` (the default) sheds just enough: Expendable appliances
+that are on wait in a heap per rule of `Floor._appliances_expendable`,
+the longest idle corridor & the hungriest appliance first. Rules are
+tried in order. Each decision is O(log n) in the appliances on the floor.
+Whatever it sheds goes on a stack, & is switched back on (last shed,
+first back) when the floor has room for it again.
+
+`SweepShedder` is the way it used to be: Every expendable appliance in
+every idle corridor goes off, the moment the floor is over budget.
+
+Pick one for all floors with `Floor.shedder_class`, or for one floor by
+setting `floor.shedder`.
+"""
+
+import heapq
+import itertools
+from time import perf_counter
+
+from prana import clock
+from prana.enums import ApplianceCategory, ApplianceStatus
+
+
+class SweepShedder:
+
+    # Headroom (watts) it takes, with the floor within budget, for there to
+    # be anything to switch back on. The floor doesn't bother the shedder
+    # with less.
+    room_wanted = float('inf')
+
+    def __init__(self, floor):
+        self.floor = floor
+
+    def optimize(self, excess, trace=None):
+        """
+        Switch off expendable appliances of idle corridors, if the floor is
+        over budget (by `excess` watts, under it if negative). Returns how
+        many were switched off. Each corridor looked at gets a span in
+        `trace`, if given (see `prana.tracing`).
+        """
+        if excess <= 0:
+            return 0
+        floor = self.floor
+        shed = 0
+        for rule in floor._appliances_expendable:
+            for corridor in floor.filtered_corridors(rule['corridor']):
+                if trace is None:
+                    shed += corridor.optimize(rule['appliance'])
+                    continue
+                start = perf_counter()
+                count = corridor.optimize(rule['appliance'])
+                trace.span(
+                    'corridor.optimize', start, corridor=corridor.id,
+                    shed=count)
+                shed += count
+        return shed
+
+    def appliance_switched(self, appliance, delta):
+        """
+        An appliance on the floor was switched
+        """
+
+    def reset(self):
+        """
+        The floor is back to defaults (sensors may have been reset as well)
+        """
+
+    def recover(self):
+        """
+        The floor was brought back from elsewhere (a journal, a snapshot or
+        a pickle), appliances & all. Work out what was shed from that.
+        """
+
+
+class HeapShedder(SweepShedder):
+
+    def __init__(self, floor):
+        super(HeapShedder, self).__init__(floor)
+        # One heap per rule, of
+        # (corridor's last activity, -watts, sequence, appliance).
+        # Made on first use.
+        self._heaps = None
+        # (Corridor category, appliance category) => rule's heap
+        self._rules = {}
+        # Appliances in a heap. Each is in just once.
+        self._queued = set()
+        self._sequence = itertools.count()
+        # (Appliance, watts) shed, to be switched back on in reverse. The
+        # one on top is always off.
+        self._shed = []
+        self.room_wanted = float('inf')
+
+    def _build(self):
+        floor = self.floor
+        self._heaps = []
+        for rule in floor._appliances_expendable:
+            key = (rule['corridor'], rule['appliance'])
+            if key in self._rules:
+                continue
+            heap = self._rules[key] = [
+                self._entry(appliance)
+                for corridor in floor.filtered_corridors(rule['corridor'])
+                for appliance in corridor.filtered_appliances(
+                    rule['appliance'])
+                if appliance.status == ApplianceStatus.ON]
+            heapq.heapify(heap)
+            self._queued.update(entry[-1] for entry in heap)
+            self._heaps.append(heap)
+
+    def _entry(self, appliance):
+        return (
+            appliance.parent.last_activity(),
+            -ApplianceCategory.watts(appliance.category),
+            next(self._sequence), appliance)
+
+    def _push(self, heap, appliance):
+        if appliance.status != ApplianceStatus.ON or \
+                appliance in self._queued:
+            return
+        self._queued.add(appliance)
+        heapq.heappush(heap, self._entry(appliance))
+
+    def appliance_switched(self, appliance, delta):
+        if delta < 0:
+            return
+        if self._shed and self._shed[-1][0] is appliance:
+            # Somebody else switched it back on
+            self._settle()
+        if self._heaps is None:
+            return
+        heap = self._rules.get(
+            (appliance.parent.category, appliance.category))
+        if heap is not None:
+            self._push(heap, appliance)
+
+    def optimize(self, excess, trace=None):
+        """
+        Switch off just enough expendable appliances of idle corridors to
+        get the floor within budget, or back on what fits if it's under
+        (`excess` watts over it, negative if under). Returns how many were
+        switched off. Each appliance switched off gets a span in `trace`,
+        if given (see `prana.tracing`).
+        """
+        if excess <= 0:
+            if -excess >= self.room_wanted:
+                self.restore(-excess)
+            return 0
+        if self._heaps is None:
+            self._build()
+        now = clock.now()
+        shed = 0
+        for heap in self._heaps:
+            while excess > 0 and heap:
+                start = perf_counter() if trace is not None else None
+                idle, watts, sequence, appliance = heap[0]
+                if appliance.status != ApplianceStatus.ON:
+                    # Switched off since, it can go
+                    heapq.heappop(heap)
+                    self._queued.discard(appliance)
+                    continue
+                corridor = appliance.parent
+                last_activity = corridor.last_activity()
+                if last_activity != idle:
+                    # There was activity since, get in line again
+                    heapq.heapreplace(
+                        heap, (last_activity, watts, sequence, appliance))
+                    continue
+                if corridor.is_active(now):
+                    # So is every corridor after this one
+                    break
+                heapq.heappop(heap)
+                self._queued.discard(appliance)
+                appliance.switch_off()
+                self._shed.append((appliance, -watts))
+                excess += watts
+                shed += 1
+                if start is not None:
+                    trace.span(
+                        'shed', start, corridor=corridor.id,
+                        appliance=appliance.id, watts=-watts)
+        if shed:
+            self._settle()
+        return shed
+
+    def restore(self, headroom):
+        """
+        Switch back on what was shed, most recent first, while it fits in
+        `headroom` watts. Returns how many were switched on.
+        """
+        restored = 0
+        while self._shed:
+            appliance, watts = self._shed[-1]
+            if appliance.status == ApplianceStatus.ON:
+                # Somebody else got to it
+                self._shed.pop()
+                continue
+            if watts > headroom:
+                break
+            self._shed.pop()
+            appliance.switch_on()
+            headroom -= watts
+            restored += 1
+        self._settle()
+        return restored
+
+    def recover(self):
+        # Corridors boot with every AC on, so an expendable appliance that
+        # is off was shed. Longest idle corridors were shed first, so they
+        # go to the bottom of the stack.
+        self.reset()
+        floor = self.floor
+        shed = []
+        seen = set()
+        for rule in floor._appliances_expendable:
+            key = (rule['corridor'], rule['appliance'])
+            if key in seen:
+                continue
+            seen.add(key)
+            for corridor in floor.filtered_corridors(rule['corridor']):
+                idle = corridor.last_activity()
+                for appliance in corridor.filtered_appliances(
+                        rule['appliance']):
+                    if appliance.status == ApplianceStatus.ON:
+                        continue
+                    watts = ApplianceCategory.watts(appliance.category)
+                    shed.append((
+                        idle, -watts, corridor.id, appliance.id, appliance))
+        shed.sort(key=lambda entry: entry[:4])
+        self._shed = [(entry[-1], -entry[1]) for entry in shed]
+        self._settle()
+
+    def _settle(self):
+        # Whatever is on top of the stack but on again can go, what's left
+        # on top says how much room it takes to restore anything
+        shed = self._shed
+        while shed and shed[-1][0].status == ApplianceStatus.ON:
+            shed.pop()
+        self.room_wanted = shed[-1][1] if shed else float('inf')
+
+    def reset(self):
+        # Everything that is supposed to be on, is. Activity may have gone
+        # back in time too, so the heaps start over.
+        self._heaps = None
+        self._rules = {}
+        self._queued = set()
+        self._shed = []
+        self.room_wanted = float('inf')
@@ -0,0 +1,161 @@
+"""
+Simulator
+
+Replays a trace of sensor events against a `Building` on a virtual clock.
+Nothing sleeps: The clock jumps straight from one thing that matters to
+the next (an event, a sensor timing-out or day turning to night), so a
+month worth of trace goes by in no time.
+
+Trace timestamps are seconds, counted from a midnight. That is how the
+simulator knows when day & night slots begin.
+"""
+
+import csv
+
+from prana.clock import ManualClock, use_clock
+from prana.constants import TIME_SLOT_DAY, TIME_SLOT_NIGHT
+
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+
+def time_slot_at(timestamp):
+    """
+    Day or night slot, at the given timestamp
+    """
+    hour = (timestamp % SECONDS_PER_DAY) / SECONDS_PER_HOUR
+    if TIME_SLOT_DAY[0] <= hour < TIME_SLOT_DAY[1]:
+        return TIME_SLOT_DAY
+    return TIME_SLOT_NIGHT
+
+
+def next_time_slot_change(timestamp):
+    """
+    When does the current time slot end?
+    """
+    day = timestamp - timestamp % SECONDS_PER_DAY
+    for hour in sorted(TIME_SLOT_DAY) + [TIME_SLOT_DAY[0] + 24]:
+        change = day + hour * SECONDS_PER_HOUR
+        if change > timestamp:
+            return change
+
+
+def read_trace(path):
+    """
+    Read a CSV trace of `timestamp,floor,corridor,sensor` rows.
+    A header row (or any row starting with '#') is skipped.
+    """
+    with open(path) as trace:
+        for row in csv.reader(trace):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                timestamp = float(row[0])
+            except ValueError:
+                continue  # header
+            yield timestamp, int(row[1]), int(row[2]), int(row[3])
+
+
+class Simulator:
+    """
+    Drives a building through a trace, keeping track of the watts
+    consumed on each floor over time.
+    """
+
+    def __init__(self, building, start=0.0, time_slots=True):
+        self.building = building
+        self.clock = ManualClock(start)
+        self.time_slots = time_slots
+        # Floor id => [(timestamp, watts), ..] Only changes are recorded.
+        self.timelines = {}
+        # Floor id => watt-seconds consumed so far
+        self.energy = {}
+        self.events = 0
+        with use_clock(self.clock):
+            if time_slots:
+                building.time_slot = time_slot_at(start)
+            building.reset(start)
+        for floor in building.iter_floors():
+            self.timelines[floor.id] = [(start, floor.current_watts())]
+            self.energy[floor.id] = 0.0
+
+    def _record(self, floors):
+        """
+        Note down where the watts went on the given floors
+        """
+        now = self.clock.now()
+        for floor in floors:
+            timeline = self.timelines[floor.id]
+            since, watts = timeline[-1]
+            if floor.current_watts() == watts:
+                continue
+            self.energy[floor.id] += watts * (now - since)
+            if since == now:
+                timeline[-1] = (now, floor.current_watts())
+            else:
+                timeline.append((now, floor.current_watts()))
+
+    def advance(self, timestamp):
+        """
+        Move the clock up to `timestamp`, handling every sensor time-out &
+        time slot change on the way, in order.
+        """
+        building = self.building
+        while True:
+            expiry = building.next_expiry()
+            change = next_time_slot_change(self.clock.now()) \
+                if self.time_slots else None
+            upcoming = [
+                t for t in (expiry, change)
+                if t is not None and t <= timestamp]
+            if not upcoming:
+                break
+            upcoming = min(upcoming)
+            self.clock.set(upcoming)
+            if upcoming == change:
+                building.set_time_slot(time_slot_at(upcoming))
+                self._record(building.iter_floors())
+            if upcoming == expiry:
+                self._record(building.tick(upcoming))
+        if timestamp > self.clock.now():
+            self.clock.set(timestamp)
+
+    def run(self, events, until=None):
+        """
+        Replay `events`: (timestamp, floor_id, corridor_id, sensor_id) in
+        order of time. Carries on up to `until`, if given.
+        Returns the report.
+        """
+        building = self.building
+        with use_clock(self.clock):
+            for timestamp, floor_id, corridor_id, sensor_id in events:
+                self.advance(timestamp)
+                with building.transaction() as transitions:
+                    building.register_activity(
+                        floor_id, corridor_id, sensor_id, timestamp)
+                # Other floors may have had to shed (see `prana.budget`)
+                floors = {floor_id}
+                floors.update(transition.floor for transition in transitions)
+                self._record([building.get_floor(id) for id in floors])
+                self.events += 1
+            if until is not None:
+                self.advance(until)
+        return self.report()
+
+    def report(self):
+        """
+        Watt timelines & energy (in watt-hours) per floor, up until now
+        """
+        now = self.clock.now()
+        floors = {}
+        for floor_id, timeline in self.timelines.items():
+            since, watts = timeline[-1]
+            energy = self.energy[floor_id] + watts * (now - since)
+            floors[floor_id] = dict(
+                timeline=timeline, energy=energy / SECONDS_PER_HOUR)
+        return dict(
+            events=self.events,
+            until=now,
+            floors=floors,
+            energy=sum(floor['energy'] for floor in floors.values()),
+        )
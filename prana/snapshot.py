@@ -0,0 +1,244 @@
+"""
+Binary snapshots
+
+The whole building (layout & live state) in one compact, versioned file,
+so a new controller need not build it up again appliance by appliance.
+
+Everything is fixed width records, in tables one after the other:
+
+* Floors: id, first corridor, corridor count, flags, watts & the latest
+  activity on the floor
+* Corridors: id, category, first appliance, appliance count, first sensor,
+  sensor count
+* Appliances: id, category, status
+* Sensors: id, category, last activity
+
+`load` maps the file into memory & hands back a `MappedBuilding`. Floors
+that have something going on (active sensors, or not at defaults) are
+built right away. The rest are read straight from the mapping, only once
+somebody asks for them.
+
+Timestamps are stored as wall clock time (see `prana.journal`).
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from prana import clock
+from prana.constants import SENSOR_TIMEOUT_SECONDS
+from prana.enums import CorridorCategory
+from prana.models import Appliance, Building, Corridor, Floor
+
+VERSION = 1
+MAGIC = b'PRNS'
+
+# magic, version, time slot, floor count, corridor count, appliance count,
+# sensor count
+HEADER = struct.Struct('<4sHBBIIII')
+FLOOR = struct.Struct('<IIIB3xid')
+CORRIDOR = struct.Struct('<IB3xIIII')
+APPLIANCE = struct.Struct('<IBB2x')
+SENSOR = struct.Struct('<IB3xd')
+
+# Floor flags
+DIRTY = 1
+
+
+def wall_offset(offset=None):
+    """
+    Seconds to add to `prana.clock` time to make it wall clock time
+    """
+    if offset is None:
+        offset = time.time() - clock.now()
+    return offset
+
+
+def dump(building, path, offset=None):
+    """
+    Write `building` down to `path`, as of one moment
+    """
+    offset = wall_offset(offset)
+    floors, corridors, appliances, sensors = [], [], [], []
+    with building.locked() as locked:
+        dirty = {floor.id for floor in building.dirty_floors()}
+        for floor in locked:
+            first_corridor = len(corridors)
+            latest = float('-inf')
+            for corridor in floor.iter_corridors():
+                first_appliance, first_sensor = len(appliances), len(sensors)
+                for appliance in corridor.iter_appliances():
+                    appliances.append(APPLIANCE.pack(
+                        appliance.id, appliance.category, appliance.status))
+                for sensor in corridor.iter_sensors():
+                    latest = max(latest, sensor.last_activity)
+                    sensors.append(SENSOR.pack(
+                        sensor.id, sensor.category,
+                        sensor.last_activity + offset))
+                corridors.append(CORRIDOR.pack(
+                    corridor.id, corridor.category, first_appliance,
+                    len(appliances) - first_appliance, first_sensor,
+                    len(sensors) - first_sensor))
+            floors.append(FLOOR.pack(
+                floor.id, first_corridor, len(corridors) - first_corridor,
+                DIRTY if floor.id in dirty else 0, floor.current_watts(),
+                latest + offset))
+        header = HEADER.pack(
+            MAGIC, VERSION, building.time_slot[0], building.time_slot[1],
+            len(floors), len(corridors), len(appliances), len(sensors))
+    with open(path + '.tmp', 'wb') as snapshot:
+        snapshot.write(header)
+        for table in (floors, corridors, appliances, sensors):
+            snapshot.write(b''.join(table))
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def load(path, offset=None):
+    """
+    Attach to the snapshot at `path`
+    """
+    return MappedBuilding(path, offset)
+
+
+class MappedBuilding(Building):
+    """
+    A building that reads it's floors out of a snapshot, as they are
+    needed. Once built, a floor is an ordinary `Floor`.
+    """
+
+    _transient = Building._transient + ('_map', '_mapping')
+
+    def __init__(self, path, offset=None, id=0):
+        super(MappedBuilding, self).__init__(id)
+        self.offset = wall_offset(offset)
+        with open(path, 'rb') as snapshot:
+            self._map = mmap.mmap(
+                snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, start, end, floors, corridors, appliances, \
+            sensors = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError('%s is not a snapshot' % path)
+        if version != VERSION:
+            raise ValueError(
+                'Snapshot version %d is not supported (%d is)' % (
+                    version, VERSION))
+        self.time_slot = (start, end)
+        self._corridors_at = HEADER.size + floors * FLOOR.size
+        self._appliances_at = self._corridors_at + corridors * CORRIDOR.size
+        self._sensors_at = self._appliances_at + appliances * APPLIANCE.size
+
+        # Floor id => floor record, for floors not built yet
+        self._unmapped = {}
+        now = clock.now()
+        hot = []
+        caps = 0
+        for record in FLOOR.iter_unpack(
+                memoryview(self._map)[HEADER.size:self._corridors_at]):
+            floor_id, first, count, flags, watts, latest = record
+            self._unmapped[floor_id] = record
+            # Not built yet, but on the bill (& in the budget) all the same
+            self._add_watts(watts)
+            caps += self._floor_cap(first, count)
+            if flags & DIRTY or \
+                    latest - self.offset + SENSOR_TIMEOUT_SECONDS > now:
+                hot.append(floor_id)
+        self._add_caps(caps)
+        for floor_id in hot:
+            self._map_floor(floor_id)
+
+    def _init_transient(self):
+        super(MappedBuilding, self)._init_transient()
+        self._map = None
+        # Held while floors are being built
+        self._mapping = threading.Lock()
+
+    def __getstate__(self):
+        self.map_floors()
+        return super(MappedBuilding, self).__getstate__()
+
+    def _records(self, table, at, first, count):
+        start = at + first * table.size
+        return table.iter_unpack(
+            memoryview(self._map)[start:start + count * table.size])
+
+    def _floor_cap(self, first, count):
+        """
+        Cap of a floor not built yet, going by it's corridors
+        """
+        return sum(
+            CorridorCategory.multiplier(record[1])
+            for record in self._records(
+                CORRIDOR, self._corridors_at, first, count))
+
+    def _map_floor(self, floor_id):
+        floor_id, first, count, flags, watts, _ = self._unmapped.pop(floor_id)
+        floor = Floor(floor_id)
+        for corridor_id, category, first_appliance, appliances, \
+                first_sensor, sensors in self._records(
+                    CORRIDOR, self._corridors_at, first, count):
+            corridor = Corridor(corridor_id, category)
+            for appliance_id, category, status in self._records(
+                    APPLIANCE, self._appliances_at, first_appliance,
+                    appliances):
+                appliance = Appliance(appliance_id, category)
+                appliance.status = status
+                corridor.attach_appliance(appliance)
+            for sensor_id, category, last_activity in self._records(
+                    SENSOR, self._sensors_at, first_sensor, sensors):
+                sensor = corridor.add_sensor(sensor_id, category)
+                sensor.last_activity = last_activity - self.offset
+            floor.attach_corridor(corridor)
+        if flags & DIRTY:
+            # Only floors off their defaults can have anything shed
+            floor.shedder.recover()
+        with self._lock:
+            self._add_watts(-watts)
+            # The floor brings it's own once attached
+            self._add_caps(-self._floor_cap(first, count))
+        self.attach_floor(floor)
+        if flags & DIRTY:
+            self.mark_dirty(floor)
+        return floor
+
+    def map_floors(self):
+        """
+        Build every floor that is not built yet
+        """
+        if not self._unmapped:
+            return
+        with self._mapping:
+            for floor_id in sorted(self._unmapped):
+                self._map_floor(floor_id)
+
+    def get_component(self, id):
+        try:
+            return super(MappedBuilding, self).get_component(id)
+        except KeyError:
+            if id not in self._unmapped:
+                raise
+        with self._mapping:
+            if id in self._unmapped:
+                return self._map_floor(id)
+        # Somebody else got to it first
+        return super(MappedBuilding, self).get_component(id)
+
+    def list_components(self):
+        self.map_floors()
+        return super(MappedBuilding, self).list_components()
+
+    def iter_components(self):
+        self.map_floors()
+        return super(MappedBuilding, self).iter_components()
+
+    def close(self):
+        """
+        Build what is left & let go of the file
+        """
+        self.map_floors()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
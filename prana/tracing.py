@@ -0,0 +1,131 @@
+"""
+Tracing
+
+Where did the time go for one particular motion event? Hand a `Tracer` to
+a building (`watch`) & a sample of `register_activity` calls are followed
+from the event coming in to every appliance transition it caused, with a
+timed span for each stage:
+
+* `register_activity`: All of it, with the sensor & the transitions
+* `switch_on`: Switching on the corridor's appliances
+* `floor.optimize`: Keeping the floor within budget, with a `shed` span
+  for each appliance switched off (or a `corridor.optimize` span for each
+  corridor looked at, with `SweepShedder`. See `prana.shedding`)
+* `commit`: Working out the net transitions & handing them over to the
+  actuators (& subscribers)
+
+Traces are written to a file in the Chrome trace event format (a JSON
+array of events), which `chrome://tracing`, Perfetto & friends open as is.
+Spans of one trace share a thread id & nest by time; each carries the
+trace's id in it's args.
+
+`sample_rate` is the fraction of events traced. An event that is not
+sampled costs a single check, as does a building without a tracer (the
+default).
+"""
+
+import itertools
+import json
+import os
+import random
+import threading
+from time import perf_counter
+
+
+class Trace:
+    """
+    Spans of one traced event, written out together by `finish`
+    """
+
+    __slots__ = ('tracer', 'id', 'tid', 'events')
+
+    def __init__(self, tracer, id):
+        self.tracer = tracer
+        self.id = id
+        self.tid = threading.get_ident()
+        self.events = []
+
+    def span(self, name, start, end=None, **args):
+        """
+        Record `name` as having taken from `start` till `end` (now, if not
+        given), both as per `time.perf_counter`
+        """
+        if end is None:
+            end = perf_counter()
+        args['trace'] = self.id
+        self.events.append(dict(
+            name=name, cat='prana', ph='X', ts=start * 1e6,
+            dur=(end - start) * 1e6, pid=self.tracer.pid, tid=self.tid,
+            args=args))
+
+    def finish(self):
+        self.tracer.write(self)
+
+
+class Tracer:
+
+    def __init__(self, path, sample_rate=1.0, seed=None):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(
+                "Sample rate must be between 0 & 1, not %r" % sample_rate)
+        self.path = path
+        self.sample_rate = sample_rate
+        self.pid = os.getpid()
+        self.traces = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = open(path, 'w')
+        # Name the process, so the viewer has something to show for it
+        self._file.write('[\n' + json.dumps(dict(
+            name='process_name', ph='M', pid=self.pid,
+            args=dict(name='prana'))))
+
+    def watch(self, building):
+        """
+        Start tracing `building`
+        """
+        building.tracer = self
+        return building
+
+    def start(self):
+        """
+        A new `Trace`, or None if this one is not sampled
+        """
+        rate = self.sample_rate
+        if rate < 1 and (not rate or self._random.random() >= rate):
+            return None
+        return Trace(self, next(self._ids))
+
+    def write(self, trace):
+        lines = ''.join(
+            ',\n' + json.dumps(event, sort_keys=True)
+            for event in trace.events)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(lines)
+            self.traces += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """
+        Finish the file off. Without this it still opens in a trace viewer,
+        but it is not quite valid JSON.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,4 +1,4 @@
-import time
+from prana.clock import ManualClock, set_clock
 from prana.models import Building
 from prana.enums import CorridorCategory, ApplianceCategory, SensorCategory, \
      ApplianceStatus
@@ -8,6 +8,10 @@ NUMBER_OF_FLOORS = 2
 NUMBER_OF_MAIN_COORRIDORS = 1
 NUMBER_OF_SUB_COORRIDORS = 2
 
+# No need to sit through the timeouts, time moves when we say so
+clock = ManualClock()
+set_clock(clock)
+
 b = Building()
 corridor_categories = [CorridorCategory.MAIN] * NUMBER_OF_MAIN_COORRIDORS \
     + [CorridorCategory.SUB] * NUMBER_OF_SUB_COORRIDORS
@@ -41,10 +45,8 @@ print("CURRENT WATTS: ", f.current_watts(), "  MAX WATTS: ", f.max_watts())
 print("Target Light State", ApplianceStatus.lookup(target_light.status))
 print("Expendable AC State", ApplianceStatus.lookup(expendable_ac.status))
 
-print("Countdown to 30")
-for i in range(30):
-    print(30-i)
-    time.sleep(1)
+print("30 seconds later..")
+clock.advance(30)
 
 b.refresh()
 print("\n")
@@ -55,10 +57,8 @@ print("Expendable AC State", ApplianceStatus.lookup(expendable_ac.status))
 
 print("\n")
 print("=" * 80)
-print("Countdown to 30")
-for i in range(30):
-    print(30-i)
-    time.sleep(1)
+print("30 seconds later..")
+clock.advance(30)
 
 
 b.refresh()
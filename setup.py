@@ -63,5 +63,6 @@ setup(
     extras_require={
         'dev': [],
         'test': ['pytest'],
+        'columnar': ['numpy'],
     },
 )
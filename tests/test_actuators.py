@@ -0,0 +1,145 @@
+"""
+Test the actuator driver against mock gateways
+"""
+
+import threading
+import time
+
+from prana.actuators import ActuatorDriver, MockGateway
+from prana.enums import ApplianceStatus
+from prana.models import Transition
+
+from tests.test_models import make_building
+
+
+def test_ActuatorDriver():
+    with MockGateway() as first, MockGateway() as second:
+        driver = ActuatorDriver(
+            {0: first.transport(), 1: second.transport()}, flush_size=4,
+            flush_interval=60)
+        b = make_building()
+        b.add_actuator(driver)
+        b.boot()
+        # 4 per floor, that is a full batch each. No need to wait a minute.
+        driver.flush()
+        assert len(first.batches) == len(second.batches) == 1
+
+        b.register_activity(0, 1, 0)
+        b.refresh(full=True)
+        driver.close()
+        assert driver.in_flight == driver.pending() == 0
+        assert driver.sent == 10
+        floor = b.get_floor(0)
+        assert len(first.statuses) == 5
+        for (_, corridor, appliance), status in first.statuses.items():
+            assert floor.get_corridor(corridor).get_appliance(
+                appliance).status == status
+
+
+def test_ActuatorDriver_coalesce():
+    """
+    Switched back before it was sent: Nothing to send
+    """
+    on = Transition(0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON)
+    off = Transition(0, 1, 1, ApplianceStatus.ON, ApplianceStatus.OFF)
+    with MockGateway() as gateway:
+        driver = ActuatorDriver(gateway.transport(), flush_interval=60)
+        driver([on])
+        driver([off])
+        assert driver.pending() == 0
+        driver([on])
+        driver.close()
+        assert gateway.batches == [[(0, 1, 1, ApplianceStatus.ON)]]
+
+
+def test_ActuatorDriver_retry():
+    on = Transition(0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON)
+    errors = []
+    with MockGateway(failures=2) as gateway:
+        driver = ActuatorDriver(
+            gateway.transport(), backoff=0,
+            on_error=lambda key, commands, e: errors.append(commands))
+        driver([on])
+        driver.flush()
+        assert driver.sent == 1 and not errors
+        assert len(gateway.batches) == 1
+
+        gateway.failures = 10
+        driver([on])
+        driver.close()
+        assert driver.failed == errors[0] == [on]
+
+
+def test_ActuatorDriver_order():
+    """
+    A newer command is never overtaken by an older one being retried
+    """
+    on = Transition(0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON)
+    off = Transition(0, 1, 1, ApplianceStatus.ON, ApplianceStatus.OFF)
+    with MockGateway(failures=1) as gateway:
+        driver = ActuatorDriver(
+            gateway.transport(), flush_size=1, flush_interval=60,
+            backoff=0.05)
+        driver([on])
+        # Taken for sending, before the next one comes along
+        while driver.pending():
+            time.sleep(0.001)
+        driver([off])
+        driver.close()
+        assert not driver.failed
+        assert gateway.batches[-1] == [(0, 1, 1, ApplianceStatus.OFF)]
+        assert gateway.statuses == {(0, 1, 1): ApplianceStatus.OFF}
+
+
+class SlowTransport:
+    """
+    Takes a while over every batch, keeping track of how many it's got on
+    at once
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sending = self.most = 0
+        self.sent = []
+
+    def connect(self):
+        return self
+
+    def send(self, commands):
+        with self.lock:
+            self.sending += 1
+            self.most = max(self.most, self.sending)
+        time.sleep(0.02)
+        with self.lock:
+            self.sending -= 1
+            self.sent.append(commands)
+
+    def close(self):
+        pass
+
+
+def test_ActuatorDriver_parallel():
+    """
+    Up to `pool_size` batches at once, but never two for one appliance
+    """
+    on = Transition(0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON)
+    off = Transition(0, 1, 1, ApplianceStatus.ON, ApplianceStatus.OFF)
+    transport = SlowTransport()
+    driver = ActuatorDriver(
+        transport, flush_size=1, flush_interval=60, pool_size=3)
+    driver([
+        Transition(0, 2, appliance, ApplianceStatus.OFF, ApplianceStatus.ON)
+        for appliance in range(6)])
+    driver.flush()
+    assert transport.most == 3
+
+    transport.most = 0
+    transport.sent = []
+    for command in [on, off] * 3:
+        driver([command])
+        # Taken for sending, before the next one comes along
+        while driver.pending():
+            time.sleep(0.001)
+    driver.close()
+    assert transport.most == 1
+    assert transport.sent == [[on], [off]] * 3
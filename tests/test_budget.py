@@ -0,0 +1,95 @@
+"""
+Test power budgets
+"""
+
+import pytest
+
+from prana.budget import Lend, Pool, Strict
+from prana.clock import ManualClock, use_clock
+from prana.enums import CorridorCategory
+
+from tests.test_models import make_building
+
+
+def test_caps():
+    b = make_building()
+    f = b.get_floor(0)
+    main, sub = f.get_corridor(0), f.get_corridor(1)
+    b.boot()
+    assert (main.cap(), sub.cap()) == (15, 10)
+    assert f.cap() == f.max_watts() == 35
+    assert b.cap() == b.max_watts() == 70
+    # Corridors share the floor
+    assert main.max_watts() == 35 - 20
+
+    # Caps add up the tree..
+    sub.set_cap(20)
+    assert f.cap() == f.max_watts() == 45
+    assert b.cap() == 80
+    # ..till they are set
+    f.set_cap(40)
+    sub.set_cap(None)
+    assert f.cap() == 40
+    assert b.cap() == 75
+    f.set_cap(None)
+    assert f.cap() == 35
+    assert b.cap() == 70
+    # So do corridors added later on
+    f.append_corridor(CorridorCategory.SUB)
+    assert f.cap() == f.max_watts() == 45
+    assert b.cap() == 80
+
+
+def test_Strict():
+    with use_clock(ManualClock(1000)):
+        b = make_building()
+        b.boot()
+        # Not enough for every floor, they are cut down alike
+        b.set_cap(56)
+        assert [f.max_watts() for f in b.iter_floors()] == [28, 28]
+        b.optimize()
+        assert [f.current_watts() for f in b.iter_floors()] == [25, 25]
+        # Room again
+        b.set_cap(None)
+        b.optimize()
+        assert [f.current_watts() for f in b.iter_floors()] == [35, 35]
+
+
+def test_Lend():
+    with use_clock(ManualClock(1000)):
+        b = make_building()
+        b.boot()
+        lend = Lend()
+        b.set_budget_policy(lend)
+        with pytest.raises(ValueError):
+            b.get_floor(0).set_budget_policy(lend)
+        f0, f1 = b.get_floor(0), b.get_floor(1)
+        ac = f1.get_corridor(1).get_appliance(0)
+        ac.switch_off()
+
+        # Floor 1 has 10W to spare, floor 0 borrows 5W of it
+        b.register_activity(0, 1, 0)
+        assert f0.current_watts() == 40
+        assert f0.max_watts() == 45
+        assert f1.max_watts() == 35
+        assert b.rebalance() == 0
+
+        # Floor 1 wants it back, floor 0 gives it back
+        ac.switch_on()
+        assert f0.max_watts() == 35
+        assert b.rebalance() == 1
+        assert f0.current_watts() == 30
+        assert f1.current_watts() == 35
+        assert b.current_watts() <= b.max_watts()
+
+
+def test_floor_policies():
+    """
+    Corridors share their floor's budget, shedding knows no other way
+    """
+    f = make_building().get_floor(0)
+    for policy in (Strict(), Lend()):
+        with pytest.raises(ValueError):
+            f.set_budget_policy(policy)
+    assert isinstance(f.budget_policy, Pool)
+    f.set_budget_policy(Pool())
@@ -0,0 +1,54 @@
+"""
+Test change data capture
+"""
+
+from prana.changes import ChangeEvent, ChangeFeed
+from prana.clock import ManualClock, use_clock
+from prana.constants import AC_WATTS, LIGHT_WATTS
+from prana.enums import ApplianceStatus
+
+from tests.test_models import make_building
+
+
+def test_subscribe():
+    batches = []
+    with use_clock(ManualClock(1000)):
+        b = make_building()
+        b.subscribe(batches.append)
+        b.boot()
+        assert len(batches) == 1 and len(batches[0]) == 8
+        del batches[:]
+
+        b.register_activity(0, 1, 0)
+        assert batches == [[
+            ChangeEvent(
+                0, 0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON, 1000,
+                LIGHT_WATTS),
+            ChangeEvent(
+                0, 0, 2, 0, ApplianceStatus.ON, ApplianceStatus.OFF, 1000,
+                -AC_WATTS),
+        ]]
+
+        b.unsubscribe(batches.append)
+        b.register_activity(1, 1, 0)
+        assert len(batches) == 1
+
+
+def test_ChangeFeed():
+    feed = ChangeFeed(4)
+    assert feed.read() == ([], 0)
+    feed(['a', 'b', 'c'])
+    assert feed.read() == (['a', 'b', 'c'], 3)
+    assert feed.read(1, limit=1) == (['b'], 2)
+    assert feed.read(3) == ([], 3)
+
+    # Fell behind: 'a' & 'b' are gone
+    feed(['d', 'e', 'f'])
+    assert feed.read(0) == (['c', 'd', 'e', 'f'], 6)
+
+    b = make_building()
+    b.subscribe(feed)
+    b.boot()
+    events, cursor = feed.read(6)
+    assert len(events) == 4 and cursor == 14
+    assert all(event.new == ApplianceStatus.ON for event in events)
@@ -0,0 +1,25 @@
+"""
+Test clocks
+"""
+
+from prana import clock
+from prana.clock import ManualClock, MonotonicClock, use_clock
+
+
+def test_MonotonicClock():
+    c = MonotonicClock()
+    assert c.now() <= c.now()
+
+
+def test_use_clock():
+    """
+    A manual clock is in use only within the block
+    """
+    default = clock.get_clock()
+    with use_clock(ManualClock(10)) as manual:
+        assert clock.now() == 10
+        manual.advance(5)
+        assert clock.now() == 15
+        manual.set(3)
+        assert clock.now() == 3
+    assert clock.get_clock() is default
@@ -0,0 +1,113 @@
+"""
+Test the columnar engine against the object models
+"""
+
+import pytest
+
+from prana.clock import ManualClock, use_clock
+from prana.enums import CorridorCategory, ApplianceCategory, SensorCategory, \
+     ApplianceStatus
+from prana.models import Building
+
+np = pytest.importorskip("numpy")
+
+from prana.columnar import ColumnarBuilding  # noqa: E402
+
+
+NUMBER_OF_FLOORS = 3
+CORRIDOR_CATEGORIES = [CorridorCategory.MAIN] + [CorridorCategory.SUB] * 3
+
+
+def populate(b):
+    for floor_id in range(NUMBER_OF_FLOORS):
+        f = b.add_floor(floor_id)
+        for corridor_category in CORRIDOR_CATEGORIES:
+            c = f.append_corridor(corridor_category)
+            c.append_appliance(ApplianceCategory.AC)
+            c.append_appliance(ApplianceCategory.LIGHT)
+            c.append_sensor(SensorCategory.MOTION)
+    return b
+
+
+def statuses(b):
+    return [
+        appliance.status
+        for f in b.list_floors()
+        for c in f.list_corridors()
+        for appliance in c.list_appliances()]
+
+
+def test_columnar_matches_models():
+    """
+    Both engines should end up in the exact same state
+    """
+    models = populate(Building())
+    columnar = populate(ColumnarBuilding())
+    models.boot()
+    columnar.boot()
+    assert statuses(models) == statuses(columnar)
+
+    for event in [(0, 1, 0), (0, 2, 0), (2, 3, 0), (1, 0, 0)]:
+        models.register_activity(*event)
+        columnar.register_activity(*event)
+        assert statuses(models) == statuses(columnar)
+
+    for floor_id in range(NUMBER_OF_FLOORS):
+        assert models.get_floor(floor_id).current_watts() == \
+            columnar.get_floor(floor_id).current_watts()
+        assert models.get_floor(floor_id).max_watts() == \
+            columnar.get_floor(floor_id).max_watts()
+    assert models.current_watts() == columnar.current_watts()
+
+
+def test_columnar_refresh():
+    """
+    Floors go back to defaults once their sensors time out
+    """
+    with use_clock(ManualClock(1000)) as clock:
+        b = populate(ColumnarBuilding())
+        b.boot()
+        defaults = statuses(b)
+        b.register_activity(0, 1, 0)
+        target_light = b.get_floor(0).get_corridor(1).get_appliance(1)
+        assert target_light.status == ApplianceStatus.ON
+
+        clock.advance(30)
+        b.refresh()
+        assert target_light.status == ApplianceStatus.ON
+
+        clock.advance(30)
+        b.refresh()
+        assert statuses(b) == defaults
+
+
+def test_columnar_burst():
+    """
+    Bursts & ticks, the same as the object models
+    """
+    with use_clock(ManualClock(1000)) as clock:
+        models = populate(Building())
+        columnar = populate(ColumnarBuilding())
+        events = [(0, 1, 0), (0, 2, 0), (2, 3, 0), (0, 1, 0)]
+        for b in (models, columnar):
+            b.boot()
+        summary = models.register_activities(events)
+        burst = columnar.register_activities(events)
+        assert sorted(burst.pop('transitions')) == \
+            sorted(summary.pop('transitions'))
+        assert burst == summary
+        assert statuses(models) == statuses(columnar)
+
+        clock.advance(30)
+        for b in (models, columnar):
+            b.register_activity(1, 0, 0)
+        clock.advance(35)
+        assert [f.id for f in columnar.tick()] == \
+            [f.id for f in models.tick()] == [0, 2]
+        assert statuses(models) == statuses(columnar)
+
+        clock.advance(30)
+        for b in (models, columnar):
+            b.refresh(full=True)
+            b.optimize(full=True)
+        assert statuses(models) == statuses(columnar)
@@ -0,0 +1,99 @@
+"""
+Hammer a building from many threads at once
+"""
+
+import random
+import sys
+import threading
+
+import pytest
+
+from prana.clock import ManualClock, use_clock
+from prana.enums import ApplianceCategory, ApplianceStatus
+
+from tests.test_models import make_building
+
+FLOORS = 8
+THREADS = 16
+EVENTS_PER_THREAD = 2000
+
+
+def watts_of(statuses):
+    """
+    Watts, going by the statuses in a snapshot
+    """
+    return sum(
+        ApplianceCategory.watts(
+            ApplianceCategory.AC if appliance_id == 0
+            else ApplianceCategory.LIGHT)
+        for (_, appliance_id), status in statuses.items()
+        if status == ApplianceStatus.ON)
+
+
+@pytest.fixture
+def busy_switching():
+    """
+    Switch threads as often as possible, to shake out the races
+    """
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(switch_interval)
+
+
+def test_stress(busy_switching):
+    errors = []
+    done = threading.Event()
+
+    def guard(work):
+        def run():
+            try:
+                work()
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+        return run
+
+    with use_clock(ManualClock(1000)) as clock:
+        b = make_building(FLOORS)
+        b.boot()
+
+        def events(seed):
+            def work():
+                rnd = random.Random(seed)
+                for i in range(EVENTS_PER_THREAD):
+                    event = (
+                        rnd.randrange(FLOORS), rnd.randrange(3), 0)
+                    if i % 10:
+                        b.register_activity(*event)
+                    else:
+                        b.register_activities([event, event])
+            return work
+
+        def housekeeping():
+            while not done.is_set():
+                clock.advance(7)
+                b.tick()
+                b.refresh()
+                b.optimize()
+                for floor in b.snapshot().values():
+                    assert floor['current_watts'] == \
+                        watts_of(floor['statuses'])
+
+        workers = [
+            threading.Thread(target=guard(events(seed)))
+            for seed in range(THREADS)]
+        keeper = threading.Thread(target=guard(housekeeping))
+        keeper.start()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        done.set()
+        keeper.join()
+
+    assert errors == []
+    snapshot = b.snapshot()
+    for floor in snapshot.values():
+        assert floor['current_watts'] == watts_of(floor['statuses'])
+    assert b.current_watts() == sum(
+        floor['current_watts'] for floor in snapshot.values())
@@ -0,0 +1,91 @@
+"""
+Test energy accounting
+"""
+
+import pytest
+
+from prana.clock import ManualClock, use_clock
+from prana.energy import kwh
+
+from tests.test_models import make_building
+
+
+def test_energy():
+    with use_clock(ManualClock(600)) as clock:
+        b = make_building(1)
+        floor = b.get_floor(0)
+        # ACs everywhere & the main corridor's light: 35W
+        b.boot()
+        clock.advance(90)
+        # Sub corridor 1 lights up, sub corridor 2's AC goes off: 30W
+        b.register_activity(0, 1, 0)
+        clock.advance(90)
+
+        assert b.energy() == floor.energy() == 35 * 90 + 30 * 90
+        assert b.energy() == sum(
+            appliance.energy()
+            for corridor in floor.iter_corridors()
+            for appliance in corridor.iter_appliances())
+        sub = floor.get_corridor(2)
+        assert sub.energy() == sub.get_appliance(0).energy() == 10 * 90
+        assert floor.get_corridor(0).energy(720) == 15 * 60
+
+        # From the rollups
+        assert floor.energy(600, 690) == 35 * 90
+        assert floor.energy(630, 660) == 35 * 30
+        assert floor.energy(660, 720) == 35 * 30 + 30 * 30
+        assert b.energy(600, 720) == floor.energy(600, 720)
+
+        # Corridors & appliances only know since their last change
+        with pytest.raises(ValueError):
+            floor.get_corridor(1).energy(600)
+        with pytest.raises(ValueError):
+            floor.get_corridor(1).get_appliance(1).energy(600)
+
+        # Floors keep an hour
+        clock.advance(2 * 60 * 60)
+        b.register_activity(0, 2, 0)
+        with pytest.raises(ValueError):
+            floor.energy(660)
+        assert b.energy(660) == b.energy() - 35 * 60
+        # Nothing before counting started
+        assert floor.energy(0) == floor.energy()
+        assert floor.energy(clock.now() - 60 * 60) == pytest.approx(
+            30 * 60 * 60)
+
+
+def test_energy_within_a_minute():
+    """
+    Rollups are exact in between minute boundaries, as long as the watts
+    changed once at most in that minute
+    """
+    with use_clock(ManualClock(600)) as clock:
+        b = make_building(1)
+        floor = b.get_floor(0)
+        b.boot()
+        clock.advance(15)
+        # 35W, then 30W from 615, then 35W again from 720 on the boundary
+        b.register_activity(0, 1, 0)
+        clock.set(720)
+        floor.get_corridor(1).get_appliance(1).switch_off()
+        floor.get_corridor(2).get_appliance(0).switch_on()
+        # Up & down within a minute
+        clock.set(765)
+        floor.get_corridor(1).get_appliance(1).switch_on()
+        clock.set(775)
+        floor.get_corridor(1).get_appliance(1).switch_off()
+        clock.advance(60)
+
+        assert floor.energy(600, 605) == 35 * 5
+        assert floor.energy(600, 630) == 35 * 15 + 30 * 15
+        assert floor.energy(610, 700) == 35 * 5 + 30 * 85
+        assert floor.energy(700, 730) == 30 * 20 + 35 * 10
+        assert b.energy(605, 730) == floor.energy(605, 730)
+        # Two changes in a minute: A little off, but no more than that
+        assert floor.energy(720, 780) == 35 * 60 + 5 * 10
+        assert floor.energy(720, 770) == pytest.approx(
+            35 * 50 + 5 * 5, abs=5 * 10)
+
+
+def test_kwh():
+    assert kwh(3.6e6) == 1
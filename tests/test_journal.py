@@ -0,0 +1,94 @@
+"""
+Test the journal: Whatever happened should survive a restart
+"""
+
+import os
+
+from prana.clock import ManualClock, use_clock
+from prana.journal import Journal
+
+from tests.test_models import make_building
+
+
+def state(building):
+    return building.snapshot(), {
+        (floor.id, corridor.id, sensor.id): sensor.last_activity
+        for floor in building.iter_floors()
+        for corridor in floor.iter_corridors()
+        for sensor in corridor.iter_sensors()}
+
+
+def restart(path):
+    """
+    What a controller does when it starts: Lay out the building & recover
+    """
+    building = make_building()
+    # The manual clock is as good as wall clock time here
+    journal = Journal(path, offset=0)
+    if not journal.recover(building):
+        # First time round
+        building.boot()
+        journal.snapshot(building)
+    return building, journal
+
+
+def assert_same(one, other):
+    statuses, activities = state(one)
+    assert state(other)[0] == statuses
+    assert state(other)[1] == activities
+    assert other.next_expiry() == one.next_expiry()
+
+
+def test_Journal(tmp_path):
+    path = str(tmp_path)
+    with use_clock(ManualClock(1000)) as clock:
+        b, journal = restart(path)
+        b.register_activity(0, 1, 0)
+        clock.advance(10)
+        b.register_activity(1, 2, 0)
+        journal.commit()
+        # Crash! Nothing closed, everything committed is there
+        recovered, journal = restart(path)
+        assert_same(b, recovered)
+
+        # Carry on from the recovered one, then compact
+        b = recovered
+        b.register_activity(0, 2, 0)
+        journal.snapshot(b)
+        assert os.listdir(path) == ['snapshot']
+        clock.advance(100)
+        b.tick()
+        journal.close()
+        recovered, journal = restart(path)
+        assert_same(b, recovered)
+
+        # A record half written when it all went down
+        with open(os.path.join(path, 'log.1'), 'ab') as log:
+            log.write(b'\x02\x00')
+        journal.close()
+        again, journal = restart(path)
+        assert_same(b, again)
+        again.register_activity(0, 1, 0)
+        journal.close()
+        last, journal = restart(path)
+        journal.close()
+        assert_same(again, last)
+
+
+def test_Journal_shed(tmp_path):
+    """
+    What was shed before the crash comes back on once there is room
+    """
+    path = str(tmp_path)
+    with use_clock(ManualClock(1000)):
+        b, journal = restart(path)
+        b.register_activity(0, 1, 0)
+        journal.commit()
+        recovered, journal = restart(path)
+        journal.close()
+        for building in (b, recovered):
+            assert building.get_floor(0).current_watts() == 30
+            building.get_floor(0).set_cap(40)
+            building.optimize()
+        assert_same(b, recovered)
+        assert recovered.get_floor(0).current_watts() == 40
@@ -0,0 +1,58 @@
+"""
+Test metrics
+"""
+
+from urllib.request import urlopen
+
+from prana.clock import ManualClock, use_clock
+from prana.metrics import Histogram, Metrics
+
+from tests.test_models import make_building
+
+
+def test_Histogram():
+    histogram = Histogram([1, 2])
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [(1, 2), (2, 3), ('+Inf', 4)]
+    assert histogram.sum == 6 and histogram.count == 4
+
+
+def test_Metrics():
+    with use_clock(ManualClock(1000)) as clock:
+        b = make_building()
+        metrics = Metrics()
+        metrics.watch(b)
+        b.boot()
+        b.register_activity(0, 1, 0)
+        clock.advance(60)
+        b.tick()
+        b.optimize(full=True)
+
+    # Every switch counts, even those that cancel out (& never make it to
+    # the actuators): Refreshing floor 0 switches off what is on (4), then
+    # boots it again (4)
+    assert metrics.counters == dict(
+        switch_on=8 + 1 + 4,
+        switch_off=1 + 4,
+        shed=1,
+        sensor_expirations=1)
+    assert metrics.histograms['register_activity'].count == 1
+    assert metrics.histograms['tick'].count == 1
+    assert metrics.histograms['refresh_floor'].count == 1
+    assert metrics.histograms['optimize'].count == 1
+
+    text = metrics.export()
+    assert 'prana_shed_total 1\n' in text
+    assert 'prana_operation_seconds_count{operation="tick"} 1\n' in text
+    assert 'prana_floor_watts{building="0",floor="0"} %d\n' % (
+        b.get_floor(0).current_watts()) in text
+    assert 'prana_floor_max_watts{building="0",floor="1"} 35\n' in text
+
+    server = metrics.serve()
+    try:
+        with urlopen('http://%s:%d/metrics' % server.server_address) as r:
+            assert r.read().decode() == metrics.export()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -2,11 +2,12 @@
 Just declaring some sample models to test BaseModel
 """
 
-import time
+import pytest
 
+from prana.clock import ManualClock, use_clock
 from prana.constants import LIGHT_WATTS
 from prana.models import BaseModel, CategoryModel, Appliance,\
-    Sensor, Building
+    Sensor, Building, ComponentStore
 from prana.enums import CorridorCategory, ApplianceCategory, SensorCategory, \
      ApplianceStatus
 
@@ -31,16 +32,46 @@ class Bar(BaseModel):
     _component_type = Foo
 
 
+@pytest.fixture
+def manual_clock():
+    """
+    Time only moves when the test says so. No sleeping!
+    """
+    with use_clock(ManualClock(1000)) as clock:
+        yield clock
+
+
+def make_building(floors=NUMBER_OF_FLOORS):
+    """
+    Build a sample building to play with
+    """
+    b = Building()
+    corridor_categories = \
+        [CorridorCategory.MAIN] * NUMBER_OF_MAIN_COORRIDORS \
+        + [CorridorCategory.SUB] * NUMBER_OF_SUB_COORRIDORS
+    for floor_id in range(floors):
+        f = b.add_floor(floor_id)
+        for corridor_category in corridor_categories:
+            c = f.append_corridor(corridor_category)
+            c.append_appliance(ApplianceCategory.AC)
+            c.append_appliance(ApplianceCategory.LIGHT)
+            c.append_sensor(SensorCategory.MOTION)
+    return b
+
+
 def test_BaseModel_CategoryModel():
     b = Bar(1)
 
     # Test for dynamically created functions
     assert hasattr(b, "get_foo")
     assert hasattr(b, "list_foos")
+    assert hasattr(b, "iter_foos")
     assert hasattr(b, "add_foo")
     assert hasattr(b, "init_foos")
     assert hasattr(b, "append_foo")
     assert hasattr(b, "filtered_foos")
+    # ..which live on the class, not on every instance
+    assert "get_foo" not in vars(b)
 
     # Test for component_key
     component_key = b.component_key(2)
@@ -63,6 +94,29 @@ def test_BaseModel_CategoryModel():
     # Filter foo bt category 1
     assert len(b.filtered_foos(1)) == 2
 
+    # Filtered foos are a live view, not a copy
+    foos = b.filtered_foos(2)
+    b.append_foo(category=2)
+    assert len(foos) == 2
+    assert len(b.filtered_foos(3)) == 0
+    assert list(b.iter_foos()) == b.list_foos()
+
+
+def test_ComponentStore():
+    """
+    Ids in order go to the list, the rest to the dict
+    """
+    store = ComponentStore()
+    for id in [0, 1, 3, 4]:
+        store.add(id, "c%d" % id)
+    assert len(store) == 4
+    assert 3 in store and 2 not in store and -1 not in store
+    assert store[1] == "c1" and store[4] == "c4"
+    # Filling the gap brings the rest along
+    store.add(2, "c2")
+    assert store._sparse == {}
+    assert list(store.values()) == ["c0", "c1", "c2", "c3", "c4"]
+
 
 def test_Applicance():
     """
@@ -70,6 +124,7 @@ def test_Applicance():
     """
 
     a = Appliance(id=1, category=ApplianceCategory.LIGHT)
+    assert not hasattr(a, "__dict__")
     assert a.status == ApplianceStatus.OFF
     assert a.current_watts() == 0
 
@@ -78,6 +133,175 @@ def test_Applicance():
     assert a.current_watts() == LIGHT_WATTS
 
 
+def test_watts_counters():
+    """
+    Running watt counters should always match a full walk of the tree
+    """
+    b = make_building()
+    assert b.current_watts() == 0
+    b.boot()
+    b.register_activity(1, 2, 0)
+    a = b.get_floor(0).get_corridor(0).get_appliance(0)
+    a.switch_on()
+    a.switch_on()  # Switching it on twice shouldn't count twice
+    for f in b.list_floors():
+        assert f.current_watts() == sum(
+            appliance.current_watts()
+            for corridor in f.list_corridors()
+            for appliance in corridor.list_appliances())
+        assert f.max_watts() == 35
+    assert b.current_watts() == sum(
+        f.current_watts() for f in b.list_floors())
+
+
+def test_dirty_floors():
+    """
+    Only floors that saw a change should be optimized / refreshed
+    """
+    b = make_building()
+    b.boot()
+    assert b.dirty_floors() == []
+    assert len(b.dirty_floors(full=True)) == NUMBER_OF_FLOORS
+
+    b.register_activity(1, 1, 0)
+    assert b.dirty_floors() == [b.get_floor(1)]
+
+    # Someone fiddled with a switch on floor 0, refresh puts it back
+    expendable_ac = b.get_floor(0).get_corridor(2).get_appliance(0)
+    expendable_ac.switch_off()
+    assert b.get_floor(0) in b.dirty_floors()
+    b.refresh()
+    assert expendable_ac.status == ApplianceStatus.ON
+    # Floor 1 still has an active sensor, so it stays on the list
+    assert b.dirty_floors() == [b.get_floor(1)]
+
+
+def test_tick():
+    """
+    Tick should only refresh floors whose sensors actually timed out
+    """
+    with use_clock(ManualClock(1000)) as clock:
+        b = make_building()
+        b.boot()
+        assert b.tick() == []
+
+        b.register_activity(0, 1, 0)
+        target_light = b.get_floor(0).get_corridor(1).get_appliance(1)
+        assert target_light.status == ApplianceStatus.ON
+
+        # Nothing timed out yet
+        clock.advance(30)
+        assert b.tick() == []
+        assert target_light.status == ApplianceStatus.ON
+
+        # A fresh activity on the same sensor supersedes the earlier one
+        b.register_activity(0, 1, 0)
+        clock.advance(40)
+        assert b.tick() == []
+        assert target_light.status == ApplianceStatus.ON
+
+        clock.advance(30)
+        assert b.tick() == [b.get_floor(0)]
+        assert target_light.status == ApplianceStatus.OFF
+        assert b.dirty_floors() == []
+        assert b.tick() == []
+
+
+def test_backlogged_activity():
+    """
+    An event that happened a while back should time out that much sooner
+    """
+    with use_clock(ManualClock(1000)) as clock:
+        b = make_building()
+        b.boot()
+        b.register_activity(0, 1, 0, timestamp=clock.now() - 50)
+        target_light = b.get_floor(0).get_corridor(1).get_appliance(1)
+        assert target_light.status == ApplianceStatus.ON
+        clock.advance(10)
+        assert b.tick() == [b.get_floor(0)]
+        assert target_light.status == ApplianceStatus.OFF
+
+
+def test_register_activities():
+    """
+    A burst of events should end up where one-by-one events would
+    """
+    events = [(0, 1, 0), (0, 1, 0), (0, 2, 0), (1, 1, 0), (0, 1, 0)]
+    one_by_one = make_building()
+    one_by_one.boot()
+    for event in events:
+        one_by_one.register_activity(*event)
+
+    b = make_building()
+    b.boot()
+    summary = b.register_activities(events)
+    assert summary['events'] == 5
+    assert summary['corridors'] == 3
+    assert summary['floors'] == 2
+    for floor_id in range(NUMBER_OF_FLOORS):
+        for corridor_id in range(3):
+            for appliance_id in range(2):
+                assert one_by_one.get_floor(floor_id).get_corridor(
+                    corridor_id).get_appliance(appliance_id).status == \
+                    b.get_floor(floor_id).get_corridor(
+                        corridor_id).get_appliance(appliance_id).status
+
+    # Lights in the sub corridors came on. Floor 1 had to give up an AC.
+    transitions = set(summary['transitions'])
+    assert transitions == {
+        (0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON),
+        (0, 2, 1, ApplianceStatus.OFF, ApplianceStatus.ON),
+        (1, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON),
+        (1, 2, 0, ApplianceStatus.ON, ApplianceStatus.OFF),
+    }
+
+    # Late events don't rewind a sensor
+    sensor = b.get_floor(0).get_corridor(1).get_sensor(0)
+    last_activity = sensor.last_activity
+    b.register_activities([(0, 1, 0, last_activity - 5)])
+    assert sensor.last_activity == last_activity
+
+
+def test_transaction(manual_clock):
+    """
+    Only net transitions should reach the actuators
+    """
+    b = make_building()
+    commands = []
+    b.add_actuator(commands.extend)
+    b.boot()
+    # ACs everywhere & main corridor lights (it is night)
+    assert len(commands) == 8
+
+    # Light comes on, the other sub corridor gives up it's AC
+    del commands[:]
+    b.register_activity(0, 1, 0)
+    assert set(commands) == {
+        (0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON),
+        (0, 2, 0, ApplianceStatus.ON, ApplianceStatus.OFF)}
+
+    # Same again, nothing to do
+    del commands[:]
+    b.register_activity(0, 1, 0)
+    assert commands == []
+
+    # Refreshing an idle floor switches everything off & on again.
+    # None of that should make it out.
+    b.refresh(full=True)
+    assert commands == []
+
+    # Switching on & off within a transaction cancels out
+    light = b.get_floor(1).get_corridor(2).get_appliance(1)
+    with b.transaction() as transitions:
+        light.switch_on()
+        light.switch_off()
+    assert transitions == commands == []
+
+    # Outside of a transaction, every switch goes straight out
+    light.switch_on()
+    assert commands == [(1, 2, 1, ApplianceStatus.OFF, ApplianceStatus.ON)]
+
+
 def test_Sensor():
     """
     Test our sensors
@@ -86,7 +310,7 @@ def test_Sensor():
     assert s.is_active() is False
 
 
-def test_integration():
+def test_integration(manual_clock):
     """
     Previos tests are unit tests. This one is sort of like an
     integration test :P
@@ -122,10 +346,7 @@ def test_integration():
     assert target_light.status == ApplianceStatus.ON
     assert expendable_ac.status == ApplianceStatus.OFF
 
-    print("Countdown to 30")
-    for i in range(30):
-        print(30-i)
-        time.sleep(1)
+    manual_clock.advance(30)
 
     b.refresh()
     assert f.current_watts() == 35
@@ -133,13 +354,50 @@ def test_integration():
     assert target_light.status == ApplianceStatus.ON
     assert expendable_ac.status == ApplianceStatus.OFF
 
-    print("Countdown to 30")
-    for i in range(30):
-        print(30-i)
-        time.sleep(1)
+    manual_clock.advance(30)
 
     b.refresh()
     assert f.current_watts() == 35
     assert f.max_watts() == 35
     assert target_light.status == ApplianceStatus.OFF
     assert expendable_ac.status == ApplianceStatus.ON
+
+
+def test_from_spec():
+    corridors = [
+        dict(category='MAIN', appliances=['AC', 'LIGHT'], sensors=['MOTION']),
+        dict(category='SUB', count=2, appliances=['AC', 'LIGHT'],
+             sensors=['MOTION']),
+    ]
+    b = Building.from_spec(dict(
+        layouts=dict(standard=corridors),
+        floors=[dict(ids='0-1', layout='standard')]))
+    expected = make_building()
+    b.boot()
+    expected.boot()
+    assert b.snapshot() == expected.snapshot()
+    assert b.current_watts() == expected.current_watts()
+    b.register_activity(1, 2, 0)
+    expected.register_activity(1, 2, 0)
+    assert b.snapshot() == expected.snapshot()
+
+    # Straight from JSON, with a floor of it's own
+    b = Building.from_spec('''{
+        "id": 3,
+        "floors": [{"ids": [0, "5-6"], "corridors": [
+            {"category": "SUB", "count": 3, "appliances": ["light"]}
+        ]}]
+    }''')
+    assert b.id == 3
+    assert [floor.id for floor in b.iter_floors()] == [0, 5, 6]
+    assert b.get_floor(5).max_watts() == 3 * CorridorCategory.multiplier(
+        CorridorCategory.SUB)
+    assert b.get_floor(6).get_corridor(2).get_appliance(0).category == \
+        ApplianceCategory.LIGHT
+
+    with pytest.raises(ValueError):
+        Building.from_spec(dict(floors=[
+            dict(ids=1, corridors=[]), dict(ids='0-2', corridors=[])]))
+    with pytest.raises(ValueError):
+        Building.from_spec(dict(floors=[
+            dict(ids=1, corridors=[dict(category='ATTIC')])]))
@@ -0,0 +1,86 @@
+"""
+Test the asyncio runtime
+"""
+
+import asyncio
+
+from prana.clock import ManualClock, use_clock
+from prana.enums import ApplianceStatus
+from prana.runtime import Runtime
+
+from tests.test_models import make_building
+
+
+def test_Runtime():
+    commands = []
+
+    async def sink(transitions):
+        commands.extend(transitions)
+
+    async def main(clock):
+        b = make_building()
+        b.boot()
+        async with Runtime(b, sink, maxsize=2) as runtime:
+            for _ in range(5):
+                await runtime.submit(0, 1, 0)
+            await runtime.drain()
+            assert set(commands) == {
+                (0, 1, 1, ApplianceStatus.OFF, ApplianceStatus.ON),
+                (0, 2, 0, ApplianceStatus.ON, ApplianceStatus.OFF)}
+
+            # Events from a socket
+            server = await runtime.serve()
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"1 1 0\nrubbish\n")
+            await writer.drain()
+            writer.close()
+            while len(commands) < 4:
+                await asyncio.sleep(0.01)
+            await runtime.drain()
+            server.close()
+
+            # Time flies, the timer catches the sensors timing out
+            del commands[:]
+            clock.advance(61)
+            runtime.schedule_expiry()
+            while len(commands) < 4:
+                await asyncio.sleep(0.01)
+            assert set(commands) == {
+                (0, 1, 1, ApplianceStatus.ON, ApplianceStatus.OFF),
+                (0, 2, 0, ApplianceStatus.OFF, ApplianceStatus.ON),
+                (1, 1, 1, ApplianceStatus.ON, ApplianceStatus.OFF),
+                (1, 2, 0, ApplianceStatus.OFF, ApplianceStatus.ON)}
+
+    with use_clock(ManualClock(1000)) as clock:
+        asyncio.run(asyncio.wait_for(main(clock), 10))
+
+
+def test_Runtime_errors():
+    commands = []
+    failures = []
+
+    async def sink(transitions):
+        if not failures:
+            failures.append(transitions)
+            raise RuntimeError("Gateway is down")
+        commands.extend(transitions)
+
+    async def main():
+        b = make_building()
+        b.boot()
+        async with Runtime(b, sink) as runtime:
+            # No such floor: Dropped, the others in the batch still count
+            await runtime.submit(99, 0, 0)
+            await runtime.submit(0, 1, 0)
+            await runtime.drain()
+            assert b.get_floor(0).get_corridor(1).get_appliance(
+                1).status == ApplianceStatus.ON
+            assert len(failures) == 1
+            # The sink failing does not stop the next commands going out
+            await runtime.submit(1, 1, 0)
+            await runtime.drain()
+            assert {command.floor for command in commands} == {1}
+
+    with use_clock(ManualClock(1000)):
+        asyncio.run(asyncio.wait_for(main(), 10))
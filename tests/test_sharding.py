@@ -0,0 +1,90 @@
+"""
+Test the sharded controller against a single process
+"""
+
+import pytest
+
+from prana.budget import Lend
+from prana.models import Building
+from prana.sharding import ShardedController
+
+from tests.test_models import make_building
+
+EVENTS = [(0, 0, 1, 0), (0, 1, 2, 0), (1, 1, 1, 0), (1, 0, 2, 0)]
+
+
+def make_buildings():
+    buildings = [make_building(), make_building()]
+    buildings[1].id = 1
+    return buildings
+
+
+def expected():
+    """
+    What a plain old single process would do
+    """
+    buildings = make_buildings()
+    statuses = {}
+    for b in buildings:
+        b.boot()
+    for building_id, floor_id, corridor_id, sensor_id in EVENTS:
+        buildings[building_id].register_activity(
+            floor_id, corridor_id, sensor_id)
+    for b in buildings:
+        for f in b.iter_floors():
+            for c in f.iter_corridors():
+                for a in c.iter_appliances():
+                    statuses[(b.id, f.id, c.id, a.id)] = a.status
+    return statuses
+
+
+def test_ShardedController():
+    statuses = expected()
+    for by in ('floor', 'building'):
+        with ShardedController(make_buildings(), 3, by=by) as controller:
+            controller.boot()
+            summary = controller.register_activities(EVENTS[:2])
+            assert summary['events'] == 2
+            assert summary['floors'] == 2
+            for event in EVENTS[2:]:
+                controller.register_activity(*event)
+            assert controller.statuses() == statuses
+            watts = controller.watts()
+            assert len(watts) == 4
+            assert controller.current_watts() == sum(
+                current for current, _ in watts.values())
+            assert controller.tick() == []
+
+
+def test_attach_floor():
+    """
+    A floor can move to another building, watts & all
+    """
+    b = make_building()
+    b.boot()
+    b.register_activity(1, 1, 0)
+    other = Building(7)
+    floor = other.attach_floor(b.get_floor(1))
+    assert floor.parent is other
+    assert other.current_watts() == floor.current_watts() == 30
+    assert other.dirty_floors() == [floor]
+
+
+def test_ShardedController_budget():
+    """
+    A capped building shares it's feeder alike, sharded or not
+    """
+    for by in ('floor', 'building'):
+        buildings = make_buildings()
+        for b in buildings:
+            b.set_cap(56)
+        with ShardedController(buildings, 3, by=by) as controller:
+            assert {most for _, most in controller.watts().values()} == {28}
+            controller.boot()
+            controller.optimize(full=True)
+            assert set(controller.watts().values()) == {(25, 28)}
+
+    buildings = make_buildings()
+    buildings[0].set_budget_policy(Lend())
+    with pytest.raises(ValueError):
+        ShardedController(buildings, 2)
@@ -0,0 +1,104 @@
+"""
+Test load shedding
+"""
+
+import pickle
+
+from prana.clock import ManualClock, use_clock
+from prana.enums import ApplianceCategory, ApplianceStatus, CorridorCategory, \
+    SensorCategory
+from prana.models import Building
+from prana.shedding import SweepShedder
+
+
+def make_floor(shedder_class=None):
+    """
+    One main & four sub corridors: 55W to spend, 55W spent once booted
+    """
+    b = Building()
+    f = b.add_floor(0)
+    if shedder_class is not None:
+        f.shedder = shedder_class(f)
+    for category in [CorridorCategory.MAIN] + [CorridorCategory.SUB] * 4:
+        c = f.append_corridor(category)
+        c.append_appliance(ApplianceCategory.AC)
+        c.append_appliance(ApplianceCategory.LIGHT)
+        c.append_sensor(SensorCategory.MOTION)
+    b.boot()
+    return b, f
+
+
+def acs(floor):
+    return [
+        corridor.get_appliance(0).status
+        for corridor in floor.iter_corridors()]
+
+
+def test_HeapShedder():
+    ON, OFF = ApplianceStatus.ON, ApplianceStatus.OFF
+    with use_clock(ManualClock(1000)) as clock:
+        b, f = make_floor()
+        assert f.current_watts() == f.max_watts() == 55
+
+        # 5W over, one AC is enough
+        b.register_activity(0, 1, 0)
+        assert acs(f) == [ON, ON, OFF, ON, ON]
+        assert f.current_watts() == 50
+
+        # Back within budget, nothing to do
+        clock.advance(30)
+        b.register_activity(0, 3, 0)
+        assert acs(f) == [ON, ON, OFF, ON, ON]
+        assert f.current_watts() == 55
+
+        # The longest idle corridor goes first
+        clock.advance(10)
+        b.register_activity(0, 4, 0)
+        assert acs(f) == [ON, ON, OFF, ON, ON]
+        clock.advance(25)
+        b.register_activity(0, 4, 0)
+        assert acs(f) == [ON, OFF, OFF, ON, ON]
+        assert f.current_watts() == 50
+        # It takes room for an AC to bring anything back
+        assert f.shedder.room_wanted == 10
+
+        # Room again: Back on it goes, last shed first
+        f.get_corridor(3).get_appliance(1).switch_off()
+        assert f.optimize() == 0
+        assert acs(f) == [ON, ON, OFF, ON, ON]
+        assert f.current_watts() == 55
+
+        # Switched back on behind it's back: Off the stack
+        f.get_corridor(2).get_appliance(0).switch_on()
+        assert f.shedder.room_wanted == float('inf')
+
+        # Defaults once everything times out
+        clock.advance(120)
+        b.tick()
+        assert acs(f) == [ON] * 5
+
+
+def test_HeapShedder_pickle():
+    """
+    Unpickled, what was shed still comes back on
+    """
+    ON, OFF = ApplianceStatus.ON, ApplianceStatus.OFF
+    with use_clock(ManualClock(1000)):
+        b, f = make_floor()
+        b.register_activity(0, 1, 0)
+        b = pickle.loads(pickle.dumps(b))
+        f = b.get_floor(0)
+        assert acs(f) == [ON, ON, OFF, ON, ON]
+        assert f.shedder.room_wanted == 10
+        f.get_corridor(1).get_appliance(1).switch_off()
+        f.optimize()
+        assert acs(f) == [ON] * 5
+
+
+def test_SweepShedder():
+    ON, OFF = ApplianceStatus.ON, ApplianceStatus.OFF
+    with use_clock(ManualClock(1000)):
+        b, f = make_floor(SweepShedder)
+        b.register_activity(0, 1, 0)
+        assert acs(f) == [ON, ON, OFF, OFF, OFF]
+        assert f.current_watts() == 30
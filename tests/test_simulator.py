@@ -0,0 +1,69 @@
+"""
+Test the simulator
+"""
+
+from prana.budget import Lend
+from prana.constants import TIME_SLOT_DAY, TIME_SLOT_NIGHT
+from prana.enums import ApplianceStatus
+from prana.simulator import Simulator, time_slot_at, next_time_slot_change, \
+    read_trace
+
+from tests.test_models import make_building
+
+HOUR = 60 * 60
+
+
+def test_time_slots():
+    assert time_slot_at(0) == TIME_SLOT_NIGHT
+    assert time_slot_at(6 * HOUR) == TIME_SLOT_DAY
+    assert time_slot_at(18 * HOUR) == TIME_SLOT_NIGHT
+    assert next_time_slot_change(0) == 6 * HOUR
+    assert next_time_slot_change(6 * HOUR) == 18 * HOUR
+    assert next_time_slot_change(20 * HOUR) == 30 * HOUR
+
+
+def test_Simulator(tmpdir):
+    """
+    Replay a tiny trace & check where the watts went
+    """
+    trace = tmpdir.join("trace.csv")
+    trace.write("timestamp,floor,corridor,sensor\n1000,0,1,0\n1030,0,1,0\n")
+
+    b = make_building()
+    sim = Simulator(b)
+    target_light = b.get_floor(0).get_corridor(1).get_appliance(1)
+    main_light = b.get_floor(1).get_corridor(0).get_appliance(1)
+
+    # Halfway through the events, nothing has timed out yet
+    sim.run(read_trace(str(trace)), until=1080)
+    assert target_light.status == ApplianceStatus.ON
+
+    # The second event keeps the light on till 1090, then day breaks
+    report = sim.run([], until=7 * HOUR)
+    assert target_light.status == ApplianceStatus.OFF
+    assert main_light.status == ApplianceStatus.OFF
+    assert report['events'] == 2
+    assert report['floors'][0]['timeline'] == [
+        (0, 35), (1000, 30), (1090, 35), (6 * HOUR, 30)]
+
+    # 35W for 6 hours, but 30W for 90s of it. Then 30W for an hour
+    expected = (35 * 6 * HOUR - 5 * 90 + 30 * HOUR) / HOUR
+    assert report['floors'][0]['energy'] == expected
+    assert report['energy'] == expected + (35 * 6 * HOUR + 30 * HOUR) / HOUR
+
+
+def test_Simulator_other_floors():
+    """
+    Floors that shed because of an event elsewhere are recorded as well
+    """
+    b = make_building()
+    sim = Simulator(b)
+    b.set_budget_policy(Lend())
+    # Floor 0 sheds an AC, floor 1 borrows what that left over
+    sim.run([(1000, 0, 1, 0), (1010, 1, 1, 0)])
+    assert b.get_floor(1).current_watts() == 40
+    # Floor 0 wants it back
+    report = sim.run([(1020, 0, 2, 0)])
+    assert b.get_floor(1).current_watts() == 30
+    assert report['floors'][1]['timeline'] == [
+        (0, 35), (1010, 40), (1020, 30)]
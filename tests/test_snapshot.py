@@ -0,0 +1,66 @@
+"""
+Test binary snapshots
+"""
+
+import pytest
+
+from prana.clock import ManualClock, use_clock
+from prana.snapshot import dump, load
+
+from tests.test_models import make_building
+
+
+def test_snapshot(tmp_path):
+    path = str(tmp_path / 'building')
+    with use_clock(ManualClock(1000)) as clock:
+        b = make_building()
+        b.boot()
+        b.register_activity(0, 1, 0)
+        clock.advance(10)
+        dump(b, path, offset=0)
+
+        loaded = load(path, offset=0)
+        # Floor 1 is idle, no need to build it till it is asked for
+        assert list(loaded._unmapped) == [1]
+        assert loaded.current_watts() == b.current_watts()
+        # It's budget is there all the same
+        assert loaded.cap() == b.cap()
+        assert loaded.get_floor(0).max_watts() == 35
+        assert loaded.next_expiry() == b.next_expiry()
+        assert loaded.get_floor(1).current_watts() == \
+            b.get_floor(1).current_watts()
+        assert loaded.snapshot() == b.snapshot()
+        assert loaded.cap() == b.cap()
+
+        # And it carries on like any other building
+        clock.advance(60)
+        assert [floor.id for floor in loaded.tick()] == [0]
+        b.tick()
+        assert loaded.snapshot() == b.snapshot()
+        loaded.close()
+
+        with open(path, 'r+b') as snapshot:
+            snapshot.seek(4)
+            snapshot.write(b'\x09')
+        with pytest.raises(ValueError):
+            load(path)
+
+
+def test_snapshot_shed(tmp_path):
+    """
+    What was shed comes back on once there is room, loaded or not
+    """
+    path = str(tmp_path / 'building')
+    with use_clock(ManualClock(1000)):
+        b = make_building()
+        b.boot()
+        b.register_activity(0, 1, 0)
+        dump(b, path, offset=0)
+        loaded = load(path, offset=0)
+        for building in (b, loaded):
+            assert building.get_floor(0).current_watts() == 30
+            building.get_floor(0).set_cap(40)
+            building.optimize()
+        assert loaded.snapshot() == b.snapshot()
+        assert loaded.get_floor(0).current_watts() == 40
+        loaded.close()
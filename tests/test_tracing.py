@@ -0,0 +1,56 @@
+"""
+Test tracing
+"""
+
+import json
+
+from prana.clock import ManualClock, use_clock
+from prana.tracing import Tracer
+
+from tests.test_models import make_building
+
+
+def test_Tracer(tmp_path):
+    path = str(tmp_path / 'trace.json')
+    with use_clock(ManualClock(1000)):
+        b = make_building()
+        b.boot()
+        with Tracer(path) as tracer:
+            tracer.watch(b)
+            b.register_activity(0, 1, 0)
+    with open(path) as source:
+        events = json.load(source)
+
+    assert events[0]['ph'] == 'M'
+    spans = {event['name']: event for event in events[1:]}
+    assert sorted(spans) == [
+        'commit', 'floor.optimize', 'register_activity', 'shed', 'switch_on']
+    assert {event['args']['trace'] for event in events[1:]} == {1}
+    assert len({event['tid'] for event in events[1:]}) == 1
+    # Light on where the motion was, AC off where there was none
+    whole = spans['register_activity']
+    assert whole['args']['transitions'] == [[0, 1, 1, 2, 1], [0, 2, 0, 1, 2]]
+    assert spans['commit']['args']['transitions'] == 2
+    assert spans['floor.optimize']['args']['shed'] == 1
+    # Every stage falls within the whole
+    for span in spans.values():
+        assert span['ts'] >= whole['ts']
+        assert span['ts'] + span['dur'] <= whole['ts'] + whole['dur'] + 1e-3
+
+
+def test_Tracer_sampling(tmp_path):
+    with use_clock(ManualClock(1000)):
+        b = make_building()
+        b.boot()
+        with Tracer(str(tmp_path / 'none.json'), sample_rate=0) as off:
+            off.watch(b)
+            for _ in range(10):
+                b.register_activity(0, 1, 0)
+        with Tracer(
+                str(tmp_path / 'some.json'), sample_rate=0.5,
+                seed=1) as some:
+            some.watch(b)
+            for _ in range(100):
+                b.register_activity(0, 1, 0)
+    assert off.traces == 0
+    assert 20 < some.traces < 80